@@ -7,17 +7,38 @@ Com super tabela interativa
 
 import pandas as pd
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import sqlite3
 import os
+import sys
 import warnings
 import logging
 import hashlib
+import json
+import threading
+import time
+import re
+import bisect
+import urllib.request
+from io import BytesIO
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from collections import OrderedDict, namedtuple
 from pathlib import Path
+import numpy as np
 from streamlit_option_menu import option_menu
+from leitura_pagamentos import (
+    LINHAS_POR_BLOCO_IMPORTACAO, abas_de_pagamento, contar_linhas_excel, ler_aba, ler_excel_em_blocos
+)
+from mapeamento_colunas import MAPEADOR_BOLSISTAS, MAPEADOR_PAGAMENTOS, MAPEADOR_COLABORADORES, normalizar_cabecalho
 warnings.filterwarnings('ignore')
+# Os DataFrames compartilhados entre sessões saem como visões somente leitura (_visao_somente_leitura):
+# escrever numa delas só é seguro com Copy-on-Write, que é padrão a partir do pandas 3
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # ---------------------------------------------------------------------------
 # Logging configuration
@@ -170,26 +191,27 @@ def logout():
 # ---------------------------------------------------------------------------
 # Backup Automático e Integração
 # ---------------------------------------------------------------------------
+def _copiar_banco(pasta="backups", manter=10):
+    """Copia o banco para `pasta` e devolve o caminho da cópia; com `manter`, apaga as mais antigas além desse número."""
+    import shutil
+
+    os.makedirs(pasta, exist_ok=True)
+    # Microssegundos: ações em lote seguidas não sobrescrevem o backup uma da outra
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    backup_file = os.path.join(pasta, f"bolsas_{timestamp}.db")
+    shutil.copy2("bolsas.db", backup_file)
+    if manter:
+        backups = sorted([os.path.join(pasta, f) for f in os.listdir(pasta) if f.endswith(".db")])
+        while len(backups) > manter:
+            os.remove(backups.pop(0))
+    return backup_file
+
 def backup_database():
     """Cria um backup do banco de dados antes de alterações críticas"""
-    import shutil
-    import os
-    from datetime import datetime
-    
-    if not os.path.exists("backups"):
-        os.makedirs("backups")
-        
-    db_file = "bolsas.db"
-    if os.path.exists(db_file):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = f"backups/bolsas_{timestamp}.db"
+    if os.path.exists("bolsas.db"):
         try:
-            shutil.copy2(db_file, backup_file)
             # Manter apenas os ultimos 10 backups para não lotar disco
-            backups = sorted([os.path.join("backups", f) for f in os.listdir("backups") if f.endswith(".db")])
-            while len(backups) > 10:
-                os.remove(backups.pop(0))
-            return True, f"Backup criado: {backup_file}"
+            return True, f"Backup criado: {_copiar_banco('backups', manter=10)}"
         except Exception as e:
             return False, f"Falha no backup: {e}"
     return False, "Banco não encontrado"
@@ -240,58 +262,279 @@ LOCAL_PATHS = {
     "BOLSAS": "BASES.BOLSAS/BASE.BOLSAS.2025.xlsx"
 }
 
-@st.cache_data(ttl=300)
-def get_dataset(source_key):
-    """
-    Carrega dados de uma fonte (Google Sheets ou Local).
-    Prioridade: Google Sheets > Excel Local.
-    """
-    df = pd.DataFrame()
-    source_name = f"Google Sheets ({source_key})"
-    
-    # 1. Tentar Google Sheets
-    try:
-        url = GSHEETS_URLS.get(source_key)
-        if url:
-             logger.info(f"Tentando conectar ao Google Sheets: {source_key}...")
-             # Conexão usa st.secrets automaticamente se configurado, ou o public URL se for público
-             conn = st.connection("gsheets", type=GSheetsConnection)
-             # Tenta ler. Se falhar, vai pro except.
-             df = conn.read(spreadsheet=url)
-             
-             if not df.empty:
-                 logger.info(f"Dados carregados do Google Sheets: {source_key} | Shape: {df.shape}")
-             else:
-                 logger.warning(f"Google Sheets retornou dados vazios para: {source_key}")
-    except Exception as e:
-        logger.warning(f"Falha ao conectar Google Sheets [{source_key}]: {e}. Tentando local...")
-        # st.warning(f"Falha na conexão com Google Sheets ({source_key}): {e}") # Opcional: mostrar pro usuário
-        df = pd.DataFrame() # Reset para garantir fallback
-
-    # 2. Fallback para Excel Local se falhou ou vazio
-    if df.empty:
-        local_path = LOCAL_PATHS.get(source_key)
-        if local_path and os.path.exists(local_path):
-            source_name = f"Excel Local ({local_path})"
-            df = safe_read_excel(local_path)
-            logger.info(f"Dados carregados localmente: {local_path} | Shape: {df.shape}")
-        else:
-            logger.warning(f"Arquivo local não encontrado: {local_path}")
-    
-    # 3. Limpeza Padrão (Trim headers) e validação
+# Endpoint de exportação CSV do Google Sheets (configurável para apontar para um servidor local nos testes)
+GSHEETS_EXPORT_BASE = os.environ.get("BOLSAS_SHEETS_BASE", "https://docs.google.com")
+# Prazo máximo (s) que a página espera por cada fonte remota antes de usar a última cópia boa
+PRAZO_FONTE_SEGUNDOS = float(os.environ.get("BOLSAS_PRAZO_FONTE", "4"))
+# Validade (s) da última cópia boa antes de buscar de novo
+TTL_FONTE_SEGUNDOS = 300
+
+def _url_exportacao_csv(url):
+    """Converte o link de edição da planilha no endpoint /export?format=csv da aba (gid)."""
+    m = re.search(r"/spreadsheets/d/([^/]+)", url)
+    if not m:
+        return None
+    gid = re.search(r"gid=(\d+)", url)
+    return f"{GSHEETS_EXPORT_BASE}/spreadsheets/d/{m.group(1)}/export?format=csv&gid={gid.group(1) if gid else 0}"
+
+def _buscar_planilha_remota(source_key, prazo):
+    """Busca a planilha pelo export CSV; se não for possível, tenta o GSheetsConnection."""
+    url = GSHEETS_URLS.get(source_key)
+    if not url:
+        return pd.DataFrame()
+    url_csv = _url_exportacao_csv(url)
+    if url_csv:
+        try:
+            with urllib.request.urlopen(url_csv, timeout=prazo) as resp:
+                # Planilha privada redireciona para a página de login (HTML)
+                if 'text/html' in resp.headers.get('Content-Type', ''):
+                    raise ValueError("planilha não é pública (resposta HTML)")
+                conteudo = resp.read()
+            return pd.read_csv(BytesIO(conteudo))
+        except Exception as e:
+            logger.warning(f"Export CSV indisponível [{source_key}]: {e}. Tentando GSheetsConnection...")
+    conn = st.connection("gsheets", type=GSheetsConnection)
+    return conn.read(spreadsheet=url)
+
+def _ler_fonte_local(source_key):
+    local_path = LOCAL_PATHS.get(source_key)
+    if local_path and os.path.exists(local_path):
+        df = safe_read_excel(local_path)
+        logger.info(f"Dados carregados localmente: {local_path} | Shape: {df.shape}")
+        return df
+    logger.warning(f"Arquivo local não encontrado: {local_path}")
+    return pd.DataFrame()
+
+def _limpar_dataset(df):
+    """Limpeza padrão: trim dos cabeçalhos e remoção de colunas vazias."""
     if not df.empty:
-        # Converter colunas para string e remover espaços
         df.columns = [str(c).strip() for c in df.columns]
-        # Remover colunas vazias se houver
         df = df.dropna(how='all', axis=1)
-    
     return df
 
-@st.cache_data(ttl=300)
+# Snapshots em disco da última leitura boa de cada fonte remota (sobrevivem a reinícios)
+PASTA_SNAPSHOTS = "snapshots"
+ORIGEM_SHEETS = 'Google Sheets'
+ORIGEM_LOCAL = 'Excel local'
+
+# O que uma leitura entregou: o DataFrame compartilhado (somente leitura), de onde veio e de quando
+# é (hora da busca no Sheets ou mtime do Excel). `versao` serve de chave barata para caches derivados.
+class FonteCarregada(namedtuple('FonteCarregada', 'df origem atualizado_em')):
+    __slots__ = ()
+
+    @property
+    def versao(self):
+        return (self.origem, self.atualizado_em)
+
+class CarregadorFontes:
+    """
+    Fontes remotas (ORGANOGRAMA, PAGAMENTOS, BOLSAS) no modelo stale-while-revalidate.
+    Cada fonte mantém um snapshot local da última leitura boa (memória + disco) com a hora
+    da busca. Quem lê recebe o snapshot na hora; se ele passou do TTL, uma única atualização
+    por fonte roda em segundo plano (trava de atualização), por mais sessões que peçam.
+    Só quando ainda não existe snapshot a leitura espera a rede, limitada ao prazo da fonte.
+    """
+
+    def __init__(self, max_workers=4, pasta_snapshots=PASTA_SNAPSHOTS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fontes")
+        self._pasta = pasta_snapshots
+        self._lock = threading.Lock()
+        self._ultima_boa = {}     # source_key -> (DataFrame, buscado_em)
+        self._atualizando = {}    # source_key -> Future (trava de atualização por fonte)
+        self._ultima_falha = {}   # source_key -> timestamp (evita martelar a rede quando está fora)
+        self._locais = {}         # source_key -> (mtime, DataFrame) do Excel local
+        self._entregas = {}       # source_key -> FonteCarregada da última leitura (para estado())
+        self._vencidas = set()    # fontes marcadas para atualizar já (botão "Atualizar Dados")
+
+    def _caminho_snapshot(self, source_key):
+        return os.path.join(self._pasta, f"{source_key}.pkl")
+
+    def _salvar_snapshot(self, source_key, df, buscado_em):
+        try:
+            os.makedirs(self._pasta, exist_ok=True)
+            caminho = self._caminho_snapshot(source_key)
+            # Grava num temporário e troca de uma vez para nunca deixar um snapshot pela metade
+            pd.to_pickle({'df': df, 'buscado_em': buscado_em}, caminho + ".tmp")
+            os.replace(caminho + ".tmp", caminho)
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar o snapshot de {source_key}: {e}")
+
+    def _snapshot(self, source_key):
+        """Última cópia boa: memória; na primeira leitura do processo, o arquivo em disco."""
+        with self._lock:
+            item = self._ultima_boa.get(source_key)
+        if item:
+            return item
+        caminho = self._caminho_snapshot(source_key)
+        if not os.path.exists(caminho):
+            return None
+        try:
+            dados = pd.read_pickle(caminho)
+            item = (_congelar(dados['df']), dados['buscado_em'])
+        except Exception as e:
+            logger.warning(f"Snapshot de {source_key} ilegível: {e}")
+            return None
+        with self._lock:
+            self._ultima_boa.setdefault(source_key, item)
+            return self._ultima_boa[source_key]
+
+    def _buscar(self, source_key):
+        try:
+            df = _limpar_dataset(_buscar_planilha_remota(source_key, PRAZO_FONTE_SEGUNDOS * 5))
+            if df.empty:
+                raise ValueError("fonte remota vazia")
+        except Exception:
+            with self._lock:
+                self._ultima_falha[source_key] = datetime.now()
+            raise
+        logger.info(f"Dados carregados do Google Sheets: {source_key} | Shape: {df.shape}")
+        buscado_em = datetime.now()
+        _congelar(df)  # compartilhado entre sessões: ninguém escreve nos dados
+        with self._lock:
+            self._ultima_boa[source_key] = (df, buscado_em)
+            self._ultima_falha.pop(source_key, None)
+            self._vencidas.discard(source_key)
+        self._salvar_snapshot(source_key, df, buscado_em)
+        return df
+
+    def _disparar(self, source_key):
+        """Inicia a atualização da fonte, ou reaproveita a que já está em curso."""
+        with self._lock:
+            futuro = self._atualizando.get(source_key)
+            if futuro is None or futuro.done():
+                futuro = self._executor.submit(self._buscar, source_key)
+                self._atualizando[source_key] = futuro
+            return futuro
+
+    def _pode_buscar(self, source_key):
+        if source_key not in GSHEETS_URLS:
+            return False
+        with self._lock:
+            falha = self._ultima_falha.get(source_key)
+        return falha is None or (datetime.now() - falha).total_seconds() >= 60
+
+    def _local(self, source_key):
+        """Excel local, relido apenas quando o arquivo muda: (mtime, DataFrame)."""
+        caminho = LOCAL_PATHS.get(source_key)
+        mtime = os.path.getmtime(caminho) if caminho and os.path.exists(caminho) else None
+        with self._lock:
+            item = self._locais.get(source_key)
+        if item and item[0] == mtime:
+            return item
+        item = (mtime, _congelar(_limpar_dataset(_ler_fonte_local(source_key))))
+        with self._lock:
+            self._locais[source_key] = item
+        return item
+
+    def expirar(self):
+        """Marca os snapshots como vencidos: a próxima leitura dispara a atualização."""
+        with self._lock:
+            self._vencidas.update(GSHEETS_URLS)
+            self._ultima_falha.clear()
+            self._locais.clear()
+
+    def carregar_versionado(self, chaves, prazo=None):
+        """Carrega várias fontes ao mesmo tempo; devolve {chave: FonteCarregada}."""
+        prazo = PRAZO_FONTE_SEGUNDOS if prazo is None else prazo
+        resultado, futuros = {}, {}
+        for chave in chaves:
+            snapshot = self._snapshot(chave)
+            if snapshot is not None:
+                # Entrega o snapshot na hora; se venceu, atualiza em segundo plano
+                resultado[chave] = FonteCarregada(snapshot[0], ORIGEM_SHEETS, snapshot[1])
+                vencido = chave in self._vencidas or (datetime.now() - snapshot[1]).total_seconds() >= TTL_FONTE_SEGUNDOS
+                if vencido and self._pode_buscar(chave):
+                    self._disparar(chave)
+            elif self._pode_buscar(chave):
+                futuros[chave] = self._disparar(chave)
+        limite = time.monotonic() + prazo
+        for chave, futuro in futuros.items():
+            try:
+                futuro.result(timeout=max(0.0, limite - time.monotonic()))
+                snapshot = self._snapshot(chave)
+                resultado[chave] = FonteCarregada(snapshot[0], ORIGEM_SHEETS, snapshot[1])
+            except FuturesTimeout:
+                logger.warning(f"Google Sheets [{chave}] excedeu {prazo:.0f}s; usando Excel local e atualizando em segundo plano.")
+            except Exception as e:
+                logger.warning(f"Falha ao conectar Google Sheets [{chave}]: {e}. Tentando local...")
+        for chave in chaves:
+            if chave not in resultado:
+                mtime, df = self._local(chave)
+                resultado[chave] = FonteCarregada(df, ORIGEM_LOCAL, datetime.fromtimestamp(mtime) if mtime else None)
+        with self._lock:
+            self._entregas.update(resultado)
+        return resultado
+
+    def carregar(self, chaves, prazo=None):
+        """Carrega várias fontes ao mesmo tempo; devolve {chave: DataFrame} (compartilhados, somente leitura)."""
+        return {chave: fonte.df for chave, fonte in self.carregar_versionado(chaves, prazo).items()}
+
+    def estado(self, entregues=None):
+        """
+        Origem, hora dos dados e se há atualização em curso, por fonte (para a interface).
+        `entregues` ({chave: FonteCarregada}) descreve o que a sessão recebeu; sem ele, vale a última entrega do processo.
+        """
+        with self._lock:
+            entregues = dict(self._entregas, **(entregues or {}))
+            atualizando = {chave: futuro is not None and not futuro.done() for chave, futuro in self._atualizando.items()}
+        return {
+            chave: {
+                'origem': fonte.origem,
+                'atualizado_em': fonte.atualizado_em,
+                'atualizando': atualizando.get(chave, False),
+            }
+            for chave, fonte in entregues.items() if chave in GSHEETS_URLS
+        }
+
+@st.cache_resource
+def obter_carregador_fontes():
+    """Carregador único por processo (compartilhado entre as sessões)."""
+    return CarregadorFontes(max_workers=len(GSHEETS_URLS) + 1)
+
+def carregar_fontes(*chaves):
+    """Dispara todas as fontes pedidas em paralelo (padrão: todas as configuradas)."""
+    return obter_carregador_fontes().carregar(chaves or tuple(GSHEETS_URLS))
+
+def carregar_fontes_versionadas(*chaves):
+    """Como carregar_fontes, com origem e versão de cada fonte ({chave: FonteCarregada})."""
+    return obter_carregador_fontes().carregar_versionado(chaves or tuple(GSHEETS_URLS))
+
+def descrever_idade(quando):
+    """Idade dos dados em texto curto ("agora", "há 5 min", "há 2 h", "há 3 dias")."""
+    if quando is None:
+        return "idade desconhecida"
+    segundos = max(0, (datetime.now() - quando).total_seconds())
+    if segundos < 60:
+        return "agora"
+    if segundos < 3600:
+        return f"há {int(segundos // 60)} min"
+    if segundos < 86400:
+        return f"há {int(segundos // 3600)} h"
+    return f"há {int(segundos // 86400)} dias"
+
+def render_idade_fontes(entregues=None):
+    """Mostra de onde veio cada fonte que a sessão recebeu e há quanto tempo foi buscada."""
+    for chave, info in obter_carregador_fontes().estado(entregues).items():
+        sufixo = " · 🔄 atualizando" if info['atualizando'] else ""
+        st.caption(f"📡 {chave.title()}: {info['origem']} · {descrever_idade(info['atualizado_em'])}{sufixo}")
+
+def get_dataset(source_key):
+    """
+    Carrega dados de uma fonte (Google Sheets ou Local).
+    Prioridade: snapshot da última leitura boa do Google Sheets > Excel Local.
+    Devolve uma visão somente leitura do DataFrame compartilhado (sem cópia dos dados).
+    """
+    return _visao_somente_leitura(carregar_fontes(source_key)[source_key])
+
 def carregar_organograma():
     """Carrega o organograma com mapeamento Cod. Local -> Diretoria, Gestor N3, Gestor N4"""
     return get_dataset("ORGANOGRAMA")
 
+def carregar_organograma_versionado():
+    """(organograma, versão): a versão (origem, hora da leitura) é a chave barata dos caches derivados."""
+    fonte = carregar_fontes_versionadas("ORGANOGRAMA")["ORGANOGRAMA"]
+    return _visao_somente_leitura(fonte.df), fonte.versao
+
 def get_organograma_mapping(df_org):
     """Cria um cache do organograma focado em Cod. Local -> Diretoria (Coluna C FÍSICA)"""
     if df_org.empty:
@@ -326,6 +569,9 @@ def get_organograma_mapping(df_org):
             
     return dict(sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True))
 
+# Textos usados nas planilhas no lugar de um código local
+CODIGOS_LOCAL_SEM_VALOR = ['SEM CODIGO LOCAL', 'SEM CÓDIGO LOCAL', 'N/A', 'N/D', 'NAN', 'NONE', '']
+
 def buscar_info_organograma_fast(cod_local, mapping):
     """Versão otimizada usando cache de dicionário mantendo a estrutura original do código"""
     if not cod_local or not mapping:
@@ -335,7 +581,7 @@ def buscar_info_organograma_fast(cod_local, mapping):
     cl = str(cod_local).strip()
     
     # Tratar códigos inválidos explicitamente
-    if cl.upper() in ['SEM CODIGO LOCAL', 'SEM CÓDIGO LOCAL', 'N/A', 'N/D', 'NAN', 'NONE', '']:
+    if cl.upper() in CODIGOS_LOCAL_SEM_VALOR:
         return "N/D", "N/D", "N/D"
 
     # 1. Busca Exata
@@ -366,11 +612,11 @@ def buscar_info_organograma_fast(cod_local, mapping):
             
     return "N/D", "N/D", "N/D"
 
-def enriquecer_com_organograma(df, df_org):
+def enriquecer_com_organograma(df, df_org, versao_org=None):
     """Enriquece um DataFrame de bolsistas com dados do organograma usando Cod. Local"""
     if df_org.empty or len(df) == 0:
         return df
-    
+
     # Garantir cod_local existe
     if 'cod_local' not in df.columns:
         df['cod_local'] = None
@@ -378,27 +624,21 @@ def enriquecer_com_organograma(df, df_org):
     # Normalizar diretoria existente (tratar N/D, N/A, None, etc como NaN para o combine_first)
     if 'diretoria' in df.columns:
         df['diretoria'] = df['diretoria'].astype(str).replace(['N/D', 'N/A', 'None', 'nan', '', 'nan'], None)
-    
-    mapping = get_organograma_mapping(df_org)
-    
-    diretorias_org = []
-    gestores_n3 = []
-    gestores_n4 = []
-    
-    for _, row in df.iterrows():
-        cl = str(row.get('cod_local', '')).strip()
+
+    mapping = obter_indice_organograma(df_org, versao_org)
+
+    # Resolver cada Cod. Local distinto uma única vez (há muitos bolsistas por local)
+    codigos = df['cod_local'].astype(str).str.strip()
+    resolvidos = {}
+    for cl in codigos.unique():
         if cl and cl not in ['None', 'nan', '']:
-            d, g3, g4 = buscar_info_organograma_fast(cl, mapping)
+            resolvidos[cl] = buscar_info_organograma_fast(cl, mapping)
         else:
-            d, g3, g4 = None, None, None
-            
-        diretorias_org.append(d)
-        gestores_n3.append(g3)
-        gestores_n4.append(g4)
-    
-    df['diretoria_org'] = diretorias_org
-    df['gestor_n3'] = gestores_n3
-    df['gestor_n4'] = gestores_n4
+            resolvidos[cl] = (None, None, None)
+
+    df['diretoria_org'] = codigos.map(lambda c: resolvidos[c][0])
+    df['gestor_n3'] = codigos.map(lambda c: resolvidos[c][1])
+    df['gestor_n4'] = codigos.map(lambda c: resolvidos[c][2])
     
     # Usar diretoria do organograma como prioridade se encontrada
     if 'diretoria' in df.columns:
@@ -418,29 +658,618 @@ def get_conn() -> sqlite3.Connection:
     """Abre e devolve uma conexão SQLite."""
     return sqlite3.connect(DB_PATH)
 
+# ---------------------------------------------------------------------------
+# Schemas Tipados (dtypes compactos já na leitura do banco)
+# ---------------------------------------------------------------------------
+# Tipos: 'texto' (mantém), 'categoria' (strip), 'categoria_maiuscula' (strip + upper),
+# 'int16'/'int32' (inteiros compactos), 'float64' (valores) e 'data' (datetime64).
+SCHEMA_HISTORICO_PAGAMENTOS = {
+    'id': 'int32',
+    'matricula': 'texto',
+    'nome': 'texto',
+    'mes': 'int16',
+    'ano': 'int16',
+    'mes_referencia': 'categoria',
+    'valor': 'float64',
+    'data_pagamento': 'data',
+    'cod_local': 'categoria',
+    'diretoria': 'categoria_maiuscula',
+    'safra': 'categoria',
+    'origem': 'categoria',
+}
+
+SCHEMA_BOLSISTAS = {
+    'id': 'int32',
+    'matricula': 'texto',
+    'nome': 'texto',
+    'diretoria': 'categoria_maiuscula',
+    'cod_local': 'categoria',
+    'tipo': 'categoria_maiuscula',
+    'modalidade': 'categoria_maiuscula',
+    'situacao': 'categoria_maiuscula',
+    'checagem': 'categoria_maiuscula',
+    'inicio_curso': 'data',
+    'fim_curso': 'data',
+    'data_cadastro': 'data',
+    'mensalidade': 'float64',
+    'porcentagem': 'float64',
+    'valor_reembolso': 'float64',
+}
+
+def aplicar_schema(df, schema):
+    """Converte as colunas presentes no DataFrame para os dtypes compactos do schema."""
+    for col, tipo in schema.items():
+        if col not in df.columns:
+            continue
+        serie = df[col]
+        if tipo in ('categoria', 'categoria_maiuscula'):
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                continue
+            # Normaliza apenas os valores distintos e monta a categoria de uma vez
+            mapa = {}
+            for v in serie.dropna().unique():
+                t = str(v).strip()
+                if tipo == 'categoria_maiuscula':
+                    t = t.upper()
+                mapa[v] = t if t else None
+            df[col] = pd.Categorical(serie.map(mapa))
+        elif tipo in ('int16', 'int32'):
+            numeros = pd.to_numeric(serie, errors='coerce')
+            df[col] = numeros.astype(tipo.capitalize() if numeros.isna().any() else tipo)
+        elif tipo == 'float64':
+            df[col] = pd.to_numeric(serie, errors='coerce').astype('float64')
+        elif tipo == 'data':
+            df[col] = pd.to_datetime(serie, errors='coerce')
+    return df
+
+def ler_sql_tipado(query, conn, schema, params=None):
+    """pd.read_sql_query que já devolve as colunas com os dtypes do schema."""
+    df = pd.read_sql_query(query, conn, params=params)
+    return aplicar_schema(df, schema)
+
+def ler_sql_em_blocos(query, params=None, schema=None, tamanho=20000):
+    """Percorre o resultado da consulta em blocos de DataFrame (cursor), sem materializar tudo."""
+    conn = get_conn()
+    try:
+        for bloco in pd.read_sql_query(query, conn, params=params, chunksize=tamanho):
+            yield aplicar_schema(bloco, schema) if schema else bloco
+    finally:
+        conn.close()
+
+# ---------------------------------------------------------------------------
+# Cache Compartilhado entre Sessões (uma cópia por processo)
+# ---------------------------------------------------------------------------
+# Orçamento de memória do cache (MB). Pode ser ajustado por variável de ambiente no servidor.
+CACHE_ORCAMENTO_MB = int(os.environ.get("BOLSAS_CACHE_MB", "256"))
+
+def _medir_bytes(obj):
+    """Mede a memória ocupada por um item do cache (DataFrames via memory_usage deep)."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sys.getsizeof(k) + _medir_bytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_medir_bytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+def _congelar(obj):
+    """Marca os arrays de um DataFrame como somente leitura antes de compartilhá-lo."""
+    if isinstance(obj, pd.DataFrame):
+        for arr in getattr(obj._mgr, "arrays", []):
+            if isinstance(arr, np.ndarray):
+                arr.flags.writeable = False
+    return obj
+
+def _visao_somente_leitura(obj):
+    """Devolve uma visão do item em cache que não altera a cópia compartilhada."""
+    if isinstance(obj, pd.DataFrame):
+        # Cópia rasa: adicionar colunas é permitido, escrever nos dados existentes não
+        return obj.copy(deep=False)
+    if isinstance(obj, dict):
+        from types import MappingProxyType
+        return MappingProxyType(obj)
+    return obj
+
+class CacheCompartilhado:
+    """
+    Cache LRU do processo, compartilhado por todas as sessões do Streamlit.
+    As chaves são tuplas (nome, versão, *parâmetros); ao gravar uma nova versão
+    de um nome, as versões antigas são descartadas. O tamanho de cada item é
+    medido com memory_usage(deep=True) e o LRU é despejado quando o orçamento estoura.
+    """
+
+    def __init__(self, orcamento_bytes):
+        self.orcamento_bytes = orcamento_bytes
+        self._itens = OrderedDict()  # chave -> (valor, bytes)
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._locks_construcao = {}
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave, construtor):
+        """Devolve o item da chave, construindo-o uma única vez mesmo com sessões concorrentes."""
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return _visao_somente_leitura(self._itens[chave][0])
+            lock_chave = self._locks_construcao.setdefault(chave, threading.Lock())
+
+        with lock_chave:
+            # Outra sessão pode ter construído o item enquanto esperávamos
+            with self._lock:
+                if chave in self._itens:
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    return _visao_somente_leitura(self._itens[chave][0])
+                self.faltas += 1
+            try:
+                valor = self._guardar(chave, construtor())
+            finally:
+                with self._lock:
+                    self._locks_construcao.pop(chave, None)
+        return _visao_somente_leitura(valor)
+
+    def consultar(self, chave):
+        """O item da chave se ainda estiver no cache, sem construir; senão None."""
+        with self._lock:
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return _visao_somente_leitura(self._itens[chave][0])
+
+    def _guardar(self, chave, valor):
+        valor = _congelar(valor)
+        tamanho = _medir_bytes(valor)
+        with self._lock:
+            # Uma cópia por nome/parâmetros: versões antigas saem do cache
+            for antiga in [k for k in self._itens if k[0] == chave[0] and k[2:] == chave[2:] and k != chave]:
+                self._remover(antiga)
+            if tamanho > self.orcamento_bytes:
+                logger.warning(f"Cache: item {chave[0]} ({tamanho / 1e6:.1f} MB) excede o orçamento e não será guardado.")
+                return valor
+            self._itens[chave] = (valor, tamanho)
+            self._total_bytes += tamanho
+            while self._total_bytes > self.orcamento_bytes and self._itens:
+                despejada = next(iter(self._itens))
+                logger.info(f"Cache: despejando {despejada[0]} (LRU) para respeitar o orçamento.")
+                self._remover(despejada)
+        return valor
+
+    def _remover(self, chave):
+        _, tamanho = self._itens.pop(chave)
+        self._total_bytes -= tamanho
+
+    def invalidar(self, nome=None):
+        """Remove todos os itens (ou apenas os do nome informado)."""
+        with self._lock:
+            for chave in [k for k in self._itens if nome is None or k[0] == nome]:
+                self._remover(chave)
+
+    def estatisticas(self):
+        """Resumo de uso para o painel de configurações."""
+        with self._lock:
+            return {
+                'itens': len(self._itens),
+                'mb_usados': self._total_bytes / 1e6,
+                'mb_orcamento': self.orcamento_bytes / 1e6,
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+            }
+
+@st.cache_resource
+def obter_cache_compartilhado():
+    """Instância única do cache no processo (sobrevive aos reruns e é comum a todas as sessões)."""
+    return CacheCompartilhado(CACHE_ORCAMENTO_MB * 1024 * 1024)
+
+def versao_dados(*tabelas):
+    """
+    Versão atual das tabelas informadas. Muda a cada escrita (triggers em versoes_dados);
+    historico_pagamentos também considera o MAX(id), pois é regravado em lote pelos importadores.
+    """
+    conn = get_conn()
+    try:
+        versoes = dict(conn.execute("SELECT tabela, versao FROM versoes_dados").fetchall())
+        res = []
+        for t in tabelas:
+            v = versoes.get(t, 0)
+            if t == 'historico_pagamentos':
+                v = (v, conn.execute("SELECT MAX(id) FROM historico_pagamentos").fetchone()[0])
+            res.append(v)
+        return tuple(res)
+    except sqlite3.Error:
+        return tuple(None for _ in tabelas)
+    finally:
+        conn.close()
+
+def registrar_alteracao(conn, tabela):
+    """Incrementa manualmente a versão de uma tabela (usado nas cargas em lote sem trigger)."""
+    conn.execute("UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = ?", (tabela,))
+
+def _assinatura_dataframe(df):
+    """Assinatura barata do conteúdo de um DataFrame pequeno (ex.: organograma)."""
+    if df is None or df.empty:
+        return (0,)
+    return (len(df), tuple(df.columns), int(pd.util.hash_pandas_object(df.astype(str), index=False).sum()))
+
+def obter_indice_organograma(df_org, versao=None):
+    """
+    Índice Cod. Local -> diretoria/gestores, construído uma vez por versão do organograma.
+    `versao` vem de carregar_organograma_versionado(); sem ela, o conteúdo do DataFrame é assinado.
+    """
+    if df_org is None or df_org.empty:
+        return {}
+    chave = ("organograma_indice", versao if versao is not None else _assinatura_dataframe(df_org))
+    return obter_cache_compartilhado().obter(chave, lambda: get_organograma_mapping(df_org))
+
+# ---------------------------------------------------------------------------
+# Diretório de Colaboradores (organograma indexado por matrícula e por nome)
+# ---------------------------------------------------------------------------
+LIMITE_SUGESTOES_COLABORADORES = 20
+CAMPOS_PREENCHIMENTO_DIRETORIO = ('nome', 'cod_local', 'diretoria')
+# Textos que os importadores gravam quando a planilha não trouxe o campo
+VALORES_VAZIOS_DIRETORIO = {'', 'NAN', 'NONE', 'N/A', 'N/D', 'NÃO INFORMADO'}
+
+def chave_matricula(valor):
+    """Matrícula como chave do diretório: texto sem espaços e sem o '.0' que o Excel põe em números."""
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return ""
+    texto = str(valor).strip()
+    return texto[:-2] if texto.endswith('.0') else texto
+
+class DiretorioColaboradores:
+    """
+    Colaboradores do organograma indexados uma única vez: dicionário matrícula -> registro
+    (busca e preenchimento em O(1)) e nomes normalizados em ordem para a busca por prefixo (bisect).
+    Os registros usam as colunas de MAPEADOR_COLABORADORES; vale a primeira linha de cada matrícula.
+    """
+
+    def __init__(self, df_org, mapping=None):
+        self._registros, self._nomes, self._chaves_nome = {}, [], []
+        dados = MAPEADOR_COLABORADORES.aplicar(df_org)[0] if df_org is not None and not df_org.empty else pd.DataFrame()
+        if 'matricula' not in dados:
+            return
+        campos = list(dados.columns)
+        diretorias = {}  # cod_local -> diretoria do organograma, uma busca por código distinto
+        for linha in dados.itertuples(index=False, name=None):
+            registro = {c: self._texto(v) for c, v in zip(campos, linha)}
+            matricula = chave_matricula(registro['matricula'])
+            if not matricula or matricula in self._registros:
+                continue
+            registro['matricula'] = matricula
+            if registro.get('nome'):
+                registro['nome'] = registro['nome'].upper()
+            if not registro.get('diretoria') and registro.get('cod_local') and mapping:
+                cod = registro['cod_local']
+                if cod not in diretorias:
+                    diretoria = buscar_info_organograma_fast(cod, mapping)[0]
+                    diretorias[cod] = diretoria if diretoria != "N/D" else None
+                registro['diretoria'] = diretorias[cod]
+            self._registros[matricula] = registro
+        self._nomes = sorted(
+            (normalizar_cabecalho(r['nome']), m) for m, r in self._registros.items() if r.get('nome')
+        )
+        self._chaves_nome = [nome for nome, _ in self._nomes]
+
+    @staticmethod
+    def _texto(valor):
+        if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+            return None
+        texto = str(valor).strip()
+        return texto or None
+
+    def __len__(self):
+        return len(self._registros)
+
+    def __sizeof__(self):
+        # Para o orçamento do cache compartilhado (_medir_bytes usa sys.getsizeof)
+        return (_medir_bytes(self._registros) + _medir_bytes(self._nomes)
+                + sys.getsizeof(self._chaves_nome) + object.__sizeof__(self))
+
+    def buscar(self, matricula):
+        """Registro da matrícula (cópia) ou None."""
+        registro = self._registros.get(chave_matricula(matricula))
+        return dict(registro) if registro else None
+
+    def por_prefixo(self, prefixo, limite=LIMITE_SUGESTOES_COLABORADORES):
+        """Registros cujo nome começa por `prefixo` (sem acento/caixa), em ordem alfabética."""
+        chave = normalizar_cabecalho(prefixo)
+        if not chave:
+            return []
+        achados = []
+        for posicao in range(bisect.bisect_left(self._chaves_nome, chave), len(self._chaves_nome)):
+            if len(achados) >= limite or not self._chaves_nome[posicao].startswith(chave):
+                break
+            achados.append(dict(self._registros[self._nomes[posicao][1]]))
+        return achados
+
+    def preencher(self, df, campos=CAMPOS_PREENCHIMENTO_DIRETORIO, linhas=None):
+        """
+        Completa pela matrícula as colunas `campos` vazias do DataFrame (nulos e VALORES_VAZIOS_DIRETORIO),
+        só nas `linhas` da máscara se informada; o que veio preenchido é mantido. Altera `df` e devolve
+        quantas células foram preenchidas.
+        """
+        if not self._registros or df.empty or 'matricula' not in df:
+            return 0
+        chaves = df['matricula'].map(chave_matricula)
+        preenchidas = 0
+        for campo in campos:
+            atual = df[campo] if campo in df else pd.Series(None, index=df.index, dtype=object)
+            vazio = atual.isna() | atual.astype(str).str.strip().str.upper().isin(VALORES_VAZIOS_DIRETORIO)
+            if linhas is not None:
+                vazio &= linhas
+            if not vazio.any():
+                continue
+            novos = chaves[vazio].map(lambda m: (self._registros.get(m) or {}).get(campo)).dropna()
+            if novos.empty:
+                continue
+            if campo not in df or df[campo].dtype != object:
+                df[campo] = atual.astype(object)
+            df.loc[novos.index, campo] = novos
+            preenchidas += len(novos)
+        return preenchidas
+
+def obter_diretorio_colaboradores(df_org=None, versao=None):
+    """Diretório de colaboradores construído uma vez por versão do organograma (compartilhado entre sessões)."""
+    if df_org is None:
+        df_org, versao = carregar_organograma_versionado()
+    chave = ("diretorio_colaboradores", versao if versao is not None else _assinatura_dataframe(df_org))
+    return obter_cache_compartilhado().obter(
+        chave, lambda: DiretorioColaboradores(df_org, obter_indice_organograma(df_org, versao))
+    )
+
+def carregar_timeline_pagamentos():
+    """Linha do tempo completa do historico_pagamentos (com safra), compartilhada entre sessões."""
+    def construir():
+        conn = get_conn()
+        df = ler_sql_tipado(
+            "SELECT mes, ano, mes_referencia, matricula, nome, valor, data_pagamento, cod_local, diretoria "
+            "FROM historico_pagamentos ORDER BY ano, mes", conn, SCHEMA_HISTORICO_PAGAMENTOS
+        )
+        conn.close()
+        if not df.empty:
+            ano_inicio = np.where(df['mes'] >= 4, df['ano'], df['ano'] - 1).astype(int)
+            safra = pd.Series(ano_inicio, index=df.index).astype(str) + '/' + pd.Series(ano_inicio + 1, index=df.index).astype(str)
+            df['safra'] = safra.astype('category')
+        return df
+
+    chave = ("timeline_pagamentos", versao_dados('historico_pagamentos'))
+    return obter_cache_compartilhado().obter(chave, construir)
+
+def carregar_bolsistas_enriquecidos():
+    """Todos os bolsistas já enriquecidos com o organograma, compartilhados entre sessões."""
+    df_org, versao_org = carregar_organograma_versionado()
+
+    def construir():
+        conn = get_conn()
+        df = ler_sql_tipado("SELECT * FROM bolsistas ORDER BY nome", conn, SCHEMA_BOLSISTAS)
+        conn.close()
+        # O enriquecimento reescreve a diretoria como texto; volta para categoria ao final
+        return aplicar_schema(enriquecer_com_organograma(df, df_org, versao_org), SCHEMA_BOLSISTAS)
+
+    chave = ("bolsistas_enriquecidos", (versao_dados('bolsistas'), versao_org))
+    return obter_cache_compartilhado().obter(chave, construir)
+
+def filtrar_bolsistas(df, situacao="Todos", ano="Todos", busca="", diretoria="Todas"):
+    """Filtros da Tabela (situação, ano safra, busca por nome/matrícula e diretoria)."""
+    if situacao != "Todos":
+        df = df[df['situacao'] == situacao]
+    if ano != "Todos":
+        df = df[pd.to_numeric(df['ano_referencia'], errors='coerce') == ano]
+    df = filtrar_por_busca(df, busca)
+    if diretoria != "Todas":
+        df = df[df['diretoria'].astype(str).str.upper() == diretoria.upper()]
+    return df
+
+# Ordenações da Tabela equivalentes em SQL (usadas na exportação em blocos)
+ORDEM_BOLSISTAS_SQL = {
+    "Nome": "nome",
+    "Matrícula": "matricula",
+    "Valor": "valor_reembolso DESC",
+    "Diretoria": "diretoria",
+    "Ano Ref.": "ano_referencia DESC",
+}
+
+def blocos_bolsistas_filtrados(situacao, ano, busca, diretoria, ordem):
+    """Bolsistas lidos do banco em blocos, enriquecidos e filtrados bloco a bloco."""
+    df_org, versao_org = carregar_organograma_versionado()
+    query = f"SELECT * FROM bolsistas ORDER BY {ORDEM_BOLSISTAS_SQL.get(ordem, 'nome')}"
+    for bloco in ler_sql_em_blocos(query, schema=SCHEMA_BOLSISTAS):
+        bloco = aplicar_schema(enriquecer_com_organograma(bloco, df_org, versao_org), SCHEMA_BOLSISTAS)
+        yield filtrar_bolsistas(bloco, situacao, ano, busca, diretoria)
+
+# ---------------------------------------------------------------------------
+# Moeda e Números pt-BR (vetorizado)
+# ---------------------------------------------------------------------------
+# Formatação e leitura de colunas inteiras de uma vez. Cada valor distinto é tratado
+# uma única vez (colunas de dinheiro se repetem muito) e a troca de separadores
+# é feita num único translate sobre o texto concatenado.
+_TROCA_SEPARADORES = str.maketrans(',.', '.,')
+_RE_SO_MILHAR = r'^\d{1,3}(?:\.\d{3})+$'
+
+def _como_serie(valores):
+    """Aceita Series, arrays, listas ou escalares e devolve uma Series."""
+    if isinstance(valores, pd.Series):
+        return valores
+    if np.ndim(valores) == 0:
+        return pd.Series([valores])
+    return pd.Series(valores)
+
+def _formatar_distintos(numeros, molde, prefixo, sufixo, vazio, zero):
+    """Aplica o molde (formato en-US) aos valores distintos e converte para pt-BR."""
+    codigos, distintos = pd.factorize(numeros, use_na_sentinel=True)
+    if len(distintos):
+        # Prefixo/sufixo entram no próprio molde (não contêm separadores numéricos)
+        molde = prefixo.replace('{', '{{') + molde + sufixo.replace('{', '{{')
+        texto = '\n'.join(map(molde.format, distintos)).translate(_TROCA_SEPARADORES).split('\n')
+        rotulos = np.array(texto, dtype=object)
+        if zero is not None:
+            rotulos[np.asarray(distintos) == 0] = zero
+    else:
+        rotulos = np.array([], dtype=object)
+    # O último rótulo representa os nulos (código -1)
+    rotulos = np.append(rotulos, vazio)
+    return rotulos[codigos]
+
+def formatar_moeda_br(valores, vazio="R$ 0,00", zero=None, prefixo="R$ "):
+    """Formata uma coluna de valores como moeda BRL ("R$ 1.234,56").
+
+    vazio: texto para nulos/não numéricos; zero: texto opcional para valores iguais a zero.
+    """
+    serie = _como_serie(valores)
+    numeros = pd.to_numeric(serie, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    return pd.Series(_formatar_distintos(numeros, '{:,.2f}', prefixo, '', vazio, zero), index=serie.index)
+
+def formatar_numero_br(valores, vazio="0", zero=None, casas=2):
+    """Formata números no padrão BR; inteiros saem sem casas decimais ("1.234" / "1.234,50").
+    Texto que não é número sai como veio (só vazio/NaN vira `vazio`)."""
+    serie = _como_serie(valores)
+    numeros = pd.to_numeric(serie, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    inteiros = np.isfinite(numeros) & (numeros == np.round(numeros))
+    saida = np.empty(len(numeros), dtype=object)
+    saida[inteiros] = _formatar_distintos(numeros[inteiros], '{:,.0f}', '', '', vazio, zero)
+    saida[~inteiros] = _formatar_distintos(numeros[~inteiros], '{:,.%df}' % casas, '', '', vazio, zero)
+    texto = np.isnan(numeros) & (serie.notna() & (serie.astype(str) != "")).to_numpy()
+    saida[texto] = serie[texto].astype(str).to_numpy()
+    return pd.Series(saida, index=serie.index)
+
+def formatar_percentual_br(valores, casas=0, vazio=""):
+    """Formata frações (0.5) como percentual pt-BR ("50%", "12,5%")."""
+    serie = _como_serie(valores)
+    numeros = pd.to_numeric(serie, errors='coerce').to_numpy(dtype='float64', na_value=np.nan) * 100
+    return pd.Series(_formatar_distintos(numeros, '{:,.%df}' % casas, '', '%', vazio, None), index=serie.index)
+
+def _texto_para_float(textos):
+    """Converte uma Series de textos numéricos pt-BR/en-US para float (vetorizado)."""
+    t = textos.str.replace(r'[R$\s %]', '', regex=True)
+    negativo = t.str.startswith('-') | (t.str.startswith('(') & t.str.endswith(')'))
+    t = t.str.strip('()+-')
+    pos_virgula = t.str.rfind(',')
+    pos_ponto = t.str.rfind('.')
+    # Com os dois separadores, o último é o decimal; só vírgula é decimal;
+    # só ponto é milhar apenas no formato 1.234 / 1.234.567
+    virgula_decimal = (pos_virgula > pos_ponto) | ((pos_ponto >= 0) & t.str.match(_RE_SO_MILHAR))
+    t_br = t.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    t_us = t.str.replace(',', '', regex=False)
+    numeros = pd.to_numeric(t_br.where(virgula_decimal, t_us), errors='coerce')
+    return numeros.where(~negativo, -numeros)
+
+def _parse_serie(valores, conversor):
+    """Converte uma coluna mista (números e textos) processando cada texto distinto uma vez."""
+    serie = _como_serie(valores)
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype('float64'), pd.Series(False, index=serie.index)
+    bruto = serie.to_numpy(dtype=object, na_value=None)
+    eh_texto = np.fromiter((isinstance(v, str) for v in bruto), dtype=bool, count=len(bruto))
+    numeros = pd.to_numeric(pd.Series(np.where(eh_texto, None, bruto), index=serie.index), errors='coerce').astype('float64')
+    tinha_pct = pd.Series(False, index=serie.index)
+    if eh_texto.any():
+        codigos, distintos = pd.factorize(bruto[eh_texto])
+        distintos = pd.Series(distintos, dtype=object)
+        convertidos = conversor(distintos).to_numpy(dtype='float64', na_value=np.nan)
+        numeros[eh_texto] = convertidos[codigos]
+        tinha_pct[eh_texto] = distintos.str.contains('%', regex=False).to_numpy()[codigos]
+    return numeros, tinha_pct
+
+def parse_moeda_br(valores, padrao=np.nan):
+    """Lê valores monetários ("R$ 1.234,56", "1234,56", "1,234.56", 1234.56) como float.
+
+    Aceita Series, listas ou escalares; escalares retornam float.
+    """
+    numeros, _ = _parse_serie(valores, _texto_para_float)
+    if not pd.isna(padrao):
+        numeros = numeros.fillna(padrao)
+    return float(numeros.iloc[0]) if np.ndim(valores) == 0 else numeros
+
+def parse_percentual_br(valores, padrao=np.nan):
+    """Lê percentuais ("50%", "12,5 %", 0.5, 50) como fração de 0 a 1.
+
+    Textos com "%" e números acima de 1 são tratados como pontos percentuais.
+    """
+    numeros, tinha_pct = _parse_serie(valores, _texto_para_float)
+    numeros = numeros.where(~(tinha_pct | (numeros > 1)), numeros / 100)
+    if not pd.isna(padrao):
+        numeros = numeros.fillna(padrao)
+    return float(numeros.iloc[0]) if np.ndim(valores) == 0 else numeros
+
 # ---------------------------------------------------------------------------
 # UI Components
 # ---------------------------------------------------------------------------
 def format_br_currency(val):
     """Formata valor para moeda BRL"""
-    if pd.isna(val) or val == "": return "R$ 0,00"
-    try:
-        val = float(val)
-    except:
-        return "R$ 0,00"
-    return f"R$ {val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return formatar_moeda_br(val).iloc[0]
 
 def format_br_number(val):
     """Formata número para padrão BR"""
-    if pd.isna(val) or val == "": return "0"
-    try:
-        val = float(val)
-    except:
-        return str(val)
-    # Se for inteiro, não mostra casas decimais
-    if val == int(val):
-        return f"{int(val):,}".replace(",", ".")
-    return f"{val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return formatar_numero_br(val).iloc[0]
+
+# Formatadores pt-BR executados no navegador (AgGrid)
+_JS_MOEDA_BR = "function(p){return p.value==null||p.value===''?'':Number(p.value).toLocaleString('pt-BR',{style:'currency',currency:'BRL'});}"
+_JS_PERCENTUAL_BR = "function(p){return p.value==null||p.value===''?'':Number(p.value).toLocaleString('pt-BR',{style:'percent',maximumFractionDigits:1});}"
+_JS_INTEIRO_BR = "function(p){return p.value==null||p.value===''?'':Number(p.value).toLocaleString('pt-BR',{maximumFractionDigits:0});}"
+
+# Tabelas dinâmicas com "-": acima disso o Styler (texto célula a célula) pesa no rerun e fica o formato do navegador
+LIMITE_CELULAS_TRACO = 30_000
+
+def _formatador_por_valor(coluna, formatar):
+    """Texto pt-BR de cada valor distinto da coluna, para o Styler consultar célula a célula."""
+    distintos = pd.unique(coluna.dropna())
+    return dict(zip(distintos, formatar(distintos))).get
+
+def exibir_tabela(df, moeda=(), percentual=(), inteiro=(), rotulos=None, usar_aggrid=False, key=None, traco=False, **kwargs):
+    """Exibe um DataFrame mantendo os dtypes numéricos (ordenação numérica, sem cópia em texto).
+
+    A formatação fica no frontend: moeda (R$), percentual (frações 0-1) e inteiro (milhar), no
+    idioma do navegador (o column_config não tem como fixar o pt-BR). Com `traco` (tabelas dinâmicas),
+    zero e vazio aparecem como "-": o grid não desenha isso, então o texto pt-BR vem do Styler,
+    até LIMITE_CELULAS_TRACO células. `rotulos` renomeia cabeçalhos só na exibição; demais kwargs vão para st.dataframe.
+    """
+    rotulos = rotulos or {}
+    if usar_aggrid and AGGRID:
+        gb = GridOptionsBuilder.from_dataframe(df)
+        gb.configure_default_column(filterable=True, sortable=True, resizable=True)
+        for col, rotulo in rotulos.items():
+            gb.configure_column(col, header_name=rotulo)
+        for cols, js in ((moeda, _JS_MOEDA_BR), (percentual, _JS_PERCENTUAL_BR), (inteiro, _JS_INTEIRO_BR)):
+            for col in cols:
+                gb.configure_column(col, type=["numericColumn"], valueFormatter=JsCode(js))
+        return AgGrid(
+            df,
+            gridOptions=gb.build(),
+            height=kwargs.get('height', 400),
+            fit_columns_on_grid_load=True,
+            allow_unsafe_jscode=True,
+            key=key
+        )
+
+    config = {col: st.column_config.Column(rotulo) for col, rotulo in rotulos.items()}
+    dados = df
+    if traco and df.size <= LIMITE_CELULAS_TRACO:
+        formatos = ((moeda, lambda v: formatar_moeda_br(v, zero="-")),
+                    (percentual, lambda v: formatar_percentual_br(v, casas=1)),
+                    (inteiro, lambda v: formatar_numero_br(v, zero="-", casas=0)))
+        formatadores = {col: _formatador_por_valor(df[col], formatar) for cols, formatar in formatos for col in cols}
+        for col in formatadores:
+            config[col] = st.column_config.Column(rotulos.get(col, col))
+        dados = df.style.format(formatadores, na_rep="-")
+    else:
+        for col in moeda:
+            config[col] = st.column_config.NumberColumn(f"{rotulos.get(col, col)} (R$)", format="localized", step=0.01)
+        for col in percentual:
+            config[col] = st.column_config.NumberColumn(rotulos.get(col, col), format="percent")
+        for col in inteiro:
+            config[col] = st.column_config.NumberColumn(rotulos.get(col, col), format="localized", step=1)
+    kwargs.setdefault('use_container_width', True)
+    kwargs.setdefault('hide_index', True)
+    if key is not None:
+        kwargs['key'] = key
+    return st.dataframe(dados, column_config=config, **kwargs)
 
 def load_css():
     """Carrega o CSS customizado e força o tema claro."""
@@ -665,7 +1494,7 @@ def render_bar_chart(df, x_col, y_col, title, label_y="Valor", currency=False):
     # Preparar texto formatado se for moeda
     df_chart = df.copy()
     if currency:
-        df_chart['chart_text'] = df_chart[y_col].apply(lambda x: format_br_currency(x))
+        df_chart['chart_text'] = formatar_moeda_br(df_chart[y_col])
     else:
         df_chart['chart_text'] = df_chart[y_col]
 
@@ -731,11 +1560,162 @@ except ImportError:
 except Exception:
     AGGRID = False
 
+# Writer de Excel em memória constante (opcional; sem ele usamos openpyxl write_only)
+try:
+    import xlsxwriter
+    XLSXWRITER = True
+except ImportError:
+    XLSXWRITER = False
+
+# Parquet para downloads grandes (opcional)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW = True
+except ImportError:
+    PYARROW = False
+
+# Miniaturas dos anexos de imagem do diário (opcional; sem Pillow a imagem só abre inteira, sob demanda)
+try:
+    from PIL import Image
+    PILLOW = True
+except ImportError:
+    PILLOW = False
+
 st.set_page_config(page_title="Bolsas COCAL", page_icon="🎓", layout="wide")
 
 # Carregar estilo visual
 load_css()
 
+# ---------------------------------------------------------------------------
+# Busca Textual (FTS5: sem acento, por prefixo)
+# ---------------------------------------------------------------------------
+# Índices FTS5 com tokenizer unicode61 remove_diacritics (JOSÉ = jose). bolsistas_fts espelha a
+# tabela por triggers; historico_pagamentos_fts guarda os pares distintos (matrícula, nome) e é
+# refeito pelos importadores, que gravam o histórico em lote. Sem FTS5 no SQLite, cai no LIKE.
+TOKENIZADOR_BUSCA = "unicode61 remove_diacritics 2"
+
+def _sqlite_tem_fts5():
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE teste USING fts5(x, tokenize='{TOKENIZADOR_BUSCA}')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+FTS5 = _sqlite_tem_fts5()
+
+def reindexar_busca_historico(conn):
+    """Refaz o índice de busca do histórico (chamar na transação que regrava historico_pagamentos)."""
+    if FTS5:
+        conn.execute("DELETE FROM historico_pagamentos_fts")
+        conn.execute("INSERT INTO historico_pagamentos_fts (matricula, nome) SELECT DISTINCT matricula, nome FROM historico_pagamentos")
+
+# Fonte de cada linha do extrato: planilha VALORES.PAGOS (antigo relatório de pagos) ou a folha importada
+SQL_FONTE_FOLHA = "CASE WHEN origem LIKE 'VALORES.PAGOS%' THEN 'EXCEL' ELSE 'LEGADO' END"
+
+def reconstruir_extrato_folha(conn):
+    """Refaz o extrato_folha (total por matrícula, competência e fonte); chamar na transação que regrava historico_pagamentos."""
+    conn.execute("DELETE FROM extrato_folha")
+    conn.execute(f"""
+        INSERT INTO extrato_folha (matricula, ano, mes, fonte, valor, lancamentos)
+        SELECT matricula, ano, mes, {SQL_FONTE_FOLHA}, SUM(COALESCE(valor, 0)), COUNT(*)
+        FROM historico_pagamentos
+        WHERE matricula IS NOT NULL AND ano IS NOT NULL AND mes IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    """)
+
+def expressao_busca_fts(busca):
+    """'José Silv' -> '"José"* "Silv"*': todas as palavras, cada uma como prefixo. None sem palavras."""
+    palavras = re.findall(r"\w+", str(busca or ""))
+    return " ".join(f'"{p}"*' for p in palavras) or None
+
+# Texto de ajuda das caixas de busca: o índice casa o começo das palavras, não pedaços do meio
+AJUDA_BUSCA = "Busca pelo começo do nome ou da matrícula (ex.: 'jos sil', '1002'); trechos do meio da matrícula não são encontrados."
+
+def filtro_busca_sql(busca, tabela='bolsistas'):
+    """
+    Trecho de WHERE (e parâmetros) da busca por nome/matrícula em bolsistas ou historico_pagamentos.
+    Com FTS5 a consulta fica restrita às colunas nome e matrícula (o índice de bolsistas também tem
+    curso, instituição e observação) e cada palavra casa pelo começo.
+    """
+    expressao = expressao_busca_fts(busca)
+    if expressao is None:
+        return "1=1", []
+    expressao = f"{{nome matricula}} : ({expressao})"
+    if FTS5 and tabela == 'bolsistas':
+        return "id IN (SELECT rowid FROM bolsistas_fts WHERE bolsistas_fts MATCH ?)", [expressao]
+    if FTS5:
+        return f"matricula IN (SELECT matricula FROM {tabela}_fts WHERE {tabela}_fts MATCH ?)", [expressao]
+    return "(nome LIKE ? OR matricula LIKE ?)", [f"%{busca.strip()}%", f"%{busca.strip()}%"]
+
+def matriculas_da_busca(busca, tabela='bolsistas'):
+    """Matrículas encontradas pela busca (para filtrar DataFrames já carregados); None = sem busca."""
+    if expressao_busca_fts(busca) is None:
+        return None
+    filtro, params = filtro_busca_sql(busca, tabela)
+
+    def construir():
+        conn = get_conn()
+        try:
+            linhas = conn.execute(f"SELECT DISTINCT matricula FROM {tabela} WHERE {filtro}", params).fetchall()
+        finally:
+            conn.close()
+        return frozenset(str(m).strip() for (m,) in linhas)
+
+    chave = ("busca", tabela, expressao_busca_fts(busca), FTS5, versao_dados(tabela))
+    return obter_cache_compartilhado().obter(chave, construir)
+
+def filtrar_por_busca(df, busca, coluna='matricula', tabela='bolsistas'):
+    """Aplica a busca do índice a um DataFrame pela coluna de matrícula."""
+    matriculas = matriculas_da_busca(busca, tabela)
+    if matriculas is None:
+        return df
+    return df[df[coluna].astype(str).str.strip().isin(matriculas)]
+
+# Seletor de bolsista com busca enquanto digita: só as primeiras sugestões saem do banco
+LIMITE_SUGESTOES_BOLSISTAS = 20
+BUSCAS_RECENTES_POR_SESSAO = 32
+
+def sugerir_bolsistas(busca, limite=LIMITE_SUGESTOES_BOLSISTAS):
+    """
+    Até `limite` sugestões [(id, "NOME (matrícula)")] para o que foi digitado: prefixo das palavras
+    no nome/matrícula pelo índice FTS5, por relevância. Sem busca, os primeiros pelo índice de nome.
+    """
+    expressao = expressao_busca_fts(busca)
+    if expressao is None:
+        query, params = "SELECT id, nome, matricula FROM bolsistas ORDER BY nome LIMIT ?", [limite]
+    elif FTS5:
+        query = """
+            SELECT b.id, b.nome, b.matricula FROM bolsistas_fts JOIN bolsistas b ON b.id = bolsistas_fts.rowid
+            WHERE bolsistas_fts MATCH ? ORDER BY bolsistas_fts.rank, b.nome LIMIT ?
+        """
+        params = [f"{{nome matricula}} : ({expressao})", limite]
+    else:
+        termo = str(busca).strip()
+        query = "SELECT id, nome, matricula FROM bolsistas WHERE nome LIKE ? OR matricula LIKE ? ORDER BY nome LIMIT ?"
+        params = [f"%{termo}%", f"{termo}%", limite]
+    conn = get_conn()
+    try:
+        linhas = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+    return [(id_, f"{nome} ({matricula})") for id_, nome, matricula in linhas]
+
+def sugestoes_bolsistas_sessao(busca):
+    """sugerir_bolsistas com as buscas recentes guardadas na sessão (LRU), até a próxima escrita em bolsistas."""
+    recentes = st.session_state.setdefault('buscas_bolsistas_recentes', OrderedDict())
+    chave = (expressao_busca_fts(busca) if FTS5 else str(busca or "").strip(), versao_dados('bolsistas'))
+    if chave in recentes:
+        recentes.move_to_end(chave)
+        return recentes[chave]
+    sugestoes = recentes[chave] = sugerir_bolsistas(busca)
+    while len(recentes) > BUSCAS_RECENTES_POR_SESSAO:
+        recentes.popitem(last=False)
+    return sugestoes
+
 def init_database():
     conn = get_conn()
     cursor = conn.cursor()
@@ -818,6 +1798,10 @@ def init_database():
         cursor.execute("ALTER TABLE historico_pagamentos ADD COLUMN safra TEXT")
     except:
         pass
+    try:
+        cursor.execute("ALTER TABLE historico_pagamentos ADD COLUMN origem TEXT")
+    except:
+        pass
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS observacoes (
@@ -837,6 +1821,11 @@ def init_database():
     try:
         cursor.execute("ALTER TABLE observacoes ADD COLUMN nome_anexo TEXT")
     except: pass
+    try:
+        cursor.execute("ALTER TABLE observacoes ADD COLUMN miniatura BLOB")
+    except: pass
+    # Diário do Perfil: página por bolsista, mais recentes primeiro (paginação por chave data/id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_observacoes_bolsista ON observacoes(bolsista_id, data, id)")
     
     try:
         cursor.execute("ALTER TABLE bolsistas ADD COLUMN tipo TEXT")
@@ -858,7 +1847,185 @@ def init_database():
             UNIQUE(diretoria, ano)
         )
     ''')
-    
+
+    # VERSÕES DOS DADOS (invalida o cache compartilhado entre sessões)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versoes_dados (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for tabela in ['bolsistas', 'pagamentos', 'historico_pagamentos', 'observacoes']:
+        cursor.execute("INSERT OR IGNORE INTO versoes_dados (tabela, versao) VALUES (?, 0)", (tabela,))
+
+    # CARGA EM BLOCOS DO HISTÓRICO (área de preparação + ponto de retomada)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historico_pagamentos_carga (
+           matricula TEXT,
+           nome TEXT,
+           mes_referencia TEXT,
+           data_pagamento DATE,
+           valor REAL,
+           ano INTEGER,
+           mes INTEGER,
+           cod_local TEXT,
+           diretoria TEXT,
+           origem TEXT
+        )
+    ''')
+    try:
+        cursor.execute("ALTER TABLE historico_pagamentos_carga ADD COLUMN origem TEXT")
+    except:
+        pass
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS importacoes_checkpoint (
+            destino TEXT PRIMARY KEY,
+            assinatura TEXT NOT NULL,
+            blocos_gravados INTEGER NOT NULL DEFAULT 0,
+            linhas_gravadas INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMP
+        )
+    ''')
+    # RELATÓRIO DE VALIDAÇÃO (linhas rejeitadas/avisos da última importação de cada destino)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS importacoes_rejeicoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            destino TEXT NOT NULL,
+            origem TEXT,
+            linha INTEGER,
+            matricula TEXT,
+            coluna TEXT,
+            valor TEXT,
+            gravidade TEXT,
+            motivo TEXT,
+            registrado_em TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rejeicoes_destino ON importacoes_rejeicoes(destino)")
+
+    # Competência (mês/ano) da conferência e dos relatórios do DP; o JOIN por bolsista usa o UNIQUE
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pagamentos_competencia ON pagamentos(ano, mes, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_competencia ON historico_pagamentos(ano, mes)")
+
+    # DIÁRIO DA CONFERÊNCIA (uma linha por ação em lote, com o backup tirado antes dela)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diario_conferencia (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            acao TEXT NOT NULL,
+            mes INTEGER NOT NULL,
+            ano INTEGER NOT NULL,
+            filtro TEXT,
+            linhas INTEGER NOT NULL DEFAULT 0,
+            backup TEXT,
+            usuario TEXT,
+            executado_em TIMESTAMP
+        )
+    ''')
+    try:
+        cursor.execute("ALTER TABLE diario_conferencia ADD COLUMN ignorados INTEGER NOT NULL DEFAULT 0")
+    except: pass
+
+    # BUSCA TEXTUAL (FTS5)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_matricula ON historico_pagamentos(matricula)")
+    # Mesma chave de CHAVE_LINHA_PAGAMENTO: o "já veio de outra planilha" da importação de um arquivo só
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_chave ON historico_pagamentos(matricula, data_pagamento, valor)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bolsistas_nome ON bolsistas(nome)")
+    if FTS5:
+        existentes = {n for (n,) in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN ('bolsistas_fts', 'historico_pagamentos_fts')")}
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS bolsistas_fts USING fts5(
+                nome, matricula, curso, instituicao, observacao,
+                content='bolsistas', content_rowid='id', tokenize='{TOKENIZADOR_BUSCA}'
+            )
+        ''')
+        campos_fts = "nome, matricula, curso, instituicao, observacao"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_bolsistas_fts_insert AFTER INSERT ON bolsistas BEGIN
+                INSERT INTO bolsistas_fts (rowid, {campos_fts})
+                VALUES (new.id, new.nome, new.matricula, new.curso, new.instituicao, new.observacao);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_bolsistas_fts_delete AFTER DELETE ON bolsistas BEGIN
+                INSERT INTO bolsistas_fts (bolsistas_fts, rowid, {campos_fts})
+                VALUES ('delete', old.id, old.nome, old.matricula, old.curso, old.instituicao, old.observacao);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_bolsistas_fts_update
+            AFTER UPDATE OF {campos_fts} ON bolsistas BEGIN
+                INSERT INTO bolsistas_fts (bolsistas_fts, rowid, {campos_fts})
+                VALUES ('delete', old.id, old.nome, old.matricula, old.curso, old.instituicao, old.observacao);
+                INSERT INTO bolsistas_fts (rowid, {campos_fts})
+                VALUES (new.id, new.nome, new.matricula, new.curso, new.instituicao, new.observacao);
+            END
+        ''')
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS historico_pagamentos_fts USING fts5(matricula, nome, tokenize='{TOKENIZADOR_BUSCA}')")
+        # Bancos anteriores ao índice: indexa o que já existe
+        if 'bolsistas_fts' not in existentes:
+            cursor.execute("INSERT INTO bolsistas_fts (bolsistas_fts) VALUES ('rebuild')")
+        if 'historico_pagamentos_fts' not in existentes:
+            reindexar_busca_historico(cursor)
+
+    # EXTRATO POR BOLSISTA: folha agregada por competência (mantida pelos importadores) + conferência ao vivo
+    extrato_existia = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'extrato_folha'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS extrato_folha (
+            matricula TEXT NOT NULL,
+            ano INTEGER NOT NULL,
+            mes INTEGER NOT NULL,
+            fonte TEXT NOT NULL,
+            valor REAL NOT NULL,
+            lancamentos INTEGER NOT NULL,
+            PRIMARY KEY (matricula, ano, mes, fonte)
+        ) WITHOUT ROWID
+    ''')
+    if not extrato_existia:
+        reconstruir_extrato_folha(cursor)
+    # Prioridade na mesma competência: Conferência > Excel (VALORES.PAGOS) > Legado
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS extrato_bolsistas AS
+        SELECT b.matricula, p.ano, p.mes, p.valor * b.porcentagem AS valor, p.status,
+               'CONFERENCIA' AS fonte, 1 AS prioridade
+        FROM bolsistas b JOIN pagamentos p ON p.bolsista_id = b.id
+        UNION ALL
+        SELECT matricula, ano, mes, valor, 'PAGO', fonte, CASE fonte WHEN 'EXCEL' THEN 2 ELSE 3 END
+        FROM extrato_folha
+    ''')
+
+    # JOBS EM SEGUNDO PLANO (importações/sincronizações longas)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            dataset TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDENTE',
+            progresso REAL DEFAULT 0,
+            mensagem TEXT,
+            resultado TEXT,
+            usuario TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            iniciado_em TIMESTAMP,
+            finalizado_em TIMESTAMP
+        )
+    ''')
+    # Um job ativo por dataset, garantido pelo próprio banco
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dataset_ativo
+        ON jobs(dataset) WHERE status IN ('PENDENTE', 'EXECUTANDO')
+    ''')
+    # historico_pagamentos é gravado em lote pelos importadores, que registram a alteração uma vez só
+    for tabela in ['bolsistas', 'pagamentos', 'observacoes']:
+        for evento in ['INSERT', 'UPDATE', 'DELETE']:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+                END
+            ''')
+
     conn.commit()
     conn.close()
 
@@ -866,14 +2033,211 @@ init_database()
 
 # get_conn já definida acima
 
-def df_to_excel(df):
-    """Converte DataFrame para bytes Excel para download"""
+# ---------------------------------------------------------------------------
+# Exportação Excel (sob demanda, streaming)
+# ---------------------------------------------------------------------------
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+FORMATO_XLSX_MOEDA = '"R$" #,##0.00'
+FORMATO_XLSX_PERCENTUAL = '0%'
+FORMATO_XLSX_DATA = 'dd/mm/yyyy'
+LINHAS_POR_BLOCO_EXPORT = 20000
+
+def _blocos_da_aba(conteudo):
+    """Uma aba pode ser um DataFrame ou um iterável de DataFrames (blocos vindos do SQL)."""
+    if isinstance(conteudo, pd.DataFrame):
+        for inicio in range(0, max(len(conteudo), 1), LINHAS_POR_BLOCO_EXPORT):
+            yield conteudo.iloc[inicio:inicio + LINHAS_POR_BLOCO_EXPORT]
+    else:
+        yield from conteudo
+
+def _formatos_colunas(bloco, moeda, percentual):
+    """Formato numérico nativo de cada coluna (moeda, percentual, data ou nenhum)."""
+    formatos = []
+    for col in bloco.columns:
+        if col in moeda:
+            formatos.append(FORMATO_XLSX_MOEDA)
+        elif col in percentual:
+            formatos.append(FORMATO_XLSX_PERCENTUAL)
+        elif pd.api.types.is_datetime64_any_dtype(bloco[col]):
+            formatos.append(FORMATO_XLSX_DATA)
+        else:
+            formatos.append(None)
+    return formatos
+
+def _linhas_python(bloco):
+    """Linhas do bloco com tipos nativos do Python (nulos viram None)."""
+    valores = bloco.astype(object).where(bloco.notna(), None)
+    return valores.itertuples(index=False, name=None)
+
+def gerar_excel(abas, moeda=(), percentual=()):
+    """
+    Gera um .xlsx com várias abas ({nome_aba: DataFrame ou blocos}) em memória constante:
+    xlsxwriter constant_memory quando disponível, senão openpyxl write_only.
+    Colunas em `moeda`/`percentual` e colunas datetime recebem formato nativo do Excel.
+    """
     from io import BytesIO
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Dados')
+    moeda, percentual = set(moeda), set(percentual)
+
+    if XLSXWRITER:
+        wb = xlsxwriter.Workbook(output, {'constant_memory': True})
+        estilos = {f: wb.add_format({'num_format': f}) for f in (FORMATO_XLSX_MOEDA, FORMATO_XLSX_PERCENTUAL, FORMATO_XLSX_DATA)}
+        cabecalho = wb.add_format({'bold': True})
+        for nome_aba, conteudo in abas.items():
+            ws = wb.add_worksheet(str(nome_aba)[:31])
+            linha = 0
+            for bloco in _blocos_da_aba(conteudo):
+                if linha == 0:
+                    formatos = [estilos.get(f) for f in _formatos_colunas(bloco, moeda, percentual)]
+                    ws.write_row(0, 0, [str(c) for c in bloco.columns], cabecalho)
+                    for i, col in enumerate(bloco.columns):
+                        ws.set_column(i, i, max(len(str(col)) + 2, 12))
+                    linha = 1
+                for valores in _linhas_python(bloco):
+                    for i, v in enumerate(valores):
+                        if v is None:
+                            continue
+                        if formatos[i] is not None:
+                            ws.write(linha, i, v, formatos[i])
+                        else:
+                            ws.write(linha, i, v)
+                    linha += 1
+        wb.close()
+    else:
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        wb = Workbook(write_only=True)
+        for nome_aba, conteudo in abas.items():
+            ws = wb.create_sheet(str(nome_aba)[:31])
+            primeiro = True
+            for bloco in _blocos_da_aba(conteudo):
+                if primeiro:
+                    formatos = _formatos_colunas(bloco, moeda, percentual)
+                    titulos = []
+                    for c in bloco.columns:
+                        cel = WriteOnlyCell(ws, value=str(c))
+                        cel.font = Font(bold=True)
+                        titulos.append(cel)
+                    ws.append(titulos)
+                    primeiro = False
+                for valores in _linhas_python(bloco):
+                    linha = []
+                    for v, fmt in zip(valores, formatos):
+                        if fmt is None or v is None:
+                            linha.append(v)
+                        else:
+                            cel = WriteOnlyCell(ws, value=v)
+                            cel.number_format = fmt
+                            linha.append(cel)
+                    ws.append(linha)
+        wb.save(output)
     return output.getvalue()
 
+def df_to_excel(df, moeda=(), percentual=()):
+    """Converte DataFrame para bytes Excel para download"""
+    return gerar_excel({'Dados': df}, moeda=moeda, percentual=percentual)
+
+def gerar_csv_blocos(blocos, padrao_br=True):
+    """Gera o CSV em pedaços de bytes; padrão BR usa ';' como separador e ',' como decimal."""
+    sep, decimal = (';', ',') if padrao_br else (',', '.')
+    primeiro = True
+    for bloco in blocos:
+        texto = bloco.to_csv(index=False, header=primeiro, sep=sep, decimal=decimal, date_format='%d/%m/%Y' if padrao_br else None)
+        # BOM só no início para o Excel reconhecer UTF-8
+        yield texto.encode('utf-8-sig' if primeiro else 'utf-8')
+        primeiro = False
+
+def _schema_arrow(bloco):
+    """Schema Parquet estável entre blocos: textos/categorias sempre como string."""
+    campos = []
+    for col in bloco.columns:
+        serie = bloco[col]
+        if serie.dtype == object or isinstance(serie.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(serie):
+            campos.append(pa.field(str(col), pa.string()))
+        else:
+            campos.append(pa.field(str(col), pa.Array.from_pandas(serie.iloc[:0]).type))
+    return pa.schema(campos)
+
+def gerar_parquet(blocos):
+    """Grava os blocos como row groups de um único arquivo Parquet em memória."""
+    from io import BytesIO
+    output = BytesIO()
+    writer = None
+    try:
+        for bloco in blocos:
+            if writer is None:
+                schema = _schema_arrow(bloco)
+                writer = pq.ParquetWriter(output, schema, compression='snappy')
+            textos = {c: bloco[c].astype(str).where(bloco[c].notna(), None) for c in schema.names if schema.field(c).type == pa.string()}
+            bloco = bloco.assign(**textos)
+            writer.write_table(pa.Table.from_pandas(bloco, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+    return output.getvalue()
+
+# Formatos de exportação: rótulo -> (extensão, mime)
+FORMATOS_EXPORTACAO = {
+    "Excel": ("xlsx", MIME_XLSX),
+    "CSV (pt-BR)": ("csv", "text/csv"),
+    "CSV (padrão)": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/octet-stream"),
+}
+
+def _gerar_arquivo(formato, abas, moeda, percentual):
+    """Gera os bytes no formato pedido (CSV/Parquet usam a primeira aba)."""
+    if formato == "Excel":
+        return gerar_excel(abas, moeda=moeda, percentual=percentual)
+    conteudo = next(iter(abas.values()))
+    blocos = _blocos_da_aba(conteudo)
+    if formato == "Parquet":
+        return gerar_parquet(blocos)
+    return b''.join(gerar_csv_blocos(blocos, padrao_br=(formato == "CSV (pt-BR)")))
+
+def botao_exportar(rotulo, construtor, nome_arquivo, chave, versao, moeda=(), percentual=(),
+                   formatos=("Excel",), key=None, **kwargs):
+    """
+    Exportação sob demanda: o arquivo só é gerado quando o usuário clica em "Gerar".
+    `construtor()` devolve {nome_aba: DataFrame/blocos}; os bytes ficam no cache compartilhado
+    sob (chave da consulta, versão dos dados, formato), então outras sessões reaproveitam o arquivo.
+    `versao` pode ser uma função (ex.: assinatura do DataFrame da tela): ela roda no clique e, só
+    enquanto a sessão tem um arquivo gerado, a cada rerun para conferir se os dados mudaram.
+    Filtros (`chave`) ou dados diferentes, ou o arquivo fora do cache, voltam ao botão "Gerar".
+    """
+    key = key or f"exp_{nome_arquivo}"
+    formatos = [f for f in formatos if f != "Parquet" or PYARROW]
+    formato = formatos[0]
+    if len(formatos) > 1:
+        formato = st.radio("Formato", formatos, horizontal=True, key=f"{key}_formato", label_visibility="collapsed")
+    extensao, mime = FORMATOS_EXPORTACAO[formato]
+    nome_arquivo = f"{os.path.splitext(nome_arquivo)[0]}.{extensao}"
+    estado = f"{key}_pronto"
+    pronto = st.session_state.get(estado)
+    if pronto is not None and pronto[2:] != (chave, nome_arquivo, formato):
+        pronto = None
+    if pronto is not None and pronto[1] != (versao() if callable(versao) else versao):
+        pronto = None
+    arquivo = obter_cache_compartilhado().consultar(pronto) if pronto is not None else None
+
+    def construir():
+        inicio = datetime.now()
+        dados = _gerar_arquivo(formato, construtor(), moeda, percentual)
+        return {'dados': dados, 'segundos': (datetime.now() - inicio).total_seconds()}
+
+    if arquivo is None:
+        st.session_state.pop(estado, None)
+        if not st.button(f"📄 Gerar {rotulo}", key=f"{key}_gerar", **kwargs):
+            return None
+        chave_cache = ("export", versao() if callable(versao) else versao, chave, nome_arquivo, formato)
+        with st.spinner("Gerando arquivo..."):
+            arquivo = obter_cache_compartilhado().obter(chave_cache, construir)
+        st.session_state[estado] = chave_cache
+
+    tamanho_mb = len(arquivo['dados']) / 1024 ** 2
+    st.caption(f"📦 {formato}: {formatar_numero_br(tamanho_mb).iloc[0]} MB · gerado em {formatar_numero_br(arquivo['segundos']).iloc[0]} s")
+    return st.download_button(rotulo, arquivo['dados'], nome_arquivo, mime, key=key, **kwargs)
+
 def cadastrar_bolsista(dados):
     conn = get_conn()
     try:
@@ -903,11 +2267,12 @@ def cadastrar_bolsista(dados):
     finally:
         conn.close()
 
-def upsert_bolsista(dados, preserve_status=False):
+def upsert_bolsista(dados, preserve_status=False, fazer_backup=True):
     conn = get_conn()
     try:
-        # Backup antes de escrever
-        backup_database()
+        # Backup antes de escrever (a importação em lote já faz um único backup antes de começar)
+        if fazer_backup:
+            backup_database()
         
         campos = ['matricula', 'nome', 'cpf', 'diretoria', 'cod_local', 'curso', 'instituicao', 'tipo', 'modalidade',
                   'inicio_curso', 'fim_curso', 'ano_referencia',
@@ -956,223 +2321,1026 @@ def upsert_bolsista(dados, preserve_status=False):
     finally:
         conn.close()
 
-def processar_importacao_df(df_import, preserve_status=False):
+# ---------------------------------------------------------------------------
+# Validação das Linhas Importadas (regras vetorizadas + relatório de rejeições)
+# ---------------------------------------------------------------------------
+GRAVIDADE_ERRO = 'erro'    # a linha não é importada
+GRAVIDADE_AVISO = 'aviso'  # a linha é importada, mas fica registrada no relatório
+COLUNAS_RELATORIO_VALIDACAO = ['linha', 'matricula', 'coluna', 'valor', 'gravidade', 'motivo']
+ANO_MINIMO_IMPORTACAO = 1990
+ANOS_FUTUROS_IMPORTACAO = 10
+
+def _texto_celula(v):
+    return "" if v is None or v is pd.NaT or (isinstance(v, float) and np.isnan(v)) else str(v)
+
+def _preenchido(serie):
+    """Células com conteúdo (nem nulas nem só espaços)."""
+    return (serie.notna() & (serie.astype(str).str.strip() != '')).to_numpy()
+
+def cpf_valido(serie):
+    """Confere os dois dígitos verificadores de uma coluna de CPFs (com ou sem máscara), sem laço por linha."""
+    digitos = serie.astype(str).str.replace(r'\.0$', '', regex=True).str.replace(r'\D', '', regex=True).str.zfill(11)
+    validos = np.zeros(len(serie), dtype=bool)
+    tamanho_ok = (digitos.str.len() == 11).to_numpy()
+    if tamanho_ok.any():
+        matriz = np.frombuffer(''.join(digitos[tamanho_ok]).encode('ascii'), dtype=np.uint8).reshape(-1, 11).astype(np.int64) - 48
+        dv1 = (matriz[:, :9] @ np.arange(10, 1, -1)) * 10 % 11 % 10
+        dv2 = (matriz[:, :10] @ np.arange(11, 1, -1)) * 10 % 11 % 10
+        repetidos = (matriz == matriz[:, :1]).all(axis=1)  # 000.000.000-00, 111.111.111-11...
+        validos[tamanho_ok] = (dv1 == matriz[:, 9]) & (dv2 == matriz[:, 10]) & ~repetidos
+    return validos
+
+# Testes das regras: (dados convertidos, valores brutos da planilha, índice do organograma) -> máscara das violações
+def _sem_valor(coluna):
+    return lambda dados, brutos, mapping: ~_preenchido(brutos[coluna])
+
+def _ilegivel(coluna):
+    """Preenchida na planilha, mas a conversão não conseguiu ler (virou nulo)."""
+    return lambda dados, brutos, mapping: _preenchido(brutos[coluna]) & dados[coluna].isna().to_numpy()
+
+def _fora_do_intervalo(coluna, minimo=None, maximo=None):
+    def teste(dados, brutos, mapping):
+        numeros = pd.to_numeric(dados[coluna], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        fora = np.zeros(len(numeros), dtype=bool)
+        if minimo is not None:
+            fora |= numeros < minimo
+        if maximo is not None:
+            fora |= numeros > maximo
+        return fora
+    return teste
+
+def _data_fora_do_periodo(coluna):
+    def teste(dados, brutos, mapping):
+        anos = pd.to_datetime(dados[coluna], errors='coerce').dt.year
+        return ((anos < ANO_MINIMO_IMPORTACAO) | (anos > date.today().year + ANOS_FUTUROS_IMPORTACAO)).to_numpy()
+    return teste
+
+def _datas_invertidas(inicio, fim):
+    def teste(dados, brutos, mapping):
+        if inicio not in dados:
+            return np.zeros(len(dados), dtype=bool)
+        return (pd.to_datetime(dados[fim], errors='coerce') < pd.to_datetime(dados[inicio], errors='coerce')).to_numpy()
+    return teste
+
+def _cpf_invalido(dados, brutos, mapping):
+    preenchidos = _preenchido(dados['cpf'])
+    return preenchidos & ~cpf_valido(dados['cpf'].where(preenchidos, ''))
+
+def _codigo_fora_do_organograma(dados, brutos, mapping):
+    """Código informado (não "SEM CÓDIGO LOCAL") que não acha diretoria; sem organograma não há o que conferir."""
+    if not mapping:
+        return np.zeros(len(dados), dtype=bool)
+    codigos = dados['cod_local'].map(lambda v: "" if v is None or pd.isna(v) else str(v).strip())
+    informados = ~codigos.str.upper().isin(CODIGOS_LOCAL_SEM_VALOR)
+    distintos = codigos[informados].unique()
+    sem_diretoria = {c: buscar_info_organograma_fast(c, mapping)[0] == "N/D" for c in distintos}
+    return (informados & codigos.map(sem_diretoria).fillna(False).astype(bool)).to_numpy()
+
+# Regras: (coluna, gravidade, motivo, teste). A ordem é a do relatório.
+REGRAS_BOLSISTAS = [
+    ('matricula', GRAVIDADE_ERRO, "Sem matrícula", _sem_valor('matricula')),
+    # Datas do curso são opcionais: a linha entra e a data ilegível ou fora do período fica vazia
+    ('inicio_curso', GRAVIDADE_AVISO, "Data ilegível (gravada vazia)", _ilegivel('inicio_curso')),
+    ('fim_curso', GRAVIDADE_AVISO, "Data ilegível (gravada vazia)", _ilegivel('fim_curso')),
+    ('inicio_curso', GRAVIDADE_AVISO, "Data fora do período aceito (gravada vazia)", _data_fora_do_periodo('inicio_curso')),
+    ('fim_curso', GRAVIDADE_AVISO, "Data fora do período aceito (gravada vazia)", _data_fora_do_periodo('fim_curso')),
+    ('fim_curso', GRAVIDADE_AVISO, "Fim do curso antes do início", _datas_invertidas('inicio_curso', 'fim_curso')),
+    ('porcentagem', GRAVIDADE_ERRO, "Percentual ilegível", _ilegivel('porcentagem')),
+    ('porcentagem', GRAVIDADE_ERRO, "Percentual fora de 0% a 100%", _fora_do_intervalo('porcentagem', 0, 1)),
+    ('mensalidade', GRAVIDADE_ERRO, "Valor ilegível", _ilegivel('mensalidade')),
+    ('mensalidade', GRAVIDADE_ERRO, "Valor negativo", _fora_do_intervalo('mensalidade', minimo=0)),
+    ('valor_reembolso', GRAVIDADE_ERRO, "Valor ilegível", _ilegivel('valor_reembolso')),
+    ('valor_reembolso', GRAVIDADE_ERRO, "Valor negativo", _fora_do_intervalo('valor_reembolso', minimo=0)),
+    ('cpf', GRAVIDADE_AVISO, "CPF inválido (dígito verificador)", _cpf_invalido),
+    ('cod_local', GRAVIDADE_AVISO, "Código local fora do organograma", _codigo_fora_do_organograma),
+]
+
+REGRAS_HISTORICO = [
+    ('data', GRAVIDADE_ERRO, "Sem data de pagamento", _sem_valor('data')),
+    ('data', GRAVIDADE_ERRO, "Data ilegível", _ilegivel('data')),
+    ('data', GRAVIDADE_ERRO, "Data fora do período aceito", _data_fora_do_periodo('data')),
+    ('matricula', GRAVIDADE_ERRO, "Sem matrícula", _sem_valor('matricula')),
+    ('valor', GRAVIDADE_ERRO, "Valor ilegível", _ilegivel('valor')),
+    ('valor', GRAVIDADE_ERRO, "Valor negativo", _fora_do_intervalo('valor', minimo=0)),
+    ('cod_local', GRAVIDADE_AVISO, "Código local fora do organograma", _codigo_fora_do_organograma),
+]
+
+def validar_linhas(dados, regras, brutos=None, mapping=None):
+    """
+    Aplica as regras ao DataFrame inteiro; regras de colunas que a planilha não tem são puladas.
+    Devolve (rejeitar, relatorio): a máscara das linhas com algum erro e uma linha de relatório
+    por violação, com o índice de `dados` como número da linha e o valor como veio na planilha.
+    """
+    brutos = dados if brutos is None else brutos
+    rejeitar = np.zeros(len(dados), dtype=bool)
+    partes = []
+    for coluna, gravidade, motivo, teste in regras:
+        if coluna not in dados.columns or coluna not in brutos.columns:
+            continue
+        falhas = np.asarray(teste(dados, brutos, mapping), dtype=bool)
+        if not falhas.any():
+            continue
+        if gravidade == GRAVIDADE_ERRO:
+            rejeitar |= falhas
+        partes.append(pd.DataFrame({
+            'linha': dados.index[falhas],
+            'matricula': dados['matricula'][falhas].map(_texto_celula).to_numpy() if 'matricula' in dados else "",
+            'coluna': coluna,
+            'valor': brutos[coluna][falhas].map(_texto_celula).to_numpy(),
+            'gravidade': gravidade,
+            'motivo': motivo,
+        }))
+    if not partes:
+        return rejeitar, pd.DataFrame(columns=COLUNAS_RELATORIO_VALIDACAO)
+    return rejeitar, pd.concat(partes, ignore_index=True).sort_values('linha', kind='stable', ignore_index=True)
+
+def resumo_validacao(relatorio):
+    """(linhas rejeitadas, avisos) de um relatório de validação."""
+    erros = relatorio['gravidade'] == GRAVIDADE_ERRO
+    return int(relatorio.loc[erros, 'linha'].nunique()), int((~erros).sum())
+
+def gravar_relatorio_validacao(conn, destino, relatorio, origem=""):
+    """Acrescenta o relatório em importacoes_rejeicoes (dentro da transação de quem grava os dados)."""
+    if relatorio.empty:
+        return
+    conn.executemany(
+        "INSERT INTO importacoes_rejeicoes (destino, origem, linha, matricula, coluna, valor, gravidade, motivo, registrado_em) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(destino, origem, int(linha), matricula, coluna, valor, gravidade, motivo, _agora_texto())
+         for linha, matricula, coluna, valor, gravidade, motivo in relatorio[COLUNAS_RELATORIO_VALIDACAO].itertuples(index=False)]
+    )
+
+def contar_relatorio_validacao(conn, destino):
+    """(linhas rejeitadas, avisos) já gravados para o destino (inclui blocos de uma carga retomada)."""
+    return conn.execute(
+        "SELECT COUNT(DISTINCT CASE WHEN gravidade = ? THEN origem || ':' || linha END), "
+        "COALESCE(SUM(gravidade <> ?), 0) FROM importacoes_rejeicoes WHERE destino = ?",
+        (GRAVIDADE_ERRO, GRAVIDADE_ERRO, destino)
+    ).fetchone()
+
+def carregar_relatorio_validacao(destino):
+    """Relatório da última importação do destino (para download)."""
+    conn = get_conn()
     try:
-        # Backup antes de importar
-        backup_database()
-        
-        st.write(f"Processando {len(df_import)} registros...")
-        
-        # Normalizar colunas para maiúsculo
-        df_import.columns = [str(c).upper().strip() for c in df_import.columns]
-        
-        # Mapeamento de colunas (Excel Maiúsculo -> Banco) - EXPANDIDO
-        map_cols = {
-            # Matrícula
-            'MATRÍCULA': 'matricula', 'MATRICULA': 'matricula', 'MATR': 'matricula', 'ID': 'matricula', 'RE': 'matricula', 'REGISTRO': 'matricula',
-            # Nome
-            'NOME': 'nome', 'COLABORADOR': 'nome', 'NOMES': 'nome', 'FUNCIONARIO': 'nome', 'BOLSISTA': 'nome',
-            # CPF
-            'CPF': 'cpf',
-            # Diretoria
-            'DIRETORIA': 'diretoria', 'AREA': 'diretoria', 'DEPARTAMENTO': 'diretoria', 'DEPTO': 'diretoria',
-            # Código Local
-            'COD. LOCAL': 'cod_local', 'COD LOCAL': 'cod_local', 'CODIGO LOCAL': 'cod_local', 'CÓDIGO LOCAL': 'cod_local', 
-            'CENTRO DE CUSTO': 'cod_local', 'CC': 'cod_local', 'CR': 'cod_local', 'COD_LOCAL': 'cod_local',
-            # Curso
-            'CURSO': 'curso', 
-            # Instituição (várias variantes)
-            'INSTITUIÇÃO': 'instituicao', 'INSTITUICAO': 'instituicao', 'INSTITUIO': 'instituicao', 'FACULDADE': 'instituicao', 'UNIVERSIDADE': 'instituicao',
-            # Tipo
-            'TIPO': 'tipo', 'NIVEL': 'tipo',
-            # Modalidade
-            'MODALIDADE': 'modalidade',
-            # Início do curso (várias variantes - SEM e COM acento)
-            'INÍCIO CURSO': 'inicio_curso', 'INICIO CURSO': 'inicio_curso', 
-            'INICIO DO CURSO': 'inicio_curso', 'INÍCIO DO CURSO': 'inicio_curso',
-            'DATA INICIO': 'inicio_curso', 'DATA INÍCIO': 'inicio_curso', 'INICIO': 'inicio_curso',
-            # Fim do curso (várias variantes)
-            'FIM CURSO': 'fim_curso', 'TERMINO DO CURSO': 'fim_curso', 
-            'TÉRMINO DO CURSO': 'fim_curso', 'FIM DO CURSO': 'fim_curso',
-            'DATA FIM': 'fim_curso', 'DATA TERMINO': 'fim_curso', 'FIM': 'fim_curso',
-            # Ano referência (várias variantes)
-            'ANO PROGRAMA': 'ano_referencia', 'ANO': 'ano_referencia',
-            'ANO REFERENCIA': 'ano_referencia', 'ANO REFERÊNCIA': 'ano_referencia', 'SAFRA': 'ano_referencia',
-            # Mensalidade
-            'MENSALIDADE': 'mensalidade', 'VALOR MENSALIDADE': 'mensalidade',
-            'MENSALIDADE PREV CONTRATO': 'mensalidade',
-            # Porcentagem
-            '% BOLSA': 'porcentagem', 'PORCENTAGEM': 'porcentagem', '%BOLSA': 'porcentagem', '%': 'porcentagem',
-            # Valor reembolso
-            'VALOR REEMBOLSO': 'valor_reembolso', 'VALOR': 'valor_reembolso', 'REEMBOLSO': 'valor_reembolso',
-            # Situação
-            'SITUAÇÃO': 'situacao', 'SITUACAO': 'situacao', 'STATUS': 'situacao',
-            # Checagem
-            'CHECAGEM': 'checagem', 'CHECAGEM SITUACAO': 'checagem', 'CHECAGEM SITUAÇÃO': 'checagem'
-        }
-        
-        stats = {'inseridos': 0, 'atualizados': 0, 'erros': 0}
-        
-        bar = st.progress(0)
-        status_text = st.empty()
-        
-        for i, row in df_import.iterrows():
-            # Preparar dados
-            dados = {}
-            for col_excel, col_db in map_cols.items():
-                if col_excel in row:
-                    val = row[col_excel]
-                    # Tratamentos básicos
-                    if pd.isna(val):
-                        val = None
-                    elif col_db in ['inicio_curso', 'fim_curso']:
-                        try: val = pd.to_datetime(val).date()
-                        except: val = None
-                    elif col_db == 'porcentagem':
-                        # Se vier como string "50%", converte. Se vier 0.5 mantem
-                        if isinstance(val, str) and '%' in val:
-                            try: val = float(val.strip('%').replace(',','.')) / 100
-                            except: val = 0.5
-                    elif col_db in ['mensalidade', 'valor_reembolso']:
-                         if isinstance(val, str):
-                            try: val = float(val.replace('R$','').replace('.','').replace(',','.').strip())
-                            except: pass
-                    
-                    dados[col_db] = val
-            
-            # 1.5 Enriquecer com Organograma se tiver cod_local
-            if 'cod_local' in dados and dados['cod_local'] and not df_org.empty:
-                dir_org, _, _ = buscar_info_organograma(dados['cod_local'], df_org)
-                if dir_org:
-                    # Se não tiver diretoria ou se for N/A, usa a do organograma como prioridade
-                    if not dados.get('diretoria') or dados.get('diretoria') in ['', 'N/A', 'None']:
-                        dados['diretoria'] = dir_org
-
-            # Cadastrar/Atualizar
-            if 'matricula' in dados and dados['matricula']:
-                dados['matricula'] = str(dados['matricula']).strip() # Garantir string
-                if 'nome' in dados and dados['nome']:
-                    dados['nome'] = str(dados['nome']).upper()
-                    
-                ok, msg = upsert_bolsista(dados, preserve_status=preserve_status)
-                if ok: 
-                    if "Atualizado" in msg: stats['atualizados'] += 1
-                    else: stats['inseridos'] += 1
-                else: 
-                    stats['erros'] += 1
-                    # st.error(f"Erro na linha {i}: {msg}")
-            else:
-                stats['erros'] += 1 # Sem matricula
-            
-            if i % 10 == 0:
-                bar.progress((i + 1) / len(df_import))
-                status_text.text(f"Processando {i+1}/{len(df_import)}...")
-            
-        bar.progress(100)
-        status_text.empty()
-        
-        st.success(f"✅ Concluído! Inseridos: {stats['inseridos']} | Atualizados: {stats['atualizados']} | Erros/Ignorados: {stats['erros']}")
-        
-    except Exception as e:
-        st.error(f"Erro ao processar dados: {e}")
+        return pd.read_sql_query(
+            "SELECT origem, linha, matricula, coluna, valor, gravidade, motivo FROM importacoes_rejeicoes "
+            "WHERE destino = ? ORDER BY id", conn, params=(destino,)
+        )
+    finally:
+        conn.close()
+
+# ---------------------------------------------------------------------------
+# Importação de Bolsistas (prévia/diff vetorizado + aplicação)
+# ---------------------------------------------------------------------------
+CAMPOS_BOLSISTA = ['matricula', 'nome', 'cpf', 'diretoria', 'cod_local', 'curso', 'instituicao', 'tipo', 'modalidade',
+                   'inicio_curso', 'fim_curso', 'ano_referencia',
+                   'mensalidade', 'porcentagem', 'valor_reembolso', 'situacao', 'checagem', 'observacao']
+CAMPOS_PRESERVADOS = ['situacao', 'checagem', 'observacao']
+CAMPOS_NUMERICOS_BOLSISTA = ['ano_referencia', 'mensalidade', 'porcentagem', 'valor_reembolso']
+CAMPOS_DATA_BOLSISTA = ['inicio_curso', 'fim_curso']
+
+def _sem_nulos(serie):
+    """Object com None no lugar de NaN/NaT (o que vai para o SQLite)."""
+    serie = serie.astype(object)
+    return serie.where(serie.notna(), None)
+
+def preparar_importacao_bolsistas(df_import, mapping):
+    """
+    Converte a planilha nas colunas do banco e valida as linhas, de uma vez (REGRAS_BOLSISTAS).
+    Devolve (preparado, invalidos, colunas): uma linha por matrícula, o relatório de validação
+    (erros rejeitam a linha, avisos não) e o relatório dos cabeçalhos (MapeadorColunas.resolver).
+    """
+    renomeado, colunas = MAPEADOR_BOLSISTAS.aplicar(df_import)
+    indice = pd.RangeIndex(2, len(renomeado) + 2)  # número da linha no Excel (1 = cabeçalho)
+    brutos = pd.DataFrame({col: _sem_nulos(renomeado[col]).to_numpy() for col in renomeado.columns}, index=indice)
+    if 'matricula' not in brutos:
+        brutos['matricula'] = None
+    dados = brutos.copy()
+
+    # Tratamentos básicos (o que não der para ler vira nulo e é apontado na validação)
+    for col in CAMPOS_DATA_BOLSISTA:
+        if col in dados:
+            datas = pd.to_datetime(dados[col], errors='coerce', format='mixed')
+            dados[col] = _sem_nulos(datas.dt.date)
+    if 'porcentagem' in dados:
+        # "50%", "50" e 50 viram 0.5; 0.5 se mantém
+        preenchidos = dados['porcentagem'].notna()
+        if preenchidos.any():
+            dados.loc[preenchidos, 'porcentagem'] = parse_percentual_br(dados.loc[preenchidos, 'porcentagem']).to_numpy()
+            dados['porcentagem'] = _sem_nulos(dados['porcentagem'])
+    for col in ['mensalidade', 'valor_reembolso']:
+        if col in dados:
+            textos = dados[col].map(lambda v: isinstance(v, str))
+            if textos.any():
+                dados.loc[textos, col] = parse_moeda_br(dados.loc[textos, col]).to_numpy()
+                dados[col] = _sem_nulos(dados[col])
+
+    rejeitar, invalidos = validar_linhas(dados, REGRAS_BOLSISTAS, brutos, mapping)
+    dados = dados[~rejeitar].copy()
+    # Data fora do período é só aviso: grava vazia, como a ilegível (que a conversão já deixou nula)
+    for col in CAMPOS_DATA_BOLSISTA:
+        if col in dados:
+            dados[col] = _sem_nulos(dados[col].where(~_data_fora_do_periodo(col)(dados, brutos, mapping)))
+
+    # Enriquecer com Organograma se tiver cod_local (só onde a diretoria está vazia/N/A)
+    if 'cod_local' in dados and mapping:
+        codigos = dados['cod_local'].dropna()
+        codigos = codigos[codigos.astype(str).str.len() > 0]
+        if len(codigos):
+            dir_org = codigos.map({c: buscar_info_organograma_fast(c, mapping)[0] for c in codigos.unique()})
+            dir_org = dir_org[dir_org != "N/D"]
+            atual = dados['diretoria'] if 'diretoria' in dados else pd.Series(None, index=dados.index, dtype=object)
+            vazia = atual.isna() | atual.astype(str).isin(['', 'N/A', 'None'])
+            alvo = dir_org.index[vazia.loc[dir_org.index]]
+            dados.loc[alvo, 'diretoria'] = dir_org.loc[alvo]
+
+    # Nome em maiúsculo
+    dados['matricula'] = dados['matricula'].astype(str).str.strip()
+    if 'nome' in dados:
+        dados['nome'] = dados['nome'].map(lambda v: str(v).upper() if v else v)
+
+    for col in CAMPOS_BOLSISTA:
+        if col not in dados:
+            dados[col] = None
+
+    # Matrícula repetida na planilha: as linhas seguintes completam/sobrescrevem as anteriores
+    dados['_linha'] = dados.index
+    preparado = dados.groupby('matricula', sort=False).last()
+    preparado['_linha'] = dados.groupby('matricula', sort=False)['_linha'].first()
+    preparado['_repeticoes'] = dados.groupby('matricula', sort=False).size()
+    preparado = preparado.reset_index()
+    for col in CAMPOS_BOLSISTA:
+        preparado[col] = _sem_nulos(preparado[col])
+
+    # Valores que o SQLite não grava (ex.: hora solta numa coluna de ano) invalidam a linha
+    def gravavel(v):
+        return v is None or isinstance(v, (str, int, float, bytes, date))
+    for col in CAMPOS_BOLSISTA:
+        ruins = ~preparado[col].map(gravavel).to_numpy(dtype=bool)
+        if ruins.any():
+            invalidos = pd.concat([invalidos, pd.DataFrame({
+                'linha': preparado.loc[ruins, '_linha'].to_numpy(),
+                'matricula': preparado.loc[ruins, 'matricula'].to_numpy(),
+                'coluna': col,
+                'valor': preparado.loc[ruins, col].map(_texto_celula).to_numpy(),
+                'gravidade': GRAVIDADE_ERRO,
+                'motivo': "Valor que o banco não grava",
+            })], ignore_index=True)
+            preparado = preparado[~ruins].reset_index(drop=True)
+    return preparado, invalidos, colunas
+
+def _texto_comparavel(serie, campo):
+    """Forma canônica em texto para comparar planilha x banco (2025.0 == 2025, datas só AAAA-MM-DD)."""
+    def texto(v):
+        if v is None or (isinstance(v, float) and np.isnan(v)):
+            return None
+        if isinstance(v, float) and v.is_integer():
+            v = int(v)
+        return str(v)[:10] if campo in CAMPOS_DATA_BOLSISTA else str(v)
+    return serie.map(texto)
+
+def _iguais(novo, atual, campo):
+    """Igualdade elemento a elemento; números comparados com tolerância quando os dois lados são numéricos."""
+    igual = (_texto_comparavel(novo, campo) == _texto_comparavel(atual, campo)).to_numpy()
+    if campo in CAMPOS_NUMERICOS_BOLSISTA:
+        n_novo = pd.to_numeric(novo, errors='coerce').to_numpy(dtype=float)
+        n_atual = pd.to_numeric(atual, errors='coerce').to_numpy(dtype=float)
+        ambos = ~np.isnan(n_novo) & ~np.isnan(n_atual)
+        igual = np.where(ambos, np.isclose(n_novo, n_atual), igual)
+    return igual
+
+def calcular_diff_bolsistas(df_import, preserve_status=False):
+    """
+    Prévia da importação, sem gravar nada: compara a planilha com a tabela bolsistas num merge
+    vetorizado e classifica cada linha como nova, alterada, sem mudança ou inválida, com as
+    mudanças coluna a coluna. O resultado é o que aplicar_diff_bolsistas grava.
+    """
+    versao = versao_dados('bolsistas')[0]
+    df_org, versao_org = carregar_organograma_versionado()
+    preparado, invalidos, colunas = preparar_importacao_bolsistas(df_import, obter_indice_organograma(df_org, versao_org))
+
+    conn = get_conn()
+    try:
+        atuais = pd.read_sql_query(f"SELECT {', '.join(CAMPOS_BOLSISTA)} FROM bolsistas", conn)
+    finally:
+        conn.close()
+    atuais['matricula'] = atuais['matricula'].astype(str)
+    juntos = preparado.merge(atuais, on='matricula', how='left', suffixes=('', '_atual'), indicator=True)
+    existe = (juntos['_merge'] == 'both').to_numpy()
+
+    # Novas matrículas: o que a planilha não trouxe vem do diretório de colaboradores
+    # (nas existentes, campo vazio na planilha continua significando "não alterar")
+    obter_diretorio_colaboradores(df_org, versao_org).preencher(juntos, linhas=pd.Series(~existe, index=juntos.index))
+
+    # Novas sem nome não entram (nome é obrigatório no banco)
+    sem_nome = ~existe & juntos['nome'].isna().to_numpy()
+    if sem_nome.any():
+        invalidos = pd.concat([invalidos, pd.DataFrame({
+            'linha': juntos.loc[sem_nome, '_linha'].to_numpy(),
+            'matricula': juntos.loc[sem_nome, 'matricula'].to_numpy(),
+            'coluna': 'nome',
+            'valor': "",
+            'gravidade': GRAVIDADE_ERRO,
+            'motivo': "Nova matrícula sem nome",
+        })], ignore_index=True)
+
+    # Só campos preenchidos na planilha atualizam (e status/obs ficam de fora quando preservados)
+    comparados = [c for c in CAMPOS_BOLSISTA if c != 'matricula' and not (preserve_status and c in CAMPOS_PRESERVADOS)]
+    mudancas = []
+    alterado = np.zeros(len(juntos), dtype=bool)
+    for campo in comparados:
+        igual = _iguais(juntos[campo], juntos[f"{campo}_atual"], campo)
+        muda = existe & juntos[campo].notna().to_numpy() & ~igual
+        if muda.any():
+            alterado |= muda
+            mudancas.append(pd.DataFrame({
+                'matricula': juntos.loc[muda, 'matricula'].to_numpy(),
+                'nome': juntos.loc[muda, 'nome'].fillna(juntos.loc[muda, 'nome_atual']).to_numpy(),
+                'coluna': campo,
+                'atual': juntos.loc[muda, f"{campo}_atual"].astype(object).to_numpy(),
+                'novo': juntos.loc[muda, campo].astype(object).to_numpy(),
+            }))
+
+    mudancas = pd.concat(mudancas, ignore_index=True) if mudancas else pd.DataFrame(columns=['matricula', 'nome', 'coluna', 'atual', 'novo'])
+    novos = juntos.loc[~existe & ~sem_nome, CAMPOS_BOLSISTA].reset_index(drop=True)
+    alterados = juntos.loc[alterado, CAMPOS_BOLSISTA].reset_index(drop=True)
+    return {
+        'novos': novos,
+        'alterados': alterados,
+        'mudancas': mudancas,
+        'invalidos': invalidos.reset_index(drop=True),
+        'rejeitadas': resumo_validacao(invalidos)[0],
+        'sem_mudanca': int((existe & ~alterado).sum()),
+        'repetidas': int((preparado['_repeticoes'] > 1).sum()),
+        'colunas': colunas,
+        'preserve_status': preserve_status,
+        'versao': versao,
+    }
 
+def _valor_sqlite(v):
+    """Tipos do pandas/numpy (Timestamp, int64...) viram os nativos que o sqlite3 sabe gravar."""
+    if isinstance(v, pd.Timestamp):
+        return v.to_pydatetime()
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
 
-def processar_importacao_historico(df, ano_padrao):
+def aplicar_diff_bolsistas(diff, progresso=None):
+    """
+    Grava a prévia já calculada, numa transação: INSERT das novas e UPDATE só das colunas que mudaram.
+    Recusa se a tabela bolsistas mudou depois da prévia (a prévia estaria desatualizada).
+    """
+    progresso = progresso or (lambda fracao, mensagem: None)
+    if versao_dados('bolsistas')[0] != diff['versao']:
+        raise RuntimeError("A base de bolsistas mudou depois da prévia. Gere a prévia novamente antes de aplicar.")
+
+    backup_database()
+    novos, mudancas = diff['novos'], diff['mudancas']
+    progresso(0.1, f"Gravando {len(novos)} novos e {len(diff['alterados'])} alterados...")
     conn = get_conn()
-    # Forçar leitura fresca do organograma (sem cache)
-    df_org = carregar_organograma()
-    mapping = get_organograma_mapping(df_org)
-    
     try:
-        backup_database()
-        
-        # Padronizar nomes de colunas
-        df.columns = [str(c).upper().strip() for c in df.columns]
-        
-        # Identificar colunas críticas
-        col_data = next((c for c in ['DATA', 'PGTO', 'PAGTO', 'MÊS', 'MES'] if c in df.columns), None)
-        col_mat = next((c for c in ['MATRICULA', 'MATRÍCULA', 'ID'] if c in df.columns), None)
-        col_nome = next((c for c in ['NOMES', 'NOME', 'COLABORADOR'] if c in df.columns), None)
-        col_valor = next((c for c in ['VALOR', 'VALOR LIQUIDO', 'LÍQUIDO', 'TOTAL'] if c in df.columns), None)
-        col_cl = next((c for c in ['CODIGO LOCAL', 'CÓDIGO LOCAL', 'COD. LOCAL', 'COD LOCAL'] if c in df.columns), None)
-
-        if not col_cl:
-            st.warning("⚠️ Coluna 'CÓDIGO LOCAL' não encontrada no arquivo de pagamentos.")
-
-        df_processado = []
-        bar = st.progress(0)
-        status = st.empty()
-        
-        total = len(df)
-        for i, row in df.iterrows():
+        with conn:
+            if len(novos):
+                conn.executemany(
+                    f"INSERT INTO bolsistas ({', '.join(CAMPOS_BOLSISTA)}) VALUES ({', '.join('?' * len(CAMPOS_BOLSISTA))})",
+                    [[_valor_sqlite(v) for v in linha] for linha in novos[CAMPOS_BOLSISTA].astype(object).to_numpy().tolist()]
+                )
+            for campo, grupo in mudancas.groupby('coluna', sort=False):
+                conn.executemany(
+                    f"UPDATE bolsistas SET {campo} = ? WHERE matricula = ?",
+                    [(_valor_sqlite(v), m) for v, m in zip(grupo['novo'].tolist(), grupo['matricula'].tolist())]
+                )
+            conn.execute("DELETE FROM importacoes_rejeicoes WHERE destino = 'bolsistas'")
+            gravar_relatorio_validacao(conn, 'bolsistas', diff['invalidos'])
+    finally:
+        conn.close()
+
+    rejeitadas, avisos = resumo_validacao(diff['invalidos'])
+    stats = {
+        'inseridos': len(novos), 'atualizados': len(diff['alterados']),
+        'sem_mudanca': diff['sem_mudanca'], 'erros': rejeitadas, 'avisos_validacao': avisos,
+    }
+    progresso(1.0, f"✅ Concluído! Inseridos: {stats['inseridos']} | Atualizados: {stats['atualizados']} | "
+                   f"Sem mudança: {stats['sem_mudanca']} | Erros/Ignorados: {stats['erros']}"
+                   + (f" | Avisos: {avisos}" if avisos else ""))
+    return stats
+
+def processar_importacao_df(df_import, preserve_status=False, progresso=None):
+    """
+    Importa/atualiza bolsistas a partir de um DataFrame do Excel/Sheets (prévia + aplicação direto).
+    Não usa a interface: informa o andamento por progresso(fração, mensagem) e devolve as contagens.
+    """
+    progresso = progresso or (lambda fracao, mensagem: None)
+    progresso(0.0, f"Processando {len(df_import)} registros...")
+    return aplicar_diff_bolsistas(calcular_diff_bolsistas(df_import, preserve_status), progresso)
+
+# ---------------------------------------------------------------------------
+# Importação do Histórico em Blocos (streaming, memória limitada, retomável)
+# ---------------------------------------------------------------------------
+COLUNAS_CARGA_HISTORICO = ['matricula', 'nome', 'mes_referencia', 'data_pagamento', 'valor', 'ano', 'mes', 'cod_local', 'diretoria', 'origem']
+
+def _avisos_colunas_pagamentos(cabecalhos, fonte=None):
+    """Cabeçalhos ambíguos e falta do código local, resolvidos uma vez por planilha."""
+    colunas = MAPEADOR_PAGAMENTOS.resolver(cabecalhos)
+    avisos = MAPEADOR_PAGAMENTOS.descrever(colunas, fonte or "")
+    if 'cod_local' in colunas['ausentes']:
+        avisos.append(f"⚠️ Coluna 'CÓDIGO LOCAL' não encontrada {f'em {fonte}' if fonte else 'no arquivo de pagamentos'}.")
+    return avisos
+
+def _preparar_bloco_historico(bloco, mapping, origem="", diretorio=None):
+    """
+    Converte um bloco da planilha de pagamentos nas colunas de historico_pagamentos (vetorizado) e
+    valida as linhas (REGRAS_HISTORICO): devolve (preparado, relatorio). O índice do bloco é a linha no Excel.
+    Nome, código local e diretoria que faltarem são completados pelo diretório de colaboradores.
+    """
+    bloco, _ = MAPEADOR_PAGAMENTOS.aplicar(bloco)
+    if 'data' not in bloco.columns:
+        return pd.DataFrame(columns=COLUNAS_CARGA_HISTORICO), pd.DataFrame(columns=COLUNAS_RELATORIO_VALIDACAO)
+    brutos = pd.DataFrame({col: bloco[col] if col in bloco.columns else None for col in ('data', 'matricula', 'nome', 'valor', 'cod_local')},
+                          index=bloco.index)
+
+    # 1. Conversões (o que não der para ler vira nulo e é rejeitado na validação)
+    datas = pd.to_datetime(brutos['data'], dayfirst=True, errors='coerce', format='mixed')
+    matricula = brutos['matricula'].astype(str).str.split('.').str[0].str.strip().where(brutos['matricula'].notna())
+    nome = brutos['nome'].astype(str).str.upper().str.strip() if 'nome' in bloco.columns else "NÃO INFORMADO"
+    valor = parse_moeda_br(brutos['valor']) if 'valor' in bloco.columns else 0.0
+    cod_local = brutos['cod_local'].map(lambda v: "" if pd.isna(v) else str(v).strip()) if 'cod_local' in bloco.columns else ""
+    convertidos = pd.DataFrame({
+        'data': datas, 'matricula': matricula, 'nome': nome, 'valor': valor, 'cod_local': cod_local,
+    }, index=bloco.index)
+    if diretorio is not None:
+        diretorio.preencher(convertidos, ('nome', 'cod_local'))
+
+    # 2. Validação: linhas com erro ficam de fora e vão para o relatório
+    rejeitar, relatorio = validar_linhas(convertidos, REGRAS_HISTORICO, brutos, mapping)
+    convertidos = convertidos[~rejeitar]
+    datas = convertidos['data']
+    if convertidos.empty:
+        return pd.DataFrame(columns=COLUNAS_CARGA_HISTORICO), relatorio
+
+    preparado = pd.DataFrame({
+        'matricula': convertidos['matricula'],
+        'nome': convertidos['nome'],
+        'mes_referencia': [f"{MESES[m - 1]}/{a}" for m, a in zip(datas.dt.month, datas.dt.year)],
+        'data_pagamento': datas.dt.strftime('%Y-%m-%d'),
+        'valor': convertidos['valor'].fillna(0.0).astype('float64'),  # célula vazia = 0
+        'ano': datas.dt.year.astype('int64'),
+        'mes': datas.dt.month.astype('int64'),
+        'cod_local': convertidos['cod_local'],
+    }, index=convertidos.index)
+
+    # Diretoria (Busca no organograma, uma vez por código distinto)
+    codigos = preparado['cod_local'].unique()
+    diretorias = {c: buscar_info_organograma_fast(c, mapping)[0] for c in codigos}
+    preparado['diretoria'] = preparado['cod_local'].map(diretorias)
+    if diretorio is not None:
+        diretorio.preencher(preparado, ('diretoria',))
+    preparado['origem'] = origem
+    return preparado[COLUNAS_CARGA_HISTORICO], relatorio
+
+def _retomada_carga(conn, destino, assinatura):
+    """Blocos/linhas já gravados numa carga anterior do mesmo arquivo; senão zera a área de preparação."""
+    if assinatura:
+        linha = conn.execute(
+            "SELECT blocos_gravados, linhas_gravadas FROM importacoes_checkpoint WHERE destino = ? AND assinatura = ?",
+            (destino, assinatura)
+        ).fetchone()
+        if linha:
+            return linha
+    with conn:
+        conn.execute("DELETE FROM historico_pagamentos_carga")
+        conn.execute("DELETE FROM importacoes_checkpoint WHERE destino = ?", (destino,))
+        conn.execute("DELETE FROM importacoes_rejeicoes WHERE destino = ?", (destino,))
+    return 0, 0
+
+def _carregar_historico(blocos, conn, assinatura, blocos_feitos, linhas_feitas, total_linhas, progresso, origem):
+    """
+    Grava cada bloco na área de preparação numa transação própria, junto com o checkpoint e as rejeições.
+    No fim, troca de uma vez (quem consulta nunca vê carga pela metade) as linhas da mesma fonte
+    nas competências que a planilha cobre. Devolve (linhas, avisos, contagens da validação).
+    """
+    df_org, versao_org = carregar_organograma_versionado()
+    mapping, diretorio = obter_indice_organograma(df_org, versao_org), obter_diretorio_colaboradores(df_org, versao_org)
+    linhas, avisos = linhas_feitas, []
+    for indice, bloco in blocos:
+        if indice == blocos_feitos:
+            avisos = _avisos_colunas_pagamentos(bloco.columns)
+        preparado, relatorio = _preparar_bloco_historico(bloco, mapping, origem, diretorio)
+        with conn:
+            gravar_relatorio_validacao(conn, 'historico_pagamentos', relatorio, origem)
+            conn.executemany(
+                f"INSERT INTO historico_pagamentos_carga ({', '.join(COLUNAS_CARGA_HISTORICO)}) "
+                f"VALUES ({', '.join('?' * len(COLUNAS_CARGA_HISTORICO))})",
+                preparado.astype(object).to_numpy().tolist()
+            )
+            linhas += len(preparado)
+            conn.execute(
+                "INSERT OR REPLACE INTO importacoes_checkpoint (destino, assinatura, blocos_gravados, linhas_gravadas, atualizado_em) "
+                "VALUES ('historico_pagamentos', ?, ?, ?, ?)",
+                (assinatura or '', indice + 1, linhas, _agora_texto())
+            )
+        lidas = (indice + 1) * LINHAS_POR_BLOCO_IMPORTACAO
+        fracao = min(lidas / total_linhas, 0.99) if total_linhas else 0.0
+        progresso(fracao, f"Bloco {indice + 1}: {linhas:,} registros gravados...".replace(",", "."))
+
+    if linhas == 0:
+        raise ValueError("Nenhum dado válido processado.")
+
+    # 3. Salvar no Banco (troca atômica)
+    # Escopo da troca: tudo desta origem, mais as linhas da mesma fonte do extrato (VALORES.PAGOS
+    # ou as demais, SQL_FONTE_FOLHA) nas competências cobertas pela planilha. Assim uma planilha
+    # corrigida com outro nome substitui os meses errados e a VALORES.PAGOS não some com a BASE.
+    # O pagamento que ficou da outra fonte não entra de novo (mesma regra do "todas as planilhas").
+    progresso(0.99, f"🧹 Substituindo {linhas:,} registros desta planilha no histórico...".replace(",", "."))
+    colunas = ', '.join(COLUNAS_CARGA_HISTORICO)
+    fonte = conn.execute(f"SELECT {SQL_FONTE_FOLHA} FROM (SELECT ? AS origem)", (origem,)).fetchone()[0]
+    with conn:
+        conn.execute(f"""
+            DELETE FROM historico_pagamentos
+            WHERE origem = ?
+               OR ({SQL_FONTE_FOLHA} = ? AND (ano, mes) IN (SELECT DISTINCT ano, mes FROM historico_pagamentos_carga))
+        """, (origem, fonte))
+        conn.execute(f"""
+            INSERT INTO historico_pagamentos ({colunas})
+            SELECT {colunas} FROM historico_pagamentos_carga c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM historico_pagamentos h
+                WHERE h.matricula = c.matricula AND h.data_pagamento = c.data_pagamento AND h.valor = c.valor
+            )
+        """)
+        reindexar_busca_historico(conn)
+        reconstruir_extrato_folha(conn)
+        conn.execute("DELETE FROM historico_pagamentos_carga")
+        conn.execute("DELETE FROM importacoes_checkpoint WHERE destino = 'historico_pagamentos'")
+        registrar_alteracao(conn, 'historico_pagamentos')
+    erros, avisos_validacao = contar_relatorio_validacao(conn, 'historico_pagamentos')
+    progresso(1.0, f"✅ Sucesso! {linhas} registros vinculados ao Organograma."
+                   + (f" {erros} linhas rejeitadas na validação." if erros else ""))
+    return linhas, avisos, {'erros': erros, 'avisos_validacao': avisos_validacao}
+
+def importar_historico_arquivo(caminho, aba=0, progresso=None, origem=None):
+    """
+    Importação em streaming da planilha de pagamentos, bloco a bloco.
+    Se uma carga anterior do mesmo arquivo falhou no meio, continua do último bloco gravado.
+    `origem` é o arquivo original quando `caminho` é uma cópia temporária (define a retomada).
+    """
+    progresso = progresso or (lambda fracao, mensagem: None)
+    origem = origem or caminho
+    info = os.stat(origem)
+    assinatura = f"{os.path.abspath(origem)}|{info.st_size}|{int(info.st_mtime)}|{aba}|{LINHAS_POR_BLOCO_IMPORTACAO}"
+    conn = get_conn()
+    try:
+        blocos_feitos, linhas_feitas = _retomada_carga(conn, 'historico_pagamentos', assinatura)
+        if blocos_feitos:
+            progresso(0.0, f"Retomando do bloco {blocos_feitos + 1} ({linhas_feitas} registros já gravados)...")
+        else:
+            backup_database()
+        total_linhas = contar_linhas_excel(caminho, aba)
+        linhas, avisos, validacao = _carregar_historico(
+            ler_excel_em_blocos(caminho, aba, pular_blocos=blocos_feitos), conn,
+            assinatura, blocos_feitos, linhas_feitas, total_linhas, progresso,
+            origem=f"{os.path.basename(origem)}:{aba}"
+        )
+        return {'registros': linhas, 'retomado_do_bloco': blocos_feitos + 1 if blocos_feitos else None, 'avisos': avisos, **validacao}
+    finally:
+        conn.close()
+
+def sincronizar_historico_arquivo(progresso=None):
+    """Localiza BASES.BOLSAS/BASE.PAGAMENTOS*.xlsx, lê a aba PAGAMENTOS (ou a primeira) e reimporta o histórico."""
+    import glob
+    import shutil
+    import tempfile
+
+    progresso = progresso or (lambda fracao, mensagem: None)
+    # Tenta nome específico primeiro; se não existir exato, tenta achar por padrão
+    arquivo_pag = "BASES.BOLSAS/BASE.PAGAMENTOS.xlsx"
+    if not os.path.exists(arquivo_pag):
+        procura = glob.glob("BASES.BOLSAS/BASE.PAGAMENTOS*.xlsx")
+        arquivo_pag = procura[0] if procura else None
+    if not arquivo_pag:
+        raise FileNotFoundError("Arquivo 'BASE.PAGAMENTOS.xlsx' não encontrado na pasta BASES.BOLSAS.")
+
+    dt_mod = datetime.fromtimestamp(os.path.getmtime(arquivo_pag)).strftime('%d/%m/%Y %H:%M:%S')
+    progresso(0.0, f"Lendo `{arquivo_pag}` (modificado em {dt_mod})...")
+
+    # Copiar para temp para evitar erro de arquivo aberto
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
+        temp_pag = tmp.name
+    try:
+        try:
+            shutil.copy2(arquivo_pag, temp_pag)
+        except PermissionError:
+            raise PermissionError(f"O arquivo `{arquivo_pag}` parece estar aberto. Feche-o e tente novamente.")
+
+        # Leitura inteligente de Abas (PAGAMENTOS > Sheet1)
+        from openpyxl import load_workbook
+        wb = load_workbook(temp_pag, read_only=True)
+        sheet_name = next((s for s in wb.sheetnames if s.upper() == 'PAGAMENTOS'), 0)
+        wb.close()
+
+        # Leitura em streaming, bloco a bloco (memória limitada mesmo com planilhas enormes)
+        resultado = importar_historico_arquivo(temp_pag, sheet_name, progresso=progresso, origem=arquivo_pag)
+    finally:
+        try:
+            os.remove(temp_pag)
+        except OSError:
+            pass
+
+    resultado.update({'arquivo': arquivo_pag, 'modificado_em': dt_mod, 'aba': sheet_name})
+    return resultado
+
+# Arquivos de pagamentos, em ordem de prioridade: nas duplicatas entre arquivos vence o primeiro
+PADROES_PLANILHAS_PAGAMENTOS = [
+    "BASES.BOLSAS/BASE.PAGAMENTOS*.xlsx",
+    "BASES.BOLSAS/VALORES.PAGOS*.xlsx",
+    "VALORES.PAGOS*.xlsx",
+]
+CHAVE_LINHA_PAGAMENTO = ['matricula', 'data_pagamento', 'valor']
+
+def descobrir_planilhas_pagamentos():
+    """Todas as planilhas de pagamento; dentro de cada padrão, a modificada por último tem prioridade."""
+    import glob
+
+    arquivos = []
+    for padrao in PADROES_PLANILHAS_PAGAMENTOS:
+        encontrados = [a for a in glob.glob(padrao) if not os.path.basename(a).startswith("~$")]
+        for caminho in sorted(encontrados, key=os.path.getmtime, reverse=True):
+            if caminho not in arquivos:
+                arquivos.append(caminho)
+    return arquivos
+
+def _ler_abas_em_paralelo(tarefas, progresso):
+    """
+    Lê as abas (caminho, aba) num pool de processos: o parsing do openpyxl é CPU-bound.
+    Processos "spawn" (sem herdar as threads do servidor) importam só o leitura_pagamentos.
+    Com uma aba só, lê aqui mesmo para não pagar a subida de um processo.
+    """
+    lidas = {}
+    if len(tarefas) == 1:
+        lidas[tarefas[0]] = ler_aba(*tarefas[0])
+        return lidas
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(len(tarefas), os.cpu_count() or 1), mp_context=contexto) as pool:
+        futuros = {pool.submit(ler_aba, caminho, aba): (caminho, aba) for caminho, aba in tarefas}
+        for feitos, futuro in enumerate(as_completed(futuros), start=1):
+            lidas[futuros[futuro]] = futuro.result()
+            progresso(0.6 * feitos / len(tarefas), f"Lidas {feitos}/{len(tarefas)} abas...")
+    return lidas
+
+def sincronizar_historico_todos(progresso=None):
+    """
+    Reimporta o histórico a partir de TODAS as planilhas e abas de pagamento encontradas.
+    As abas são lidas em paralelo, linhas repetidas entre arquivos (matrícula + data + valor)
+    entram uma vez só (a do arquivo de maior prioridade) e tudo é gravado numa única transação.
+    Para uma única planilha gigante, o modo em blocos (sincronizar_historico_arquivo) usa menos memória.
+    """
+    import shutil
+    import tempfile
+
+    progresso = progresso or (lambda fracao, mensagem: None)
+    arquivos = descobrir_planilhas_pagamentos()
+    if not arquivos:
+        raise FileNotFoundError("Nenhuma planilha de pagamentos (BASE.PAGAMENTOS*.xlsx / VALORES.PAGOS*.xlsx) encontrada.")
+
+    progresso(0.0, f"Localizadas {len(arquivos)} planilhas; identificando abas...")
+    pasta_temp = tempfile.mkdtemp(prefix="pagamentos_")
+    try:
+        # Copiar para temp para evitar erro de arquivo aberto
+        copias, tarefas = {}, []
+        for ordem, arquivo in enumerate(arquivos):
+            copia = os.path.join(pasta_temp, f"{ordem}_{os.path.basename(arquivo)}")
             try:
-                # 1. Parsing da Data
-                val_data = row[col_data] if col_data else None
-                dt = None
-                if isinstance(val_data, datetime): dt = val_data
-                else:
-                    try: dt = pd.to_datetime(val_data, dayfirst=True)
-                    except: pass
-                
-                if not dt: continue
-                
-                mes, ano = dt.month, dt.year
-                data_str = dt.strftime('%Y-%m-%d')
-                
-                # 2. Dados básicos
-                matricula = str(row[col_mat]).split('.')[0].strip() if col_mat else "0"
-                nome = str(row[col_nome]).upper().strip() if col_nome else "NÃO INFORMADO"
-                
-                # Valor
-                v = row[col_valor] if col_valor else 0
-                if isinstance(v, str):
-                    try: v = float(v.replace('R$','').replace('.','').replace(',','.').strip())
-                    except: v = 0.0
-                valor = float(v) if pd.notna(v) else 0.0
-                
-                # Código Local
-                cl = str(row[col_cl]).strip() if col_cl and pd.notna(row[col_cl]) else ""
-                
-                # Diretoria (Busca no organograma)
-                diretoria, _, _ = buscar_info_organograma_fast(cl, mapping)
-                
-                # Ordem: matricula, nome, mes_referencia, data_pagamento, valor, ano, mes, cod_local, diretoria
-                df_processado.append((
-                    matricula, nome, f"{MESES[mes-1]}/{ano}", data_str, valor, ano, mes, cl, diretoria
-                ))
-            except:
-                continue
-            
-            if i % 100 == 0:
-                bar.progress((i+1)/total)
-                status.text(f"Processando {i+1}/{total}...")
+                shutil.copy2(arquivo, copia)
+            except PermissionError:
+                raise PermissionError(f"O arquivo `{arquivo}` parece estar aberto. Feche-o e tente novamente.")
+            copias[copia] = arquivo
+            tarefas.extend((copia, aba) for aba in abas_de_pagamento(copia))
+        if not tarefas:
+            raise ValueError("Nenhuma aba com colunas de matrícula e data nas planilhas encontradas.")
+
+        lidas = _ler_abas_em_paralelo(tarefas, progresso)
+    finally:
+        shutil.rmtree(pasta_temp, ignore_errors=True)
+
+    # Preparação (vetorizada) na ordem de prioridade
+    progresso(0.6, "Convertendo datas/valores e vinculando ao organograma...")
+    df_org, versao_org = carregar_organograma_versionado()
+    mapping, diretorio = obter_indice_organograma(df_org, versao_org), obter_diretorio_colaboradores(df_org, versao_org)
+    relatorio, partes, avisos, validacoes = [], [], [], []
+    for ordem, (copia, aba) in enumerate(tarefas):
+        arquivo = copias[copia]
+        df_aba, segundos_leitura = lidas[(copia, aba)]
+        inicio = time.perf_counter()
+        origem = f"{os.path.basename(arquivo)}:{aba}"
+        avisos.extend(_avisos_colunas_pagamentos(df_aba.columns, origem))
+        preparado, validacao = _preparar_bloco_historico(df_aba, mapping, origem, diretorio)
+        preparado['_ordem'] = ordem
+        partes.append(preparado)
+        validacoes.append((origem, validacao))
+        relatorio.append({
+            'arquivo': arquivo, 'aba': aba, 'linhas': len(df_aba), 'validas': len(preparado),
+            'rejeitadas': resumo_validacao(validacao)[0], 'duplicadas': 0, 'segundos_leitura': round(segundos_leitura, 2),
+            'segundos_preparo': round(time.perf_counter() - inicio, 2),
+        })
+
+    # Duplicatas entre arquivos: cada chave fica só com as linhas da fonte de maior prioridade
+    todas = pd.concat(partes, ignore_index=True)
+    primeira_fonte = todas.groupby(CHAVE_LINHA_PAGAMENTO, sort=False)['_ordem'].transform('min')
+    repetidas = todas['_ordem'] != primeira_fonte
+    for ordem, quantidade in todas.loc[repetidas, '_ordem'].value_counts().items():
+        relatorio[ordem]['duplicadas'] = int(quantidade)
+    todas = todas.loc[~repetidas, COLUNAS_CARGA_HISTORICO]
+    if todas.empty:
+        raise ValueError("Nenhum dado válido processado.")
+
+    # Gravação única: ou entra tudo, ou nada muda
+    progresso(0.9, f"🧹 Substituindo o histórico por {len(todas)} registros...")
+    backup_database()
+    colunas = ', '.join(COLUNAS_CARGA_HISTORICO)
+    conn = get_conn()
+    try:
+        with conn:
+            conn.execute("DELETE FROM historico_pagamentos")
+            conn.executemany(
+                f"INSERT INTO historico_pagamentos ({colunas}) VALUES ({', '.join('?' * len(COLUNAS_CARGA_HISTORICO))})",
+                todas.astype(object).to_numpy().tolist()
+            )
+            reindexar_busca_historico(conn)
+            reconstruir_extrato_folha(conn)
+            # Uma carga em blocos pendente ficaria obsoleta
+            conn.execute("DELETE FROM historico_pagamentos_carga")
+            conn.execute("DELETE FROM importacoes_checkpoint WHERE destino = 'historico_pagamentos'")
+            conn.execute("DELETE FROM importacoes_rejeicoes WHERE destino = 'historico_pagamentos'")
+            for origem, validacao in validacoes:
+                gravar_relatorio_validacao(conn, 'historico_pagamentos', validacao, origem)
+            registrar_alteracao(conn, 'historico_pagamentos')
+            erros, avisos_validacao = contar_relatorio_validacao(conn, 'historico_pagamentos')
+    finally:
+        conn.close()
 
-        if not df_processado:
-            st.error("Nenhum dado válido processado.")
-            return
+    duplicadas = int(repetidas.sum())
+    progresso(1.0, f"✅ Sucesso! {len(todas)} registros de {len(tarefas)} abas em {len(arquivos)} arquivos "
+                   f"({duplicadas} duplicados entre arquivos ignorados"
+                   + (f", {erros} linhas rejeitadas na validação" if erros else "") + ").")
+    return {'registros': len(todas), 'duplicadas': duplicadas, 'arquivos': relatorio, 'avisos': avisos,
+            'erros': erros, 'avisos_validacao': avisos_validacao}
 
-        # 3. Salvar no Banco
-        st.write(f"🧹 Limpando dados antigos e salvando {len(df_processado)} registros...")
-        conn.execute("DELETE FROM historico_pagamentos")
-        
-        conn.executemany('''
-            INSERT INTO historico_pagamentos (matricula, nome, mes_referencia, data_pagamento, valor, ano, mes, cod_local, diretoria)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', df_processado)
-        
-        conn.commit()
+# ---------------------------------------------------------------------------
+# Jobs em Segundo Plano (importações e sincronizações longas)
+# ---------------------------------------------------------------------------
+STATUS_JOBS_ATIVOS = ('PENDENTE', 'EXECUTANDO')
+INTERVALO_PROGRESSO_SEGUNDOS = 0.5
+MINUTOS_EXIBIR_JOB_FINALIZADO = 15
+
+def _agora_texto():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+class GerenciadorJobs:
+    """
+    Executa importações fora do script do Streamlit, num pool de threads por processo.
+    O estado fica na tabela jobs: navegar ou dar rerun não interrompe o trabalho, qualquer
+    sessão acompanha o andamento e o índice único permite um só job ativo por dataset.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        # Jobs "ativos" herdados de um processo anterior nunca vão terminar
+        conn = get_conn()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'ERRO', mensagem = 'Interrompido pelo reinício do servidor', finalizado_em = ? "
+                "WHERE status IN ('PENDENTE', 'EXECUTANDO')", (_agora_texto(),)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def submeter(self, tipo, dataset, funcao, *args, usuario=None, **kwargs):
+        """
+        Agenda funcao(*args, progresso=..., **kwargs) e devolve (job_id, novo).
+        Se o dataset já tem job ativo, nada é agendado e volta o id do job em andamento.
+        """
+        conn = get_conn()
+        try:
+            cur = conn.execute(
+                "INSERT INTO jobs (tipo, dataset, usuario, criado_em) VALUES (?, ?, ?, ?)",
+                (tipo, dataset, usuario, _agora_texto())
+            )
+            conn.commit()
+            job_id = cur.lastrowid
+        except sqlite3.IntegrityError:
+            ativo = job_ativo(dataset)
+            return (ativo['id'] if ativo else None), False
+        finally:
+            conn.close()
+        self._executor.submit(self._executar, job_id, funcao, args, kwargs)
+        return job_id, True
+
+    def _atualizar(self, job_id, **campos):
+        conn = get_conn()
+        try:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in campos)} WHERE id = ?",
+                (*campos.values(), job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _executar(self, job_id, funcao, args, kwargs):
+        self._atualizar(job_id, status='EXECUTANDO', iniciado_em=_agora_texto())
+        ultimo = [0.0]
+
+        def progresso(fracao, mensagem):
+            # Grava no banco no máximo a cada INTERVALO_PROGRESSO_SEGUNDOS (o fim sempre é gravado)
+            agora = time.monotonic()
+            if fracao < 1 and agora - ultimo[0] < INTERVALO_PROGRESSO_SEGUNDOS:
+                return
+            ultimo[0] = agora
+            self._atualizar(job_id, progresso=float(min(max(fracao, 0.0), 1.0)), mensagem=mensagem)
+
+        try:
+            resultado = funcao(*args, progresso=progresso, **kwargs)
+        except Exception as e:
+            logger.exception(f"Job {job_id} falhou")
+            self._atualizar(job_id, status='ERRO', mensagem=str(e), finalizado_em=_agora_texto())
+            return
         st.cache_data.clear()
-        st.success(f"✅ Sucesso! {len(df_processado)} registros vinculados ao Organograma.")
-        st.balloons()
-        st.rerun()
-        
-    except Exception as e:
-        st.error(f"Erro crítico na importação: {e}")
+        self._atualizar(
+            job_id, status='CONCLUIDO', progresso=1.0, finalizado_em=_agora_texto(),
+            resultado=json.dumps(resultado, default=str, ensure_ascii=False)
+        )
+
+@st.cache_resource
+def obter_gerenciador_jobs():
+    """Gerenciador único por processo (compartilhado entre as sessões)."""
+    return GerenciadorJobs()
+
+def _consultar_jobs(where, params=()):
+    conn = get_conn()
+    conn.row_factory = sqlite3.Row
+    try:
+        linhas = conn.execute(f"SELECT * FROM jobs WHERE {where} ORDER BY id DESC LIMIT 1", params).fetchall()
     finally:
         conn.close()
+    if not linhas:
+        return None
+    job = dict(linhas[0])
+    job['resultado'] = json.loads(job['resultado']) if job['resultado'] else None
+    for campo in ('criado_em', 'iniciado_em', 'finalizado_em'):
+        job[campo] = datetime.strptime(job[campo], '%Y-%m-%d %H:%M:%S') if job[campo] else None
+    return job
+
+def obter_job(job_id):
+    """Estado atual de um job (dict) ou None."""
+    return _consultar_jobs("id = ?", (job_id,))
+
+def ultimo_job(dataset):
+    """Job mais recente do dataset, em qualquer status."""
+    return _consultar_jobs("dataset = ?", (dataset,))
+
+def job_ativo(dataset):
+    """Job pendente/em execução do dataset, se houver."""
+    return _consultar_jobs("dataset = ? AND status IN ('PENDENTE', 'EXECUTANDO')", (dataset,))
+
+def iniciar_job(tipo, dataset, funcao, *args, **kwargs):
+    """Agenda o job a partir da interface; avisa quando já havia um em andamento."""
+    job_id, novo = obter_gerenciador_jobs().submeter(
+        tipo, dataset, funcao, *args, usuario=st.session_state.get('username'), **kwargs
+    )
+    if novo:
+        st.toast(f"{tipo} iniciada em segundo plano. Pode continuar navegando.", icon="⏳")
+    else:
+        st.warning("⚠️ Já existe uma atualização em andamento para estes dados. Acompanhe o progresso abaixo.")
+    return job_id
+
+@st.fragment(run_every=2)
+def _acompanhar_job(dataset):
+    """Atualiza só a barra de progresso; ao terminar, recarrega a página com os dados novos."""
+    job = ultimo_job(dataset)
+    if job is None:
+        return
+    if job['status'] in STATUS_JOBS_ATIVOS:
+        st.progress(job['progresso'] or 0.0, text=f"⏳ {job['tipo']}: {job['mensagem'] or 'aguardando início...'}")
+    else:
+        st.rerun()
 
-def listar_bolsistas(situacao=None, diretoria=None, busca=None, ano_ref=None):
-    conn = get_conn()
+def importar_bolsistas_ui(df, tipo, preserve_status=False, previa=False):
+    """Na interface: calcula a prévia (nada é gravado) ou agenda a importação em segundo plano."""
+    if previa:
+        with st.spinner("Calculando prévia..."):
+            st.session_state['previa_bolsistas'] = calcular_diff_bolsistas(df, preserve_status)
+            st.session_state['previa_bolsistas_tipo'] = tipo
+    else:
+        iniciar_job(tipo, 'bolsistas', processar_importacao_df, df, preserve_status=preserve_status)
+
+def render_previa_bolsistas(key):
+    """Prévia guardada na sessão: aplica o diff já calculado (sem reprocessar a planilha) ou descarta."""
+    diff = st.session_state.get('previa_bolsistas')
+    if not diff:
+        return
+    tipo = st.session_state.get('previa_bolsistas_tipo', "Importação")
+    st.markdown(f"#### 🔍 Prévia: {tipo} (nada foi gravado ainda)")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("➕ Novos", len(diff['novos']))
+    c2.metric("✏️ Alterados", len(diff['alterados']))
+    c3.metric("✔️ Sem mudança", diff['sem_mudanca'])
+    c4.metric("⚠️ Rejeitadas", diff['rejeitadas'])
+    st.caption(
+        ("🔒 Status/Checagem/Obs do sistema serão preservados." if diff['preserve_status']
+         else "⚠️ Status/Checagem/Obs serão sobrescritos pela planilha.")
+        + (f" {diff['repetidas']} matrículas aparecem mais de uma vez na planilha (as linhas de baixo prevalecem)." if diff['repetidas'] else "")
+    )
+    colunas = diff['colunas']
+    for aviso in MAPEADOR_BOLSISTAS.descrever(colunas):
+        st.warning(aviso)
+    with st.expander(f"🧭 Colunas da planilha ({len(colunas['renomear'])} reconhecidas, {len(colunas['nao_mapeadas'])} ignoradas)"):
+        st.markdown(" · ".join(f"`{origem}` → **{destino}**" for origem, destino in colunas['renomear'].items()) or "Nenhuma coluna reconhecida.")
+        if colunas['nao_mapeadas']:
+            st.caption("Ignoradas: " + ", ".join(map(str, colunas['nao_mapeadas'])))
+        if colunas['ausentes']:
+            st.caption("Sem coluna na planilha (não alterados): " + ", ".join(colunas['ausentes']))
+
+    tab_alt, tab_novos, tab_inv = st.tabs([
+        f"✏️ Alterações ({len(diff['mudancas'])})", f"➕ Novos ({len(diff['novos'])})", f"⚠️ Validação ({len(diff['invalidos'])})"
+    ])
+    with tab_alt:
+        mudancas = diff['mudancas'].assign(
+            atual=diff['mudancas']['atual'].map(_texto_celula), novo=diff['mudancas']['novo'].map(_texto_celula)
+        )
+        exibir_tabela(mudancas, rotulos={'matricula': 'Matrícula', 'nome': 'Nome', 'coluna': 'Coluna', 'atual': 'Atual', 'novo': 'Novo'},
+                      hide_index=True, use_container_width=True, height=300)
+    with tab_novos:
+        exibir_tabela(diff['novos'][['matricula', 'nome', 'diretoria', 'curso', 'situacao']],
+                      rotulos={'matricula': 'Matrícula', 'nome': 'Nome', 'diretoria': 'Diretoria', 'curso': 'Curso', 'situacao': 'Situação'},
+                      hide_index=True, use_container_width=True, height=300)
+    with tab_inv:
+        st.caption("Erros rejeitam a linha; avisos só apontam o valor (a linha é importada).")
+        exibir_tabela(diff['invalidos'], inteiro=['linha'], rotulos=ROTULOS_RELATORIO_VALIDACAO,
+                      hide_index=True, use_container_width=True, height=300)
+        if len(diff['invalidos']):
+            botao_exportar("📥 Baixar relatório de validação", lambda: {'Validação': diff['invalidos']},
+                           "validacao_bolsistas.xlsx", ("validacao_previa", key), lambda: _assinatura_dataframe(diff['invalidos']),
+                           formatos=("Excel", "CSV (pt-BR)"), key=f"{key}_validacao")
+
+    col_aplicar, col_descartar, _ = st.columns([1, 1, 3])
+    with col_aplicar:
+        nada_a_fazer = not len(diff['novos']) and not len(diff['alterados'])
+        if st.button("✅ Aplicar alterações", type="primary", use_container_width=True, disabled=nada_a_fazer, key=f"{key}_aplicar"):
+            st.session_state.pop('previa_bolsistas')
+            iniciar_job(tipo, 'bolsistas', aplicar_diff_bolsistas, diff)
+            st.rerun()
+    with col_descartar:
+        if st.button("🗑️ Descartar prévia", use_container_width=True, key=f"{key}_descartar"):
+            st.session_state.pop('previa_bolsistas')
+            st.rerun()
+
+ROTULOS_RELATORIO_VALIDACAO = {'origem': 'Arquivo/Aba', 'linha': 'Linha no Excel', 'matricula': 'Matrícula', 'coluna': 'Coluna',
+                               'valor': 'Valor na planilha', 'gravidade': 'Gravidade', 'motivo': 'Motivo'}
+
+def render_relatorio_validacao(dataset, job):
+    """Resumo e download do relatório de validação gravado pela importação do job."""
+    resultado = job['resultado'] if isinstance(job['resultado'], dict) else {}
+    erros, avisos = resultado.get('erros', 0), resultado.get('avisos_validacao', 0)
+    if not erros and not avisos:
+        return
+    st.info(f"🧪 Validação: {erros} linhas rejeitadas e {avisos} avisos.")
+    botao_exportar("📥 Baixar relatório de validação",
+                   lambda: {'Validação': carregar_relatorio_validacao(dataset).rename(columns=ROTULOS_RELATORIO_VALIDACAO)},
+                   f"validacao_{dataset}.xlsx", ("validacao", dataset), job['id'],
+                   formatos=("Excel", "CSV (pt-BR)"), key=f"validacao_{dataset}")
+
+def render_status_job(dataset):
+    """Progresso do job ativo do dataset, ou o resultado do último (se recente)."""
+    job = ultimo_job(dataset)
+    if job is None:
+        return
+    if job['status'] in STATUS_JOBS_ATIVOS:
+        _acompanhar_job(dataset)
+        return
+    if not job['finalizado_em'] or datetime.now() - job['finalizado_em'] > timedelta(minutes=MINUTOS_EXIBIR_JOB_FINALIZADO):
+        return
+    quando = descrever_idade(job['finalizado_em'])
+    if job['status'] == 'CONCLUIDO':
+        st.success(f"{job['mensagem']} ({job['tipo']}, {quando})")
+        resultado = job['resultado'] if isinstance(job['resultado'], dict) else {}
+        for aviso in resultado.get('avisos', []):
+            st.warning(aviso)
+        if resultado.get('arquivos'):
+            with st.expander("📄 Detalhes por arquivo/aba", expanded=False):
+                exibir_tabela(
+                    pd.DataFrame(resultado['arquivos']),
+                    inteiro=['linhas', 'validas', 'rejeitadas', 'duplicadas'],
+                    rotulos={'arquivo': 'Arquivo', 'aba': 'Aba', 'linhas': 'Linhas', 'validas': 'Válidas', 'rejeitadas': 'Rejeitadas',
+                             'duplicadas': 'Duplicadas', 'segundos_leitura': 'Leitura (s)', 'segundos_preparo': 'Preparo (s)'},
+                    hide_index=True, use_container_width=True
+                )
+        render_relatorio_validacao(dataset, job)
+    else:
+        st.error(f"❌ {job['tipo']} falhou ({quando}): {job['mensagem']}")
+
+def _consulta_bolsistas(situacao=None, diretoria=None, busca=None, ano_ref=None):
+    """SELECT (sem ORDER BY) e parâmetros dos bolsistas filtrados; base da listagem e da conferência."""
     query = "SELECT * FROM bolsistas WHERE 1=1"
     params = []
     if situacao and situacao != "Todos":
@@ -1185,13 +3353,230 @@ def listar_bolsistas(situacao=None, diretoria=None, busca=None, ano_ref=None):
         query += " AND ano_referencia = ?"
         params.append(ano_ref)
     if busca:
-        query += " AND (nome LIKE ? OR matricula LIKE ?)"
-        params.extend([f'%{busca}%', f'%{busca}%'])
-    query += " ORDER BY nome"
-    df = pd.read_sql_query(query, conn, params=params)
+        filtro, params_busca = filtro_busca_sql(busca)
+        query += f" AND {filtro}"
+        params.extend(params_busca)
+    return query, params
+
+def listar_bolsistas(situacao=None, diretoria=None, busca=None, ano_ref=None):
+    query, params = _consulta_bolsistas(situacao, diretoria, busca, ano_ref)
+    conn = get_conn()
+    df = ler_sql_tipado(query + " ORDER BY nome", conn, SCHEMA_BOLSISTAS, params=params)
     conn.close()
     return df
 
+# Status da conferência de cada bolsista no mês, a partir do pagamento gravado (ou da falta dele)
+SQL_STATUS_CONFERENCIA = """
+    CASE p.status WHEN 'PAGO' THEN '✅ PAGO' WHEN 'PENDENTE' THEN '❌ PENDENTE' ELSE '⏳ AGUARDANDO' END
+"""
+
+def listar_conferencia(mes, ano, situacao=None, busca=None):
+    """
+    Bolsistas filtrados com o status de conferência do mês (coluna status_conf), num único LEFT JOIN
+    com pagamentos; o UNIQUE(bolsista_id, mes, ano) garante no máximo um pagamento por bolsista.
+    """
+    query, params = _consulta_bolsistas(situacao=situacao, busca=busca)
+    conn = get_conn()
+    df = ler_sql_tipado(f"""
+        SELECT b.*, {SQL_STATUS_CONFERENCIA} AS status_conf
+        FROM ({query}) b
+        LEFT JOIN pagamentos p ON p.bolsista_id = b.id AND p.mes = ? AND p.ano = ?
+        ORDER BY b.nome
+    """, conn, SCHEMA_BOLSISTAS, params=params + [int(mes), int(ano)])
+    conn.close()
+    return df
+
+def contar_conferencia(mes, ano, situacao=None, busca=None):
+    """Métricas da conferência do mês num só agregado: {'total', 'pagos', 'pendentes', 'aguardando'}."""
+    query, params = _consulta_bolsistas(situacao=situacao, busca=busca)
+    conn = get_conn()
+    total, pagos, pendentes = conn.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM(p.status = 'PAGO'), 0), COALESCE(SUM(p.status = 'PENDENTE'), 0)
+        FROM ({query}) b
+        LEFT JOIN pagamentos p ON p.bolsista_id = b.id AND p.mes = ? AND p.ano = ?
+    """, params + [int(mes), int(ano)]).fetchone()
+    conn.close()
+    return {'total': total, 'pagos': pagos, 'pendentes': pendentes, 'aguardando': total - pagos - pendentes}
+
+ROTULOS_FONTE_EXTRATO = {'CONFERENCIA': '✅ Conferência', 'EXCEL': '📁 Excel', 'LEGADO': '📦 Legado'}
+
+def carregar_extrato_bolsista(matricula):
+    """
+    Extrato do bolsista pela view extrato_bolsistas: uma linha por competência (ano, mes, valor, status, fonte),
+    a da fonte de maior prioridade, da mais recente para a mais antiga. Uma consulta pelos índices de matrícula.
+    """
+    conn = get_conn()
+    try:
+        return pd.read_sql_query("""
+            WITH extrato AS (
+                SELECT ano, mes, valor, status, fonte,
+                       ROW_NUMBER() OVER (PARTITION BY ano, mes ORDER BY prioridade) AS ordem
+                FROM extrato_bolsistas WHERE matricula = ?
+            )
+            SELECT ano, mes, valor, status, fonte FROM extrato WHERE ordem = 1 ORDER BY ano DESC, mes DESC
+        """, conn, params=(str(matricula).strip(),))
+    finally:
+        conn.close()
+
+# ---------------------------------------------------------------------------
+# Fechamento do Mês em Lote (um comando SQL por ação, um backup e uma linha no diário)
+# ---------------------------------------------------------------------------
+FECHAMENTO_APROVAR = "Aprovar aguardando"
+FECHAMENTO_REPETIR = "Repetir mês anterior"
+FECHAMENTO_INATIVOS = "Zerar inativos"
+FECHAMENTO_TABELA = "Tabela de conferência"
+# Situações tratadas como inativas (card da Conferência e "Zerar inativos"); INATIVO é o legado
+SITUACOES_INATIVAS = ("INATIVO", "CONCLUIDO", "CANCELADO", "DESISTENCIA", "TRANCADO")
+# Backups das ações em lote ficam fora do rodízio dos automáticos (o diário aponta para eles),
+# num rodízio próprio e mais longo: cada um é uma cópia inteira do banco, anexos incluídos
+PASTA_BACKUPS_FECHAMENTO = os.path.join("backups", "fechamento")
+MANTER_BACKUPS_FECHAMENTO = 30
+
+def mes_anterior(mes, ano):
+    """(mês, ano) da competência anterior."""
+    return (12, ano - 1) if mes == 1 else (mes - 1, ano)
+
+def _sql_fechamento(acao, mes, ano, situacao, busca):
+    """INSERT ... SELECT (e parâmetros) de cada ação; o UNIQUE(bolsista_id, mes, ano) decide quem já foi conferido."""
+    query, params = _consulta_bolsistas(situacao=situacao, busca=busca)
+    if acao == FECHAMENTO_APROVAR:
+        # Só quem está aguardando: INSERT OR IGNORE pula quem já tem PAGO/PENDENTE no mês.
+        # Valor cheio do boleto (100%), como no card; o reembolso sai de valor * porcentagem.
+        # Sem mensalidade cadastrada não há valor a aprovar: fica aguardando (ver _sem_valor_fechamento)
+        return f"""
+            INSERT OR IGNORE INTO pagamentos (bolsista_id, mes, ano, valor, status)
+            SELECT b.id, ?, ?, b.mensalidade, 'PAGO' FROM ({query}) b WHERE b.mensalidade IS NOT NULL
+        """, [mes, ano] + params
+    if acao == FECHAMENTO_REPETIR:
+        mes_ant, ano_ant = mes_anterior(mes, ano)
+        return f"""
+            INSERT OR IGNORE INTO pagamentos (bolsista_id, mes, ano, valor, status)
+            SELECT p.bolsista_id, ?, ?, p.valor, p.status
+            FROM pagamentos p JOIN ({query}) b ON b.id = p.bolsista_id
+            WHERE p.mes = ? AND p.ano = ?
+        """, [mes, ano] + params + [mes_ant, ano_ant]
+    if acao == FECHAMENTO_INATIVOS:
+        # Todos os inativos, independente do filtro da tela; sobrescreve o que houver no mês
+        return f"""
+            INSERT OR REPLACE INTO pagamentos (bolsista_id, mes, ano, valor, status)
+            SELECT id, ?, ?, 0, 'PENDENTE' FROM bolsistas WHERE situacao IN ({', '.join('?' * len(SITUACOES_INATIVAS))})
+        """, [mes, ano, *SITUACOES_INATIVAS]
+    raise ValueError(f"Ação de fechamento desconhecida: {acao}")
+
+def _sem_valor_fechamento(conn, mes, ano, situacao, busca):
+    """Quantos aguardando do filtro o "Aprovar" deixa de fora por não terem mensalidade cadastrada."""
+    query, params = _consulta_bolsistas(situacao=situacao, busca=busca)
+    return conn.execute(f"""
+        SELECT COUNT(*) FROM ({query}) b
+        WHERE b.mensalidade IS NULL
+          AND NOT EXISTS (SELECT 1 FROM pagamentos p WHERE p.bolsista_id = b.id AND p.mes = ? AND p.ano = ?)
+    """, params + [mes, ano]).fetchone()[0]
+
+def _backup_fechamento():
+    """Backup antes de uma ação em lote, no rodízio próprio; devolve o caminho (None se falhar)."""
+    if not os.path.exists("bolsas.db"):
+        return None
+    try:
+        return _copiar_banco(PASTA_BACKUPS_FECHAMENTO, manter=MANTER_BACKUPS_FECHAMENTO)
+    except Exception as e:
+        logger.error(f"Falha no backup do fechamento: {e}")
+        return None
+
+def _registrar_fechamento(conn, acao, mes, ano, filtro, linhas, backup, usuario, ignorados=0):
+    conn.execute(
+        "INSERT INTO diario_conferencia (acao, mes, ano, filtro, linhas, ignorados, backup, usuario, executado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (acao, mes, ano, json.dumps(filtro, ensure_ascii=False) if filtro else None, linhas, ignorados, backup, usuario,
+         datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+
+def fechar_mes_em_lote(acao, mes, ano, situacao=None, busca=None, usuario=None):
+    """
+    Executa uma ação de fechamento do mês como um único INSERT ... SELECT, depois de um backup,
+    e registra a ação no diario_conferencia na mesma transação.
+    Devolve (linhas gravadas, aguardando deixados de fora por falta de mensalidade).
+    """
+    mes, ano = int(mes), int(ano)
+    sql, params = _sql_fechamento(acao, mes, ano, situacao, busca)
+    backup = _backup_fechamento()
+    conn = get_conn()
+    try:
+        with conn:
+            ignorados = _sem_valor_fechamento(conn, mes, ano, situacao, busca) if acao == FECHAMENTO_APROVAR else 0
+            linhas = conn.execute(sql, params).rowcount
+            filtro = None if acao == FECHAMENTO_INATIVOS else {'situacao': situacao, 'busca': busca}
+            _registrar_fechamento(conn, acao, mes, ano, filtro, linhas, backup, usuario, ignorados)
+    finally:
+        conn.close()
+    return linhas, ignorados
+
+def salvar_tabela_conferencia(mes, ano, decisoes, usuario=None):
+    """Grava as decisões da tabela editável [(bolsista_id, valor, status)] num executemany, com backup e diário."""
+    mes, ano = int(mes), int(ano)
+    backup = _backup_fechamento()
+    conn = get_conn()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO pagamentos (bolsista_id, mes, ano, valor, status) VALUES (?, ?, ?, ?, ?)',
+                [(int(bolsista_id), mes, ano, valor, status) for bolsista_id, valor, status in decisoes]
+            )
+            _registrar_fechamento(conn, FECHAMENTO_TABELA, mes, ano, None, len(decisoes), backup, usuario)
+    finally:
+        conn.close()
+    return len(decisoes)
+
+ROTULOS_DIARIO_CONFERENCIA = {
+    'executado_em': 'Quando', 'acao': 'Ação', 'linhas': 'Registros', 'ignorados': 'Sem valor', 'usuario': 'Usuário',
+    'filtro': 'Filtro', 'backup': 'Backup',
+}
+
+def carregar_diario_conferencia(mes, ano, limite=20):
+    """Últimas ações em lote da competência, da mais recente para a mais antiga.
+    O backup que já saiu do rodízio continua listado, marcado como removido."""
+    conn = get_conn()
+    try:
+        diario = pd.read_sql_query(
+            "SELECT executado_em, acao, linhas, ignorados, usuario, filtro, backup FROM diario_conferencia "
+            "WHERE mes = ? AND ano = ? ORDER BY id DESC LIMIT ?",
+            conn, params=(int(mes), int(ano), limite)
+        )
+    finally:
+        conn.close()
+    diario['backup'] = [c if not c or os.path.exists(c) else f"{c} (removido no rodízio)" for c in diario['backup']]
+    return diario
+
+def render_fechamento_lote(mes_num, ano, situacao, busca, aguardando):
+    """Ações de fechamento do mês sobre o filtro atual da Conferência, com o diário da competência."""
+    if 'fechamento_msg' in st.session_state:
+        st.success(st.session_state.pop('fechamento_msg'))
+    with st.expander("⚡ Fechamento do mês em lote", expanded=False):
+        mes_ant, ano_ant = mes_anterior(int(mes_num), int(ano))
+        st.caption("Aprovar e repetir valem para o filtro de situação e busca acima; zerar vale para todos os inativos. "
+                   "Cada ação faz um backup do banco e fica registrada no diário.")
+        acoes = [
+            (FECHAMENTO_APROVAR, f"✅ Aprovar {aguardando} aguardando",
+             "PAGO com o valor cheio do boleto (mensalidade) cadastrado; quem não tem mensalidade continua aguardando", aguardando == 0),
+            (FECHAMENTO_REPETIR, f"⏮️ Repetir {MESES[mes_ant - 1]}/{ano_ant}", "Copia PAGO/PENDENTE e valor de quem ainda está aguardando", aguardando == 0),
+            (FECHAMENTO_INATIVOS, "🚫 Zerar inativos", f"PENDENTE com R$ 0,00 para {', '.join(SITUACOES_INATIVAS)}, sobrescrevendo o que houver no mês", False),
+        ]
+        for coluna, (acao, rotulo, ajuda, desabilitado) in zip(st.columns(len(acoes)), acoes):
+            with coluna:
+                if st.button(rotulo, help=ajuda, disabled=desabilitado, use_container_width=True, key=f"lote_{acao}"):
+                    inicio = time.perf_counter()
+                    linhas, ignorados = fechar_mes_em_lote(acao, mes_num, ano, situacao, busca, usuario=st.session_state.get('username'))
+                    st.session_state.fechamento_msg = (
+                        f"{acao}: {linhas} registros gravados em {time.perf_counter() - inicio:.2f}s."
+                        + (f" {ignorados} sem mensalidade cadastrada continuam aguardando." if ignorados else "")
+                    )
+                    # A tabela editável recomeça a partir do que foi gravado
+                    st.session_state.table_key_version = st.session_state.get('table_key_version', 0) + 1
+                    st.rerun()
+
+        diario = carregar_diario_conferencia(mes_num, ano)
+        if not diario.empty:
+            st.markdown("##### 📒 Diário da competência")
+            exibir_tabela(diario, inteiro=['linhas', 'ignorados'], rotulos=ROTULOS_DIARIO_CONFERENCIA, hide_index=True)
+
 def get_diretorias():
     """Busca as diretorias únicas do Organograma (Coluna C física)"""
     df_org = carregar_organograma()
@@ -1242,8 +3627,9 @@ def get_anos_referencia():
     finally:
         conn.close()
 
+@st.cache_data
 def gerar_template_excel():
-    """Gera um template Excel vazio com as colunas corretas para importação"""
+    """Gera um template Excel vazio com as colunas corretas para importação (estático, gerado uma vez)"""
     cols = ['MATRÍCULA', 'NOME', 'CPF', 'DIRETORIA', 'CURSO', 'INSTITUIÇÃO', 
             'TIPO', 'MODALIDADE', 'INÍCIO CURSO', 'FIM CURSO', 'ANO PROGRAMA', 
             'MENSALIDADE', '% BOLSA', 'VALOR REEMBOLSO', 'SITUAÇÃO', 'OBSERVAÇÃO']
@@ -1308,6 +3694,258 @@ DIRETORIAS = ["DIRETORIA AGRICOLA", "DIRETORIA INDUSTRIAL", "DIRETORIA ADMINISTR
               "DIRETORIA GENTE E GESTAO", "DIRETORIA FINANCEIRA", "DIRETORIA CSC GRCI",
               "DIRETORIA COMERCIAL NOVOS PRODUTOS"]
 
+# ---------------------------------------------------------------------------
+# Dados do Dashboard (GROUP BY projetados no SQL, cache por filtro e versão)
+# ---------------------------------------------------------------------------
+# Mesma regra de get_safra (abril abre a safra), calculada no próprio SQL
+SQL_SAFRA = (
+    "CASE WHEN mes >= 4 THEN CAST(ano AS INTEGER) || '/' || (CAST(ano AS INTEGER) + 1) "
+    "ELSE (CAST(ano AS INTEGER) - 1) || '/' || CAST(ano AS INTEGER) END"
+)
+
+def carregar_resumo_bolsistas_dashboard():
+    """
+    Indicadores e rankings dos bolsistas não inativos para o Dashboard, um GROUP BY por widget.
+    Só os agregados saem do banco; compartilhados entre sessões até a próxima escrita em bolsistas.
+    """
+    def construir():
+        conn = get_conn()
+        try:
+            nao_inativos, ativos, ativos_grad, invest_mensal = conn.execute("""
+                SELECT COUNT(*),
+                       COALESCE(SUM(situacao = 'ATIVO'), 0),
+                       COALESCE(SUM(situacao = 'ATIVO' AND tipo = 'GRADUACAO'), 0),
+                       TOTAL(CASE WHEN situacao = 'ATIVO' THEN valor_reembolso END)
+                FROM bolsistas WHERE situacao != 'INATIVO'
+            """).fetchone()
+            diretorias = pd.read_sql_query("""
+                SELECT diretoria, TOTAL(valor_reembolso) AS valor_reembolso, COUNT(matricula) AS matricula
+                FROM bolsistas WHERE situacao = 'ATIVO' AND TRIM(diretoria) != ''
+                GROUP BY diretoria ORDER BY valor_reembolso
+            """, conn)
+            contagens = {}
+            for coluna, rotulo, limite in (('tipo', 'Tipo', -1), ('modalidade', 'Modalidade', -1),
+                                           ('instituicao', 'Instituição', 5), ('curso', 'Curso', 10)):
+                contagens[coluna] = pd.read_sql_query(f"""
+                    SELECT {coluna} AS "{rotulo}", COUNT(*) AS qtd FROM bolsistas
+                    WHERE situacao != 'INATIVO' AND {coluna} IS NOT NULL
+                    GROUP BY {coluna} ORDER BY qtd DESC, {coluna} LIMIT {limite}
+                """, conn)
+            custo_cursos = pd.read_sql_query("""
+                SELECT curso AS "Curso", AVG(valor_reembolso) AS "Valor" FROM bolsistas
+                WHERE situacao != 'INATIVO' AND curso IS NOT NULL
+                GROUP BY curso ORDER BY "Valor" DESC, curso LIMIT 10
+            """, conn)
+        finally:
+            conn.close()
+        return {
+            'nao_inativos': nao_inativos,
+            'ativos': ativos,
+            'ativos_graduacao': ativos_grad,
+            'investimento_mensal': invest_mensal,
+            'diretorias': diretorias,
+            'tipos': contagens['tipo'].rename(columns={'qtd': 'Qtd'}),
+            'modalidades': contagens['modalidade'].rename(columns={'qtd': 'Qtd'}),
+            'instituicoes': contagens['instituicao'].rename(columns={'qtd': 'Alunos'}),
+            'cursos_alunos': contagens['curso'].rename(columns={'qtd': 'Valor'}),
+            'cursos_custo': custo_cursos,
+        }
+
+    chave = ("dashboard_bolsistas", versao_dados('bolsistas'))
+    return obter_cache_compartilhado().obter(chave, construir)
+
+def carregar_pagamentos_mensais():
+    """Total e quantidade de pagamentos por mês (com safra), agregados no SQL a partir do historico_pagamentos."""
+    def construir():
+        conn = get_conn()
+        try:
+            df = pd.read_sql_query(f"""
+                SELECT CAST(ano AS INTEGER) AS ano, CAST(mes AS INTEGER) AS mes, {SQL_SAFRA} AS safra,
+                       TOTAL(valor) AS valor, COUNT(*) AS pagamentos
+                FROM historico_pagamentos WHERE ano IS NOT NULL AND mes IS NOT NULL
+                GROUP BY 1, 2 ORDER BY 1, 2
+            """, conn)
+        finally:
+            conn.close()
+        df['data'] = pd.to_datetime(pd.DataFrame({'year': df['ano'], 'month': df['mes'], 'day': 1}))
+        return df
+
+    chave = ("pagamentos_mensais", versao_dados('historico_pagamentos'))
+    return obter_cache_compartilhado().obter(chave, construir)
+
+def resumo_pagamentos_dashboard(filtro="Safra", selecao="Todas"):
+    """
+    Total pago, quantidade de pagamentos e evolução mensal para a safra/ano escolhido no Dashboard.
+    Cache por filtro e versão do histórico; o recorte parte dos totais mensais, nunca das linhas.
+    """
+    versao = versao_dados('historico_pagamentos')
+
+    def construir():
+        mensal = carregar_pagamentos_mensais()
+        if selecao != "Todas":
+            mensal = mensal[mensal['safra' if filtro == "Safra" else 'ano'] == selecao]
+        return {
+            'total': float(mensal['valor'].sum()),
+            'pagamentos': int(mensal['pagamentos'].sum()),
+            'evolucao': mensal[['data', 'valor']].reset_index(drop=True),
+        }
+
+    return obter_cache_compartilhado().obter(("dashboard_pagamentos", versao, filtro, selecao), construir)
+
+# ---------------------------------------------------------------------------
+# Conciliação da Folha (aprovados na Conferência x pagos no historico_pagamentos)
+# ---------------------------------------------------------------------------
+# Diferença aceita (R$) entre o aprovado (boleto x % da bolsa) e o total pago na folha do mês
+TOLERANCIA_CONCILIACAO = float(os.environ.get("BOLSAS_TOLERANCIA_CONCILIACAO", "1.00"))
+
+APROVADO_NAO_PAGO = "Aprovado e não pago"
+PAGO_SEM_APROVACAO = "Pago sem aprovação"
+VALOR_DIVERGENTE = "Valor divergente"
+LINHA_DUPLICADA = "Linha duplicada na folha"
+TIPOS_CONCILIACAO = [APROVADO_NAO_PAGO, PAGO_SEM_APROVACAO, VALOR_DIVERGENTE, LINHA_DUPLICADA]
+
+COLUNAS_CONCILIACAO = ['tipo', 'matricula', 'nome', 'ano', 'mes', 'valor_boleto', 'porcentagem',
+                       'valor_aprovado', 'valor_folha', 'diferenca', 'linhas_folha', 'detalhe']
+ROTULOS_CONCILIACAO = {
+    'tipo': 'Exceção', 'matricula': 'Matrícula', 'nome': 'Nome', 'ano': 'Ano', 'mes': 'Mês',
+    'valor_boleto': 'Boleto (100%)', 'porcentagem': '% Bolsa', 'valor_aprovado': 'Aprovado',
+    'valor_folha': 'Pago na Folha', 'diferenca': 'Diferença', 'linhas_folha': 'Linhas na Folha', 'detalhe': 'Detalhe',
+}
+
+def _filtro_safra_sql(safra):
+    """WHERE (e parâmetros) de uma safra 'AAAA/AAAA' sobre colunas ano/mes; None = todo o período."""
+    if not safra:
+        return "1=1", []
+    ano_inicio = int(str(safra).split('/')[0])
+    return "((ano = ? AND mes >= 4) OR (ano = ? AND mes <= 3))", [ano_inicio, ano_inicio + 1]
+
+def safras_conciliacao():
+    """Safras com aprovação na Conferência ou pagamento na folha, da mais recente para a mais antiga."""
+    conn = get_conn()
+    try:
+        linhas = conn.execute(f"""
+            SELECT {SQL_SAFRA} FROM pagamentos WHERE status = 'PAGO'
+            UNION SELECT {SQL_SAFRA} FROM historico_pagamentos WHERE ano IS NOT NULL AND mes IS NOT NULL
+        """).fetchall()
+    finally:
+        conn.close()
+    return sorted((s for (s,) in linhas if s), reverse=True)
+
+def conciliar_folha(safra=None, tolerancia=TOLERANCIA_CONCILIACAO):
+    """
+    Cruza os pagamentos aprovados (status PAGO) com a folha importada, por (matrícula, ano, mês),
+    num hash join em memória sobre colunas projetadas. Devolve só as exceções (COLUNAS_CONCILIACAO):
+    aprovado sem folha, folha sem aprovação, total da folha fora da tolerância em relação a
+    boleto x % da bolsa, e linhas repetidas na folha (mesma matrícula, competência e valor).
+    """
+    filtro, params = _filtro_safra_sql(safra)
+    conn = get_conn()
+    try:
+        aprovados = pd.read_sql_query(f"""
+            SELECT TRIM(b.matricula) AS matricula, b.nome, p.ano, p.mes, p.valor AS valor_boleto,
+                   b.porcentagem, p.valor * b.porcentagem AS valor_aprovado
+            FROM (SELECT bolsista_id, ano, mes, valor FROM pagamentos WHERE status = 'PAGO' AND {filtro}) p
+            JOIN bolsistas b ON b.id = p.bolsista_id
+        """, conn, params=params)
+        folha = pd.read_sql_query(f"""
+            SELECT TRIM(matricula) AS matricula, nome, ano, mes, valor
+            FROM historico_pagamentos WHERE matricula IS NOT NULL AND {filtro}
+        """, conn, params=params)
+    finally:
+        conn.close()
+
+    chaves = ['matricula', 'ano', 'mes']
+    folha['valor'] = folha['valor'].fillna(0.0)
+
+    # Linhas repetidas: mesma matrícula, competência e valor lançados mais de uma vez
+    repetidas = folha[folha.duplicated(chaves + ['valor'], keep=False)]
+    duplicadas = (
+        repetidas.groupby(chaves + ['valor'], sort=False)
+        .agg(nome=('nome', 'first'), linhas_folha=('valor', 'size'))
+        .reset_index()
+        .rename(columns={'valor': 'valor_linha'})
+    )
+    duplicadas = duplicadas.assign(
+        tipo=LINHA_DUPLICADA,
+        valor_folha=duplicadas['valor_linha'] * duplicadas['linhas_folha'],
+        detalhe=formatar_moeda_br(duplicadas['valor_linha']).astype(str) + " lançado " + duplicadas['linhas_folha'].astype(str) + " vezes",
+    )
+
+    pagos = folha.groupby(chaves, sort=False).agg(
+        nome_folha=('nome', 'first'), valor_folha=('valor', 'sum'), linhas_folha=('valor', 'size')
+    ).reset_index()
+    cruzado = aprovados.merge(pagos, on=chaves, how='outer', indicator=True)
+    cruzado['nome'] = cruzado['nome'].fillna(cruzado['nome_folha'])
+    cruzado['diferenca'] = cruzado['valor_folha'] - cruzado['valor_aprovado']
+
+    so_aprovado = cruzado['_merge'] == 'left_only'
+    so_folha = cruzado['_merge'] == 'right_only'
+    # Sem valor do boleto ou sem % da bolsa o aprovado é desconhecido: também entra como divergência
+    divergente = (cruzado['_merge'] == 'both') & ~(cruzado['diferenca'].abs() <= tolerancia)
+    cruzado['tipo'] = np.select([so_aprovado, so_folha, divergente],
+                                [APROVADO_NAO_PAGO, PAGO_SEM_APROVACAO, VALOR_DIVERGENTE], default="")
+    cruzado['detalhe'] = np.select(
+        [so_aprovado, so_folha, divergente & cruzado['valor_boleto'].isna(), divergente & cruzado['porcentagem'].isna()],
+        ["Aprovado na Conferência, sem lançamento na folha do mês",
+         "Lançado na folha sem PAGO na Conferência do mês",
+         "PAGO na Conferência sem valor do boleto",
+         "% da bolsa não cadastrado"],
+        default="Folha difere de boleto x % da bolsa",
+    )
+
+    excecoes = pd.concat([cruzado[cruzado['tipo'] != ""], duplicadas], ignore_index=True)
+    excecoes['tipo'] = pd.Categorical(excecoes['tipo'], categories=TIPOS_CONCILIACAO)
+    return (excecoes.reindex(columns=COLUNAS_CONCILIACAO)
+            .sort_values(['tipo', 'ano', 'mes', 'matricula'], ignore_index=True))
+
+def carregar_conciliacao(safra=None, tolerancia=TOLERANCIA_CONCILIACAO):
+    """Exceções da conciliação em cache, até a próxima escrita em pagamentos, bolsistas ou na folha."""
+    versao = versao_dados('pagamentos', 'bolsistas', 'historico_pagamentos')
+    return obter_cache_compartilhado().obter(
+        ("conciliacao", versao, safra, tolerancia), lambda: conciliar_folha(safra, tolerancia)
+    )
+
+def render_conciliacao(safra_padrao=None):
+    """Resumo, filtro e exportação das exceções da conciliação de uma safra."""
+    safras = safras_conciliacao()
+    if not safras:
+        st.info("Sem pagamentos aprovados nem folha importada para conciliar.")
+        return
+    opcoes = safras + ["Todas"]
+    c_safra, c_tipo = st.columns([1, 2])
+    with c_safra:
+        safra = st.selectbox("📅 Safra", opcoes, index=opcoes.index(safra_padrao) if safra_padrao in opcoes else 0,
+                             key="conciliacao_safra")
+    safra = None if safra == "Todas" else safra
+
+    excecoes = carregar_conciliacao(safra)
+    contagem = excecoes['tipo'].value_counts()
+    for coluna, tipo in zip(st.columns(len(TIPOS_CONCILIACAO)), TIPOS_CONCILIACAO):
+        with coluna:
+            st.metric(tipo, int(contagem.get(tipo, 0)))
+    st.caption(f"Tolerância: {format_br_currency(TOLERANCIA_CONCILIACAO)} entre o aprovado (boleto × % da bolsa) e o pago na folha.")
+
+    if excecoes.empty:
+        st.success("✅ Nenhuma exceção: aprovações e folha conferem.")
+        return
+    with c_tipo:
+        tipos = st.multiselect("Exceções", TIPOS_CONCILIACAO, default=TIPOS_CONCILIACAO, key="conciliacao_tipos")
+    exibir_tabela(
+        excecoes[excecoes['tipo'].isin(tipos)],
+        moeda=['valor_boleto', 'valor_aprovado', 'valor_folha', 'diferenca'], percentual=['porcentagem'],
+        inteiro=['ano', 'mes', 'linhas_folha'], rotulos=ROTULOS_CONCILIACAO, hide_index=True, height=450
+    )
+    botao_exportar(
+        "📥 Baixar exceções da conciliação",
+        lambda: {'Conciliação': excecoes.rename(columns=ROTULOS_CONCILIACAO)},
+        f"CONCILIACAO_{(safra or 'TODAS').replace('/', '-')}.xlsx",
+        chave=("conciliacao", safra, TOLERANCIA_CONCILIACAO),
+        versao=versao_dados('pagamentos', 'bolsistas', 'historico_pagamentos'),
+        moeda=[ROTULOS_CONCILIACAO[c] for c in ('valor_boleto', 'valor_aprovado', 'valor_folha', 'diferenca')],
+        percentual=[ROTULOS_CONCILIACAO['porcentagem']],
+        formatos=("Excel", "CSV (pt-BR)"), key="exp_conciliacao"
+    )
+
 # CSS MODERNO - AZUL E VERDE
 
 
@@ -1315,22 +3953,16 @@ def render_dashboard_geral():
     """Renderiza a página principal de Dashboard com indicadores completos."""
     st.markdown("### 📊 Dashboard Estratégico")
     
-    # Carregar dados
-    conn = get_conn()
-    df_bolsistas = pd.read_sql_query("SELECT * FROM bolsistas WHERE situacao != 'INATIVO'", conn)
+    # Só agregados (GROUP BY no SQL, em cache por versão); as tabelas brutas não são lidas aqui
+    resumo = carregar_resumo_bolsistas_dashboard()
+    tem_bolsistas = resumo['nao_inativos'] > 0
     
-    # Busca TODO histórico para análises (sem travar em ano_atual-1, pois user quer safras)
-    df_hist = pd.read_sql_query("SELECT mes, ano, valor FROM historico_pagamentos", conn)
-    conn.close()
-    
-    # Tratamentos
-    if not df_hist.empty:
-        df_hist['data'] = df_hist.apply(lambda x: datetime(int(x['ano']), int(x['mes']), 1), axis=1)
-        df_hist['safra'] = df_hist.apply(lambda x: get_safra(x['ano'], x['mes']), axis=1)
+    # Totais mensais de TODO o histórico (sem travar em ano_atual-1, pois user quer safras)
+    df_mensal = carregar_pagamentos_mensais()
     
     # --- FILTRO SAFRA ---
-    not_empty_hist = not df_hist.empty
-    sel_val_label = "Todas"
+    not_empty_hist = not df_mensal.empty
+    tipo_filtro, sel_val, sel_val_label = "Safra", "Todas", "Todas"
     
     if not_empty_hist:
         col_radio, col_sel, _ = st.columns([1, 1, 2])
@@ -1339,43 +3971,35 @@ def render_dashboard_geral():
             tipo_filtro = st.radio("Filtrar por:", ["Safra", "Ano"], horizontal=True, label_visibility="collapsed")
             
         if tipo_filtro == "Safra":
-            opts = sorted(df_hist['safra'].unique().tolist(), reverse=True)
+            opts = sorted(df_mensal['safra'].unique().tolist(), reverse=True)
             label = "📅 Selecione a Safra:"
-            curr_col = 'safra'
         else:
-            opts = sorted(df_hist['ano'].unique().tolist(), reverse=True)
+            opts = sorted(df_mensal['ano'].unique().tolist(), reverse=True)
             label = "📅 Selecione o Ano:"
-            curr_col = 'ano'
             
         with col_sel:
             sel_val = st.selectbox(label, ["Todas"] + opts)
             sel_val_label = str(sel_val)
-            
-        if sel_val != "Todas":
-            df_filtered_dash = df_hist[df_hist[curr_col] == sel_val]
-        else:
-            df_filtered_dash = df_hist
-    else:
-        df_filtered_dash = df_hist
-
+    
+    pagamentos = resumo_pagamentos_dashboard(tipo_filtro, sel_val)
         
     # KPI Cards Topo
     col1, col2, col3, col4 = st.columns(4)
     
-    total_ativos = len(df_bolsistas[df_bolsistas['situacao'] == 'ATIVO'])
+    total_ativos = resumo['ativos']
     
     # Nova Métrica: Total Pago no Período Selecionado (Baseado no histórico real)
-    total_pago_periodo = df_filtered_dash['valor'].sum() if not df_filtered_dash.empty else 0
+    total_pago_periodo = pagamentos['total']
     
-    avg_ticket = total_pago_periodo / len(df_filtered_dash) if len(df_filtered_dash) > 0 else 0
+    avg_ticket = total_pago_periodo / pagamentos['pagamentos'] if pagamentos['pagamentos'] > 0 else 0
     if sel_val_label == "Todas" or not not_empty_hist:
          # Se for todas, avg_ticket fica estranho somado tudo. Melhor manter logica anterior ou apenas snapshot?
          # Vamos manter snapshot para ticket medio, mas usar total pago para o card 2
-         total_invest_mensal_snap = df_bolsistas[df_bolsistas['situacao'] == 'ATIVO']['valor_reembolso'].sum()
+         total_invest_mensal_snap = resumo['investimento_mensal']
          avg_ticket = total_invest_mensal_snap / total_ativos if total_ativos > 0 else 0
     
     # % em Graduação
-    ativos_grad = len(df_bolsistas[(df_bolsistas['situacao'] == 'ATIVO') & (df_bolsistas['tipo'] == 'GRADUACAO')])
+    ativos_grad = resumo['ativos_graduacao']
     pct_grad = (ativos_grad / total_ativos * 100) if total_ativos > 0 else 0
     
     with col1:
@@ -1424,22 +4048,9 @@ def render_dashboard_geral():
     
     with c1:
         st.subheader("Investimento Estimado por Diretoria")
-        if not df_bolsistas.empty and 'diretoria' in df_bolsistas.columns:
-            # Filtrar apenas bolsistas ativos com diretoria válida
-            df_ativos_dir = df_bolsistas[
-                (df_bolsistas['situacao'] == 'ATIVO') & 
-                (df_bolsistas['diretoria'].notna()) & 
-                (df_bolsistas['diretoria'].str.strip() != '')
-            ].copy()
-            
-            # Agrupar por diretoria
-            if not df_ativos_dir.empty:
-                df_dir = df_ativos_dir.groupby('diretoria').agg({
-                    'valor_reembolso': 'sum',
-                    'matricula': 'count'
-                }).reset_index().sort_values('valor_reembolso', ascending=True)
-            else:
-                df_dir = pd.DataFrame()
+        if tem_bolsistas:
+            # Bolsistas ativos com diretoria válida, já agrupados e ordenados no SQL
+            df_dir = resumo['diretorias']
             
             # Criar gráfico apenas se houver dados
             if not df_dir.empty:
@@ -1455,13 +4066,12 @@ def render_dashboard_geral():
             
     with c2:
         st.subheader("Perfil dos Bolsistas")
-        if not df_bolsistas.empty:
+        if tem_bolsistas:
             tab_tipo, tab_mod = st.tabs(["Nível", "Modalidade"])
             
             with tab_tipo:
-                if 'tipo' in df_bolsistas.columns:
-                    df_ipo = df_bolsistas['tipo'].value_counts().reset_index()
-                    df_ipo.columns = ['Tipo', 'Qtd']
+                df_ipo = resumo['tipos']
+                if not df_ipo.empty:
                     # Degradê azul corporativo: do azul escuro ao claro
                     cores_azul = ['#1e3a5f', '#2c5282', '#3b6ba8', '#5a8ac7', '#7da9d9']
                     fig_pie1 = px.pie(df_ipo, values='Qtd', names='Tipo', hole=0.4, color_discrete_sequence=cores_azul)
@@ -1470,9 +4080,8 @@ def render_dashboard_geral():
                     st.plotly_chart(fig_pie1, use_container_width=True, config=PLOTLY_CONFIG)
             
             with tab_mod:
-                if 'modalidade' in df_bolsistas.columns:
-                    df_mod = df_bolsistas['modalidade'].value_counts().reset_index()
-                    df_mod.columns = ['Modalidade', 'Qtd']
+                df_mod = resumo['modalidades']
+                if not df_mod.empty:
                     # Degradê azul corporativo: do azul escuro ao claro
                     cores_azul = ['#1e3a5f', '#2c5282', '#3b6ba8', '#5a8ac7', '#7da9d9']
                     fig_pie2 = px.pie(df_mod, values='Qtd', names='Modalidade', hole=0.4, color_discrete_sequence=cores_azul)
@@ -1487,20 +4096,17 @@ def render_dashboard_geral():
     
     with c3:
         st.subheader("Evolução de Pagamentos (Realizado)")
-        if not df_filtered_dash.empty:
-            df_evo = df_filtered_dash.groupby('data')['valor'].sum().reset_index().sort_values('data')
-            render_area_chart(df_evo, 'data', 'valor', "")
+        if not pagamentos['evolucao'].empty:
+            render_area_chart(pagamentos['evolucao'], 'data', 'valor', "")
             # (Chart rendered inside function)
         else:
             st.info("Sem dados históricos de pagamento.")
             
     with c4:
         st.subheader("Top 5 Instituições")
-        if not df_bolsistas.empty and 'instituicao' in df_bolsistas.columns:
-            df_inst = df_bolsistas['instituicao'].value_counts().head(5).reset_index()
-            df_inst.columns = ['Instituição', 'Alunos']
+        if tem_bolsistas:
             # Sort para bar h
-            df_inst = df_inst.sort_values('Alunos', ascending=True) 
+            df_inst = resumo['instituicoes'].sort_values('Alunos', ascending=True) 
             
             render_bar_chart(
                 df_inst, 
@@ -1517,19 +4123,17 @@ def render_dashboard_geral():
     # ----------------------------------------------------
     st.subheader("Análise de Cursos (Top 10)")
     
-    if not df_bolsistas.empty and 'curso' in df_bolsistas.columns:
+    if tem_bolsistas:
         col_select, _ = st.columns([1,3])
         with col_select:
             metrica = st.selectbox("Métrica:", ["Quantidade de Alunos", "Custo Médio (R$)"])
         
         if metrica == "Quantidade de Alunos":
-            df_curso = df_bolsistas['curso'].value_counts().head(10).reset_index()
-            df_curso.columns = ['Curso', 'Valor']
+            df_curso = resumo['cursos_alunos']
             cor = 'Valor'
             fmt = '%{text}'
         else:
-            df_curso = df_bolsistas.groupby('curso')['valor_reembolso'].mean().sort_values(ascending=False).head(10).reset_index()
-            df_curso.columns = ['Curso', 'Valor']
+            df_curso = resumo['cursos_custo']
             cor = 'Valor'
             fmt = 'R$ %{text:,.2f}'
             
@@ -1588,11 +4192,11 @@ def criar_super_tabela(df, key="tabela"):
         
         # Formatar valores monetários e percentuais
         if 'Mensalidade' in df_display.columns:
-            df_display['Mensalidade'] = df_display['Mensalidade'].apply(lambda x: f"R$ {x:,.2f}" if pd.notna(x) else "")
+            df_display['Mensalidade'] = formatar_moeda_br(df_display['Mensalidade'], vazio="")
         if 'Valor Reembolso' in df_display.columns:
-            df_display['Valor Reembolso'] = df_display['Valor Reembolso'].apply(lambda x: f"R$ {x:,.2f}" if pd.notna(x) else "")
+            df_display['Valor Reembolso'] = formatar_moeda_br(df_display['Valor Reembolso'], vazio="")
         if '% Bolsa' in df_display.columns:
-            df_display['% Bolsa'] = df_display['% Bolsa'].apply(lambda x: f"{x*100:.0f}%" if pd.notna(x) else "")
+            df_display['% Bolsa'] = formatar_percentual_br(df_display['% Bolsa'])
         
         # Configurar AgGrid com layout aprimorado (SEM QUEBRA DE LINHA)
         gb = GridOptionsBuilder.from_dataframe(df_display)
@@ -1667,10 +4271,10 @@ def criar_super_tabela(df, key="tabela"):
                 # 1. Converter nomes de colunas para string
                 df_display.columns = [str(c) for c in df_display.columns]
                 
-                # 2. Converter todos os valores de colunas tipo object/mixed para string
+                # 2. Converter todos os valores de colunas tipo object/mixed/categoria para string
                 for col in df_display.columns:
                     if not pd.api.types.is_numeric_dtype(df_display[col]):
-                        df_display[col] = df_display[col].fillna('').astype(str)
+                        df_display[col] = df_display[col].astype(object).fillna('').astype(str)
                 
                 # Checagem com dropdown e estilo (JsCode)
                 cell_style_jscode = JsCode("""
@@ -1719,55 +4323,709 @@ def criar_super_tabela(df, key="tabela"):
                 )
                 df_edited = grid_response['data']
             except Exception as e:
-                # Fallback limpo sem mensagem de erro assustadora
-                df_edited = st.data_editor(df_display, key=f"editor_fallback_{key}", use_container_width=True, hide_index=True)
+                # Fallback limpo sem mensagem de erro assustadora
+                df_edited = st.data_editor(df_display, key=f"editor_fallback_{key}", use_container_width=True, hide_index=True)
+        else:
+            st.info("ℹ️ Usando visualização básica de tabela.")
+            df_edited = st.data_editor(df_display, key=f"editor_basic_{key}", use_container_width=True, hide_index=True)
+        st.info("ℹ️ Nota: As alterações feitas aqui são salvas no **Banco de Dados do Sistema** (`bolsas.db`).")
+        if st.button("💾 Salvar alterações", type="primary"):
+            edited_df = df_edited.copy()
+            
+            # Reverter formatação para valores crus antes de gravar
+            if 'Mensalidade' in edited_df.columns:
+                edited_df['Mensalidade'] = parse_moeda_br(edited_df['Mensalidade'], padrao=0)
+            if 'Valor Reembolso' in edited_df.columns:
+                edited_df['Valor Reembolso'] = parse_moeda_br(edited_df['Valor Reembolso'], padrao=0)
+            if '% Bolsa' in edited_df.columns:
+                edited_df['% Bolsa'] = parse_percentual_br(edited_df['% Bolsa'], padrao=0.5)
+            
+            # Atualizar banco de dados - MAPEAMENTO COMPLETO
+            conn = get_conn()
+            for _, row in edited_df.iterrows():
+                update_fields = []
+                params = []
+                mapping = {
+                    "Nome": "nome", "CPF": "cpf", "Diretoria": "diretoria", "Cod. Local": "cod_local",
+                    "Curso": "curso", "Instituição": "instituicao", "Tipo": "tipo", "Modalidade": "modalidade",
+                    "Início Curso": "inicio_curso", "Fim Curso": "fim_curso", "Ano Programa": "ano_referencia",
+                    "Mensalidade": "mensalidade", "% Bolsa": "porcentagem", "Valor Reembolso": "valor_reembolso",
+                    "Situação": "situacao", "Checagem": "checagem", "Observação": "observacao"
+                }
+                for col, db_col in mapping.items():
+                    if col in row.index:
+                        val = row[col]
+                        if pd.isna(val) or val == '' or val == 'nan': val = None
+                        update_fields.append(f"{db_col} = ?")
+                        params.append(val)
+                if update_fields:
+                    sql = f"UPDATE bolsistas SET {', '.join(update_fields)} WHERE matricula = ?"
+                    params.append(row['Matrícula'])
+                    conn.execute(sql, tuple(params))
+            conn.commit()
+            conn.close()
+            st.success("✅ Alterações salvas no banco de dados!")
+            st.rerun()
+    else:
+        # Fallback para dataframe padrão
+        st.dataframe(df, width='stretch', height=800, hide_index=True)
+
+# ---------------------------------------------------------------------------
+# Diário de Observações (páginas por chave, miniaturas em cache e anexos sob demanda)
+# ---------------------------------------------------------------------------
+OBSERVACOES_POR_PAGINA = 10
+LADO_MINIATURA = 160  # px, maior lado
+EXTENSOES_IMAGEM = ('.png', '.jpg', '.jpeg')
+
+def eh_imagem(nome_anexo):
+    return isinstance(nome_anexo, str) and nome_anexo.lower().endswith(EXTENSOES_IMAGEM)
+
+def gerar_miniatura(dados):
+    """JPEG reduzido de uma imagem anexada (gravado junto com o anexo); None sem Pillow ou se a imagem não abrir."""
+    if not PILLOW or not dados:
+        return None
+    try:
+        with Image.open(BytesIO(dados)) as imagem:
+            imagem.thumbnail((LADO_MINIATURA, LADO_MINIATURA))
+            saida = BytesIO()
+            imagem.convert("RGB").save(saida, format="JPEG", quality=80)
+        return saida.getvalue()
+    except Exception as e:
+        logger.warning(f"Miniatura não gerada: {e}")
+        return None
+
+def carregar_observacoes_pagina(bolsista_id, depois_de=None, limite=OBSERVACOES_POR_PAGINA):
+    """
+    Uma página do diário, mais recentes primeiro, só com metadados (o anexo fica no banco).
+    `depois_de` é a chave (data, id) da última linha da página anterior; devolve (página, próxima chave ou None).
+    """
+    filtro, params = "", []
+    if depois_de is not None:
+        filtro, params = "AND (data, id) < (?, ?)", list(depois_de)
+    conn = get_conn()
+    try:
+        pagina = pd.read_sql_query(f"""
+            SELECT id, data, texto, nome_anexo, COALESCE(LENGTH(anexo_blob), 0) AS tamanho_anexo
+            FROM observacoes WHERE bolsista_id = ? {filtro}
+            ORDER BY data DESC, id DESC LIMIT ?
+        """, conn, params=[int(bolsista_id)] + params + [limite + 1])
+    finally:
+        conn.close()
+    if len(pagina) <= limite:
+        return pagina, None
+    pagina = pagina.iloc[:limite]
+    return pagina, (pagina['data'].iloc[-1], int(pagina['id'].iloc[-1]))
+
+def carregar_observacoes(bolsista_id, paginas):
+    """As `paginas` primeiras páginas, encadeadas pela chave; devolve (observações, há mais)."""
+    partes, chave = [], None
+    for _ in range(paginas):
+        pagina, chave = carregar_observacoes_pagina(bolsista_id, chave)
+        partes.append(pagina)
+        if chave is None:
+            break
+    return pd.concat(partes, ignore_index=True), chave is not None
+
+def miniatura_observacao(obs_id):
+    """Miniatura do anexo no cache compartilhado; anexos gravados antes das miniaturas ganham a sua na primeira exibição."""
+    def construir():
+        conn = get_conn()
+        try:
+            miniatura, nome = conn.execute("SELECT miniatura, nome_anexo FROM observacoes WHERE id = ?", (obs_id,)).fetchone() or (None, None)
+            if miniatura is None and eh_imagem(nome):
+                (dados,) = conn.execute("SELECT anexo_blob FROM observacoes WHERE id = ?", (obs_id,)).fetchone()
+                miniatura = gerar_miniatura(dados)
+                if miniatura:
+                    with conn:
+                        conn.execute("UPDATE observacoes SET miniatura = ? WHERE id = ?", (miniatura, obs_id))
+            return miniatura
+        finally:
+            conn.close()
+
+    # O anexo de uma observação não muda (ids AUTOINCREMENT não se repetem): versão fixa
+    return obter_cache_compartilhado().obter(("miniatura_observacao", 0, int(obs_id)), construir)
+
+def ler_anexo_observacao(obs_id):
+    """Bytes do anexo, lidos só quando o usuário pede a imagem inteira ou o download."""
+    conn = get_conn()
+    try:
+        linha = conn.execute("SELECT anexo_blob FROM observacoes WHERE id = ?", (int(obs_id),)).fetchone()
+    finally:
+        conn.close()
+    return linha[0] if linha else None
+
+def render_anexo_observacao(obs):
+    """Miniatura (imagens) e, depois do clique, a imagem inteira e o download do anexo."""
+    nome = obs['nome_anexo'] or "anexo"
+    imagem = eh_imagem(obs['nome_anexo'])
+    if imagem:
+        miniatura = miniatura_observacao(obs['id'])
+        if miniatura:
+            st.image(miniatura, caption=nome)
+    aberto = f"obs_anexo_aberto_{obs['id']}"
+    if not st.session_state.get(aberto):
+        tamanho = f"{obs['tamanho_anexo'] / 1024:,.0f} KB".replace(",", ".")
+        rotulo = "🖼️ Ver imagem" if imagem else "📎 Anexo"
+        if not st.button(f"{rotulo}: {nome} ({tamanho})", key=f"abrir_anexo_{obs['id']}"):
+            return
+        st.session_state[aberto] = True
+    dados = ler_anexo_observacao(obs['id'])
+    if dados is None:
+        st.error("Anexo não encontrado")
+        return
+    if imagem:
+        try:
+            st.image(dados, width=400)
+        except Exception:
+            st.error("Erro ao exibir anexo")
+    st.download_button(label=f"📎 Baixar Anexo ({nome})", data=dados, file_name=nome, key=f"dl_{obs['id']}")
+
+# ---------------------------------------------------------------------------
+# Conferência Individual (fragmento sobre a lista de trabalho da sessão)
+# ---------------------------------------------------------------------------
+# Colunas do df_conf copiadas para a lista de trabalho (st.session_state.conf_lista)
+COLUNAS_LISTA_CONFERENCIA = ['id', 'matricula', 'nome', 'diretoria', 'mensalidade', 'porcentagem',
+                             'valor_reembolso', 'situacao', 'status_conf']
+# Cards montados em segundo plano à frente do atual, e o tamanho do contexto de cada card
+CARTOES_ANTECIPADOS = int(os.environ.get("BOLSAS_CARTOES_ANTECIPADOS", "5"))
+ULTIMOS_PAGAMENTOS_CARTAO = 3
+MESES_PLANILHA_CARTAO = 5
+
+@st.cache_resource
+def obter_executor_conferencia():
+    """Threads que antecipam os cards da conferência (uma por processo, comum a todas as sessões)."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="conferencia")
+
+def _indexar_planilha_pagamentos(df):
+    """
+    Últimos meses da planilha de pagamentos (BASE.PAGAMENTOS) por matrícula, numa única varredura.
+    None se a planilha não foi encontrada/está vazia.
+    """
+    if df is None or df.empty:
+        return None
+    df = df.rename(columns=lambda c: str(c).upper().strip())
+    df = df.assign(
+        MATRICULA=df['MATRICULA'].astype(str).str.split('.').str[0].str.strip(),
+        DATA=pd.to_datetime(df['DATA'], dayfirst=True, errors='coerce'),
+    )
+    # Mais recentes primeiro; cada matrícula guarda só os meses exibidos no card
+    recentes = df.sort_values('DATA', ascending=False, kind='stable').groupby('MATRICULA', sort=False).head(MESES_PLANILHA_CARTAO)
+    return dict(tuple(recentes.groupby('MATRICULA', sort=False)))
+
+class ListaConferencia:
+    """
+    Lista de trabalho da Conferência Individual, montada uma vez por (mês, ano, filtros, versão dos dados).
+    Guarda os bolsistas na ordem da conferência e os dados prontos de cada card (últimos pagamentos
+    e meses da planilha); enquanto o operador confere um card, os próximos são montados em segundo plano.
+    As threads só leem o banco e a planilha: nada de Streamlit fora da thread do script.
+    """
+
+    def __init__(self, chave, df_conf, planilha, executor, anterior=None):
+        self.chave = chave
+        self.linhas = df_conf[COLUNAS_LISTA_CONFERENCIA].to_dict('records')
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._cartoes = {}    # bolsista_id -> dados do card
+        self._em_curso = {}   # bolsista_id -> Future do lote que está montando o card
+        self._geracao = {}    # bolsista_id -> quantas vezes o card foi invalidado
+        self._planilha = planilha
+        if anterior is not None and anterior._planilha is planilha:
+            # Mesma cópia da planilha: reaproveita o índice já feito (ou em andamento)
+            self._indice_planilha = anterior._indice_planilha
+        else:
+            self._indice_planilha = executor.submit(_indexar_planilha_pagamentos, planilha)
+
+    def __len__(self):
+        return len(self.linhas)
+
+    def __getitem__(self, idx):
+        return self.linhas[idx]
+
+    def remover(self, idx):
+        """Tira da lista o bolsista que saiu do filtro atual (o próximo ocupa a posição)."""
+        return self.linhas.pop(idx)
+
+    def invalidar(self, bolsista_id):
+        """Descarta o card de quem acabou de ser gravado (os últimos pagamentos mudaram).
+        Um lote que já estava montando esse card não o guarda: leu o banco antes da gravação."""
+        with self._lock:
+            self._cartoes.pop(bolsista_id, None)
+            self._em_curso.pop(bolsista_id, None)
+            self._geracao[bolsista_id] = self._geracao.get(bolsista_id, 0) + 1
+
+    def _montar(self, linhas):
+        """Monta os cards de um lote: uma consulta para os últimos pagamentos de todos, índice da planilha em memória."""
+        with self._lock:
+            geracoes = {l['id']: self._geracao.get(l['id'], 0) for l in linhas}
+        ids = [int(l['id']) for l in linhas]
+        conn = get_conn()
+        try:
+            df_pag = pd.read_sql_query(f"""
+                SELECT bolsista_id, mes, ano, valor, status FROM (
+                    SELECT bolsista_id, mes, ano, valor, status,
+                           ROW_NUMBER() OVER (PARTITION BY bolsista_id ORDER BY ano DESC, mes DESC) AS ordem
+                    FROM pagamentos WHERE bolsista_id IN ({','.join('?' * len(ids))})
+                ) WHERE ordem <= ? ORDER BY bolsista_id, ordem
+            """, conn, params=ids + [ULTIMOS_PAGAMENTOS_CARTAO])
+        finally:
+            conn.close()
+        pagamentos = {int(b): g.drop(columns='bolsista_id').to_dict('records') for b, g in df_pag.groupby('bolsista_id')}
+
+        try:
+            indice, erro = self._indice_planilha.result(), None
+        except Exception as e:
+            indice, erro = None, str(e)
+
+        cartoes = {}
+        for linha, bolsista_id in zip(linhas, ids):
+            cartao = {'pagamentos': pagamentos.get(bolsista_id, []), 'planilha': None, 'total_planilha': 0.0, 'erro_planilha': erro}
+            if indice is not None:
+                try:
+                    recentes = indice.get(str(linha['matricula']).strip().split('.')[0])
+                    if recentes is None:
+                        cartao['planilha'] = pd.DataFrame()
+                    else:
+                        df_show = recentes.assign(MES_ANO=recentes['DATA'].dt.strftime('%m/%Y'))
+                        # Pivotar para colunas (meses)
+                        df_pivot = df_show.pivot_table(
+                            index=['MATRICULA', 'NOMES'], columns='MES_ANO', values='VALOR', aggfunc='sum'
+                        ).reset_index()
+                        df_pivot.columns.name = None
+                        cartao['planilha'] = df_pivot.rename(columns={'MATRICULA': 'Matrícula', 'NOMES': 'Nome'})
+                        cartao['total_planilha'] = df_show['VALOR'].sum()
+                except Exception as e:
+                    cartao['erro_planilha'] = str(e)
+            cartoes[linha['id']] = cartao
+
+        with self._lock:
+            for bolsista_id, cartao in cartoes.items():
+                if self._geracao.get(bolsista_id, 0) != geracoes[bolsista_id]:
+                    continue  # invalidado durante a montagem: o _em_curso já é de outro lote (ou nenhum)
+                self._cartoes[bolsista_id] = cartao
+                self._em_curso.pop(bolsista_id, None)
+
+    def antecipar(self, inicio):
+        """Agenda num lote só os próximos cards ainda não montados nem em andamento."""
+        with self._lock:
+            faltando = [l for l in self.linhas[inicio:inicio + CARTOES_ANTECIPADOS]
+                        if l['id'] not in self._cartoes and l['id'] not in self._em_curso]
+            if not faltando:
+                return
+            futuro = self._executor.submit(self._montar, faltando)
+            for linha in faltando:
+                self._em_curso[linha['id']] = futuro
+
+    def cartao(self, idx):
+        """Dados do card na posição idx (em geral já antecipados) e agenda os seguintes."""
+        linha = self.linhas[idx]
+        with self._lock:
+            futuro = self._em_curso.get(linha['id'])
+        if futuro is not None:
+            try:
+                futuro.result()
+            except Exception as e:
+                logger.warning(f"Conferência: falha ao antecipar cards ({e}); montando o atual agora.")
+        with self._lock:
+            cartao = self._cartoes.get(linha['id'])
+        if cartao is None:
+            self._montar([linha])
+            with self._lock:
+                cartao = self._cartoes[linha['id']]
+        self.antecipar(idx + 1)
+        return cartao
+
+def preparar_lista_conferencia(chave, df_conf):
+    """Lista de trabalho da sessão: reaproveitada enquanto mês, filtros e dados não mudam."""
+    anterior = st.session_state.get('conf_lista')
+    if isinstance(anterior, ListaConferencia) and anterior.chave == chave:
+        return anterior
+    planilha = carregar_fontes("PAGAMENTOS")["PAGAMENTOS"]
+    lista = ListaConferencia(chave, df_conf, planilha, obter_executor_conferencia(),
+                             anterior if isinstance(anterior, ListaConferencia) else None)
+    st.session_state.conf_lista = lista
+    if len(lista):
+        lista.antecipar(min(st.session_state.get('idx_colab', 0), len(lista) - 1))
+    return lista
+
+def _mover_conferencia(passo, total):
+    """Callback dos botões Anterior/Próximo: só move o índice, o fragmento reexecuta sozinho."""
+    st.session_state.idx_colab = min(max(st.session_state.get('idx_colab', 0) + passo, 0), max(total - 1, 0))
+
+def _reexecutar_conferencia(lista):
+    """Reexecuta só o fragmento; com a lista esvaziada (ou numa execução completa), a página inteira."""
+    try:
+        st.rerun(scope="fragment" if lista else "app")
+    except StreamlitAPIException:
+        st.rerun()
+
+@st.fragment
+def conferencia_individual(mes, mes_num, ano, filtro_status):
+    """
+    Histórico, navegação e card da Conferência Individual. PAGO/PENDENTE/PULAR reexecutam só este
+    fragmento: grava o pagamento, atualiza a lista da sessão e avança, sem recarregar a página.
+    """
+    # Lista de trabalho montada na execução completa (main) e atualizada aqui a cada confirmação
+    lista = st.session_state.get('conf_lista') or []
+
+    # Inicializar índice no session_state (agora antes do histórico para filtrar)
+    if 'idx_colab' not in st.session_state:
+        st.session_state.idx_colab = 0
+
+    # Lista de colaboradores
+    lista_colabs = [str(c['matricula']) for c in lista]
+    total_colabs = len(lista_colabs)
+
+    # Garantir que o índice está dentro dos limites
+    if st.session_state.idx_colab >= total_colabs:
+        st.session_state.idx_colab = total_colabs - 1
+    if st.session_state.idx_colab < 0:
+        st.session_state.idx_colab = 0
+
+    # Identificar Matrícula Atual para Filtro
+    curr_mat = lista_colabs[st.session_state.idx_colab] if total_colabs > 0 else None
+
+    st.markdown("---")
+    st.markdown("---")
+    label_hist = f"📊 Histórico de Pagamentos"
+    if curr_mat:
+        label_hist += f" - Matrícula: {curr_mat}"
+
+    # Card atual já montado em segundo plano (últimos pagamentos + meses da planilha); agenda os próximos
+    cartao = lista.cartao(st.session_state.idx_colab) if total_colabs > 0 else None
+
+    with st.expander(label_hist, expanded=True):
+        if cartao is None:
+            st.info("ℹ️ Selecione um colaborador para ver o histórico.")
+        elif cartao['erro_planilha']:
+            st.error(f"Erro ao processar histórico: {cartao['erro_planilha']}")
+        elif cartao['planilha'] is None:
+            st.warning("⚠️ Arquivo BASES.BOLSAS/BASE.PAGAMENTOS.xlsx não encontrado na pasta do sistema.")
+        elif cartao['planilha'].empty:
+            m_clean = str(curr_mat).strip().split('.')[0]
+            st.info(f"ℹ️ Nenhuma informação de pagamento encontrada no Excel para a matrícula {m_clean}.")
+        else:
+            df_pivot = cartao['planilha']
+            exibir_tabela(df_pivot, moeda=[c for c in df_pivot.columns if c not in ['Matrícula', 'Nome']], traco=True)
+
+            # Totais
+            st.markdown(f"**Total acumulado nos registros acima:** {format_br_currency(cartao['total_planilha'])}")
+
+    st.markdown("#### 📝 Conferência Individual")
+
+    # (Lógica de índice movida para cima para suportar histórico filtrado)
+    # Apenas renderização da navegação aqui
+
+    # Navegação com botões (Usar callbacks para evitar conflito com selectbox)
+    col1, col2, col3 = st.columns([1, 4, 1])
+    with col1:
+        st.write("") # Spacer
+        st.write("") # Spacer
+        st.button("⬅️ Anterior", use_container_width=True, key="btn_nav_anterior",
+                  on_click=_mover_conferencia, args=(-1, total_colabs))
+    with col2:
+        # Exibir apenas texto informativo para evitar conflito de estado com lista dinâmica
+        current_matricula = lista_colabs[st.session_state.idx_colab] if st.session_state.idx_colab < len(lista_colabs) else ""
+        html_collab = f'<div style="text-align: center; padding-top: 10px;"><strong>Colaborador {st.session_state.idx_colab + 1}</strong> de {total_colabs}<div style="font-size: 0.8rem; color: #64748b;">(Matrícula: {current_matricula})</div></div>'
+        st.markdown(html_collab, unsafe_allow_html=True)
+
+    with col3:
+        st.write("") # Spacer
+        st.write("") # Spacer
+        st.button("Próximo ➡️", use_container_width=True, key="btn_nav_proximo",
+                  on_click=_mover_conferencia, args=(1, total_colabs))
+
+    # Dados do colaborador atual
+    if st.session_state.idx_colab < total_colabs:
+        row = lista[st.session_state.idx_colab]
+
+        # Últimos 3 pagamentos para contexto (já no card montado pela lista de trabalho)
+        last_payments = cartao['pagamentos']
+
+        hist_html = ""
+        if last_payments:
+            hist_items = []
+            for p in last_payments:
+                m_name = MESES[p['mes']-1][:3]
+                valor_txt = f"R${p['valor']:.0f}" if pd.notna(p['valor']) else "sem valor"
+                hist_items.append(f"<span style='background:#e2e8f0; padding:2px 6px; border-radius:4px; font-size:0.8rem;'>{m_name}/{p['ano']}: <strong>{valor_txt}</strong></span>")
+            hist_html = "<div style='margin-top:10px;'>" + " ".join(hist_items) + "</div>"
+        else:
+            hist_html = "<div style='margin-top:10px; font-size:0.8rem; color:#94a3b8;'>Sem histórico recente</div>"
+
+
+        # Botão de copiar matrícula
+        c_copy, _ = st.columns([1, 5])
+        with c_copy:
+            st.caption("📋 Copiar Matrícula")
+            st.code(row['matricula'], language=None)
+
+        # Layout em Card COM histórico (já exibido acima)
+        # Calcular valores para exibição (Fix para SyntaxError)
+        calc_mensalidade = row['mensalidade']
+        calc_porcentagem = row['porcentagem'] * 100
+        calc_reembolso = float(row['valor_reembolso'])
+
+        # Pre-formatar strings para evitar erro de sintaxe no bloco HTML
+        str_mensalidade = formatar_moeda_br(calc_mensalidade, prefixo="").iloc[0]
+        str_porcentagem = f"{calc_porcentagem:.0f}%"
+        str_reembolso = formatar_moeda_br(calc_reembolso, prefixo="").iloc[0]
+
+        # Construir HTML do card
+        status_color = '#16a34a' if 'PAGO' in str(row['status_conf']) else ('#ca8a04' if 'AGUARDANDO' in str(row['status_conf']) else '#dc2626')
+        diretoria_display = row['diretoria'] if pd.notna(row['diretoria']) and row['diretoria'] else 'Sem diretoria'
+
+        html_card = "".join([
+            f'<div style="background-color: #f8fafc; padding: 20px; border-radius: 12px; border: 1px solid #e2e8f0; margin-bottom: 20px; box-shadow: 0 4px 6px rgba(0,0,0,0.02);">',
+            f'<div style="display: flex; justify-content: space-between; align-items: start;">',
+            f'<div style="flex: 1;">',
+            f'<h3 style="margin: 0; color: #1e293b; font-size: 1.4rem;">{row["matricula"]}</h3>',
+            f'<p style="margin: 4px 0 0 0; color: #64748b; font-size: 0.9rem;">Nome: <strong>{row["nome"]}</strong> | {diretoria_display}</p>',
+            f'{hist_html}',
+            f'</div><div style="text-align: right; min-width: 120px;">',
+            f'<span style="font-size: 0.8rem; color: #64748b; text-transform: uppercase; letter-spacing: 0.5px;">Status</span><br>',
+            f'<span style="font-size: 1.1rem; font-weight: 700; color: {status_color};">{row["status_conf"]}</span></div></div>',
+            f'<hr style="margin: 15px 0; border: 0; border-top: 1px solid #e2e8f0;">',
+            f'<div style="display: flex; align-items: center; gap: 20px;"><div>',
+            f'<p style="margin: 0; font-size: 0.85rem; color: #64748b;">Cálculo Sugerido</p>',
+            f'<div style="font-size: 1.1rem; color: #334155; font-weight: 500;">R$ {str_mensalidade} <span style="color:#94a3b8">&times;</span> {str_porcentagem} <span style="color:#94a3b8">=</span> <strong>R$ {str_reembolso}</strong></div>',
+            f'</div><div>',
+            f'<p style="margin: 0; font-size: 0.85rem; color: #64748b;">Ação</p>',
+            f'<div style="font-size: 0.9rem; color: #64748b;">Clique em PAGO para salvar e avançar.</div>',
+            f'</div></div></div>'
+        ])
+        st.markdown(html_card, unsafe_allow_html=True)
+
+        # --- STATUS FORA DO FORM PARA TER INTERATIVIDADE ---
+        # Novas opções solicitadas
+        status_opts = ["REGULAR", "IRREGULAR", "CONCLUIDO", "CANCELADO", "DESISTENCIA", "TRANCADO"]
+
+        # Mapping de legado para novo sistema
+        raw_st = row['situacao']
+        if raw_st == "ATIVO": curr_status = "REGULAR"
+        elif raw_st == "INATIVO": curr_status = "CANCELADO"
+        elif raw_st == "EM ANÁLISE": curr_status = "IRREGULAR"
+        elif raw_st in status_opts: curr_status = raw_st
+        else: curr_status = "REGULAR"
+
+        idx_status = status_opts.index(curr_status)
+
+        c_stat_out, _ = st.columns([1, 2])
+        with c_stat_out:
+            novo_status = st.selectbox(
+                "📌 Situação / Checagem",
+                status_opts,
+                index=idx_status,
+                key=f"status_sel_{row['id']}",
+                help="REGULAR/IRREGULAR = Ativo | CANCELADO/DESISTENCIA = Inativo"
+            )
+
+        # Input e Botões dentro de um FORMULÁRIO para permitir Enter = Salvar
+        with st.form(key=f"form_pagto_{row['id']}"):
+            c_input, c_obs = st.columns([1, 1.5])
+            with c_input:
+                # Lógica de Valor: Se Cancelado/Desistencia/Concluido/Trancado, sugerir 0,00
+                if novo_status in SITUACOES_INATIVAS:
+                    val_float = 0.0
+                else:
+                    val_float = float(row['mensalidade'])
+
+                val_inicial = formatar_moeda_br(val_float, prefixo="").iloc[0]
+
+                valor_pagar_str = st.text_input(
+                    "💰 Valor Boleto (100%):",
+                    value=val_inicial,
+                    key=f"valor_ind_{row['id']}_{novo_status}",
+                    help="Digite o valor CHEIO do boleto. O sistema calculará o reembolso na planilha."
+                )
+
+                # Converter input texto para float (aceita 1.000,00 / 1000,00 / 1000.00)
+                valor_pagar = parse_moeda_br(valor_pagar_str, padrao=0.0)
+
+                # Se Status de Encerramento (Concluido, Cancelado, Desistencia), pedir Data
+                data_comprovante = None
+                if novo_status in SITUACOES_INATIVAS:
+                    lbl_map = {
+                        "CONCLUIDO": "Data de Conclusão",
+                        "CANCELADO": "Data de Cancelamento",
+                        "DESISTENCIA": "Data da Desistência",
+                        "TRANCADO": "Data do Trancamento"
+                    }
+                    label_data = f"📅 {lbl_map.get(novo_status, 'Data')}"
+                    st.markdown(f"**{label_data}**")
+                    data_comprovante = st.date_input(
+                        "Selecione a data:",
+                        value=datetime.today(),
+                        format="DD/MM/YYYY",
+                        key=f"dt_comp_{row['id']}",
+                        label_visibility="collapsed"
+                    )
+
+            with c_obs:
+                obs_texto = st.text_area("📝 Adicionar Obs. / Diário", height=105, key=f"obs_{row['id']}", placeholder="Digite uma observação para salvar no perfil do colaborador...")
+
+            col_btn1, col_btn2, col_btn3 = st.columns(3)
+            with col_btn1:
+                # Primeiro botão é o default do Enter
+                is_pago = st.form_submit_button("✅ PAGO", type="primary", use_container_width=True)
+            with col_btn2:
+                is_pendente = st.form_submit_button("❌ PENDENTE", use_container_width=True)
+            with col_btn3:
+                is_pular = st.form_submit_button("⏭️ PULAR", use_container_width=True)
+
+        # Logica de Processamento UNIFICADA
+        if is_pago or is_pendente:
+            try:
+                conn = get_conn()
+
+                # 1. Salvar Observação se houver (com data extra se aplicável)
+                texto_final = obs_texto
+
+                if novo_status in SITUACOES_INATIVAS and data_comprovante:
+                    str_data = data_comprovante.strftime("%d/%m/%Y")
+                    prefixo = f"[{novo_status}] Data de Referência"
+                    obs_extra = f"{prefixo}: {str_data}"
+
+                    if texto_final:
+                        texto_final += f" | {obs_extra}"
+                    else:
+                        texto_final = obs_extra
+
+                if texto_final:
+                    data_hoje = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    # Verificar se tabela tem colunas corretas, senão adaptar (Baseado no código do perfil)
+                    conn.execute("INSERT INTO observacoes (bolsista_id, data, texto) VALUES (?, ?, ?)", (int(row['id']), data_hoje, texto_final))
+
+                # 2. Atualizar Status do Bolsista se Mudou
+                if novo_status != row['situacao']:
+                    conn.execute("UPDATE bolsistas SET situacao = ? WHERE id = ?", (novo_status, int(row['id'])))
+                    st.toast(f"🔄 Status alterado para {novo_status}!", icon="🔄")
+
+                # 3. Salvar Pagamento
+                status_pgto = 'PAGO' if is_pago else 'PENDENTE'
+                valor_pgto = float(valor_pagar) if is_pago else 0.0
+
+                conn.execute('INSERT OR REPLACE INTO pagamentos (bolsista_id, mes, ano, valor, status) VALUES (?, ?, ?, ?, ?)',
+                            (int(row['id']), int(mes_num), int(ano), valor_pgto, status_pgto))
+
+                conn.commit()
+                conn.close()
+
+
+                # Feedback Visual
+                if is_pago:
+                    st.success(f"✅ Salvo: {row['nome']} - {format_br_currency(valor_pgto)} (PAGO)")
+                else:
+                    st.warning(f"⚠️ Salvo: {row['nome']} (PENDENTE)")
+
+
+                if 'table_key_version' not in st.session_state: st.session_state.table_key_version = 0
+                st.session_state.table_key_version += 1
+
+                import time
+                time.sleep(0.2)
+
+                # Lógica de navegação inteligente
+                if is_pago:
+                    vai_sair_da_lista = (filtro_status == "⏳ Aguardando") or (filtro_status == "❌ Pendentes")
+                else: # Pendente
+                    vai_sair_da_lista = (filtro_status == "⏳ Aguardando") or (filtro_status == "✅ Pagos")
+
+                if not vai_sair_da_lista:
+                    row['status_conf'] = "✅ PAGO" if is_pago else "❌ PENDENTE"
+                    row['situacao'] = novo_status
+                    lista.invalidar(row['id'])
+                    if st.session_state.idx_colab < total_colabs - 1:
+                        st.session_state.idx_colab += 1
+                else:
+                    # Sai do filtro atual: o próximo da lista ocupa a mesma posição
+                    lista.remover(st.session_state.idx_colab)
+                    if st.session_state.idx_colab >= total_colabs - 1 and total_colabs > 1:
+                            st.session_state.idx_colab -= 1
+
+            except Exception as e:
+                st.error(f"Erro ao salvar: {e}")
+            else:
+                _reexecutar_conferencia(lista)
+
+        elif is_pular:
+            if st.session_state.idx_colab < total_colabs - 1:
+                st.session_state.idx_colab += 1
+            _reexecutar_conferencia(lista)
+
+        # ==========================================
+        # PRÉVIA DO RELATÓRIO DP (Mirroring Tab 3)
+        # ==========================================
+        st.markdown("---")
+        st.markdown("##### 📄 Relatório DP Parcial (Todos os Conferidos)")
+
+        c_prev = get_conn()
+        # Buscar totais
+        res_total = c_prev.execute('SELECT SUM(valor), COUNT(*) FROM pagamentos WHERE mes=? AND ano=? AND status=?', (int(mes_num), int(ano), 'PAGO')).fetchone()
+        total_pago_now = res_total[0] if res_total and res_total[0] else 0.0
+        count_pago_now = res_total[1] if res_total else 0
+
+        # Buscar TODOS os pagos com ID para exclusão
+        df_prev = pd.read_sql_query('''
+            SELECT p.id, b.nome, b.matricula, p.valor, CAST(p.bolsista_id AS INTEGER) as bolsista_id_fix
+            FROM pagamentos p
+            LEFT JOIN bolsistas b ON CAST(p.bolsista_id AS INTEGER) = b.id
+            WHERE p.mes = ? AND p.ano = ? AND p.status = 'PAGO'
+            ORDER BY p.id DESC
+        ''', c_prev, params=(int(mes_num), int(ano)))
+        c_prev.close()
+
+        if count_pago_now > 0:
+            st.caption(f"💰 Total Acumulado: **{format_br_currency(total_pago_now)}** ({count_pago_now} colaboradores)")
+
+            # Ajustar nome 
+            def get_nome_display(row):
+                if row['nome'] and pd.notna(row['nome']):
+                    return row['nome']
+                return f"ID {row['bolsista_id_fix']}"
+
+            df_prev['nome_final'] = df_prev.apply(get_nome_display, axis=1)
+            df_prev['Excluir'] = False # Coluna de Checkbox
+            df_prev['Competência'] = f"{mes}/{ano}" # Coluna de Competência
+
+            # Formatar valor para BR string
+            df_prev['valor_fmt'] = formatar_moeda_br(df_prev['valor'])
+
+            # Tabela Interativa
+            edited_prev = st.data_editor(
+                df_prev[['Excluir', 'matricula', 'nome_final', 'Competência', 'valor_fmt']],
+                column_config={
+                    "Excluir": st.column_config.CheckboxColumn("🗑️", width="small", help="Selecione para excluir"),
+                    "matricula": st.column_config.TextColumn("Matrícula", width="medium", disabled=True),
+                    "nome_final": st.column_config.TextColumn("Nome", width="large", disabled=True),
+                    "Competência": st.column_config.TextColumn("Competência", width="medium", disabled=True),
+                    "valor_fmt": st.column_config.TextColumn("Valor", width="medium", disabled=True)
+                },
+                hide_index=True,
+                key=f"edit_prev_{st.session_state.get('table_key_version',0)}"
+            )
+
+            # Botão de Exclusão (só aparece se houver seleção)
+            if edited_prev['Excluir'].any():
+                if st.button("🗑️ Apagar Selecionados", type="secondary"):
+                    # Pegar IDs reais baseados no index
+                    ids_to_del = df_prev.loc[edited_prev[edited_prev['Excluir']].index, 'id'].tolist()
+                    if ids_to_del:
+                        conn = get_conn()
+                        for pid in ids_to_del:
+                            conn.execute("DELETE FROM pagamentos WHERE id = ?", (pid,))
+                        conn.commit()
+                        conn.close()
+
+                        st.toast("✅ Registros excluídos com sucesso!")
+
+                        # Forçar refresh
+                        if 'table_key_version' not in st.session_state: st.session_state.table_key_version = 0
+                        st.session_state.table_key_version += 1
+                        import time; time.sleep(0.5)
+                        st.rerun()
+
         else:
-            st.info("ℹ️ Usando visualização básica de tabela.")
-            df_edited = st.data_editor(df_display, key=f"editor_basic_{key}", use_container_width=True, hide_index=True)
-        st.info("ℹ️ Nota: As alterações feitas aqui são salvas no **Banco de Dados do Sistema** (`bolsas.db`).")
-        if st.button("💾 Salvar alterações", type="primary"):
-            edited_df = df_edited.copy()
-            
-            # Reverter formatação para valores crus antes de gravar
-            if 'Mensalidade' in edited_df.columns:
-                edited_df['Mensalidade'] = edited_df['Mensalidade'].astype(str).str.replace(r"R\$ ", "", regex=True).str.replace(".", "", regex=True).str.replace(",", ".", regex=True)
-                edited_df['Mensalidade'] = pd.to_numeric(edited_df['Mensalidade'], errors='coerce').fillna(0)
-            if 'Valor Reembolso' in edited_df.columns:
-                edited_df['Valor Reembolso'] = edited_df['Valor Reembolso'].astype(str).str.replace(r"R\$ ", "", regex=True).str.replace(".", "", regex=True).str.replace(",", ".", regex=True)
-                edited_df['Valor Reembolso'] = pd.to_numeric(edited_df['Valor Reembolso'], errors='coerce').fillna(0)
-            if '% Bolsa' in edited_df.columns:
-                edited_df['% Bolsa'] = edited_df['% Bolsa'].astype(str).str.rstrip('%')
-                edited_df['% Bolsa'] = pd.to_numeric(edited_df['% Bolsa'], errors='coerce').fillna(50) / 100
-            
-            # Atualizar banco de dados - MAPEAMENTO COMPLETO
-            conn = get_conn()
-            for _, row in edited_df.iterrows():
-                update_fields = []
-                params = []
-                mapping = {
-                    "Nome": "nome", "CPF": "cpf", "Diretoria": "diretoria", "Cod. Local": "cod_local",
-                    "Curso": "curso", "Instituição": "instituicao", "Tipo": "tipo", "Modalidade": "modalidade",
-                    "Início Curso": "inicio_curso", "Fim Curso": "fim_curso", "Ano Programa": "ano_referencia",
-                    "Mensalidade": "mensalidade", "% Bolsa": "porcentagem", "Valor Reembolso": "valor_reembolso",
-                    "Situação": "situacao", "Checagem": "checagem", "Observação": "observacao"
-                }
-                for col, db_col in mapping.items():
-                    if col in row.index:
-                        val = row[col]
-                        if pd.isna(val) or val == '' or val == 'nan': val = None
-                        update_fields.append(f"{db_col} = ?")
-                        params.append(val)
-                if update_fields:
-                    sql = f"UPDATE bolsistas SET {', '.join(update_fields)} WHERE matricula = ?"
-                    params.append(row['Matrícula'])
-                    conn.execute(sql, tuple(params))
-            conn.commit()
-            conn.close()
-            st.success("✅ Alterações salvas no banco de dados!")
-            st.rerun()
-    else:
-        # Fallback para dataframe padrão
-        st.dataframe(df, width='stretch', height=800, hide_index=True)
+            st.info("Nenhum pagamento confirmado para este mês ainda.")
 
 def main():
     # ---------------------------------------------------------------------------
@@ -1777,10 +5035,15 @@ def main():
         login_page()
         return
 
+    # Fontes remotas em paralelo logo no início: snapshots na hora, atualização em segundo plano
+    fontes_sessao = carregar_fontes_versionadas()
+
     with st.sidebar:
         st.write(f"Usuário: **{st.session_state.get('username', 'gestao')}**")
         if st.button("🔒 Sair / Logout", use_container_width=True):
             logout()
+        # Procedência e idade dos dados remotos
+        render_idade_fontes(fontes_sessao)
 
     import plotly.graph_objects as go
     stats = get_stats()
@@ -1837,27 +5100,25 @@ def main():
         with col_btn:
             # Opção de sobrescrever ou manter
             sobrescrever = st.checkbox("Sobrescrever Status/Obs?", value=False, help="Se marcado, o Excel substituirá os Status e Observações do sistema. Se desmarcado, mantém o que está no sistema atual.")
+            previa = st.checkbox("🔍 Prévia antes de gravar", value=True, key="previa_tabela", help="Mostra novos, alterados e inválidos coluna a coluna antes de gravar qualquer coisa.")
             
             if st.button("🔄 Atualizar Base", type="primary", use_container_width=True, help="Sincroniza com Google Sheets ou Excel Local"):
                 try:
-                    # Limpar cache antes de atualizar para garantir dados frescos
-                    st.cache_data.clear()
+                    df_local = get_dataset("BOLSAS")
                     
-                    with st.spinner("Sincronizando dados..."):
-                         df_local = get_dataset("BOLSAS")
-                         
-                         if not df_local.empty:
-                            st.toast(f"Dados brutos carregados: {len(df_local)} linhas.", icon="📥")
-                            st.write(f"Colunas encontradas: {list(df_local.columns)}") # Debug temporário
-                            processar_importacao_df(df_local, preserve_status=not sobrescrever)
-                            st.balloons()
-                            st.rerun()
-                         else:
-                            st.error("Não foi possível carregar os dados. Verifique a conexão com o Google Sheets e se a planilha não está vazia.")
-                            st.warning("Se estiver usando arquivo local, verifique se ele existe na pasta correta.")
+                    if not df_local.empty:
+                        st.toast(f"Dados brutos carregados: {len(df_local)} linhas.", icon="📥")
+                        importar_bolsistas_ui(df_local, "Atualização da base", preserve_status=not sobrescrever, previa=previa)
+                    else:
+                        st.error("Não foi possível carregar os dados. Verifique a conexão com o Google Sheets e se a planilha não está vazia.")
+                        st.warning("Se estiver usando arquivo local, verifique se ele existe na pasta correta.")
                 except Exception as e:
                     st.error(f"Erro ao sincronizar: {e}")
         
+        # Andamento/resultado das importações em segundo plano
+        render_status_job('bolsistas')
+        render_previa_bolsistas("previa_tabela")
+        
         # ---------------------------------------------------------
         # IMPORTAÇÃO DE NOVOS INSCRITOS (TEMPLATE + UPLOAD)
         # ---------------------------------------------------------
@@ -1886,9 +5147,7 @@ def main():
                     if st.button("📤 Processar Importação", type="primary"):
                         try:
                             df_novos = pd.read_excel(arquivo_novos)
-                            processar_importacao_df(df_novos)
-                            st.success("Importação concluída com sucesso!")
-                            st.rerun()
+                            importar_bolsistas_ui(df_novos, "Importação de novos inscritos", previa=previa)
                         except Exception as e:
                             st.error(f"Erro ao processar arquivo: {e}")
 
@@ -1911,7 +5170,7 @@ def main():
         with col4:
             ordem = st.selectbox("Ordenar por", ["Nome", "Matrícula", "Valor", "Diretoria", "Ano Ref."], key=f"ord_{st.session_state.filtros_version}")
         with col5:
-            busca = st.text_input("🔍 Buscar", placeholder="Digite nome ou matrícula...", key=f"bus_{st.session_state.filtros_version}")
+            busca = st.text_input("🔍 Buscar", placeholder="Digite nome ou matrícula...", key=f"bus_{st.session_state.filtros_version}", help=AJUDA_BUSCA)
         with col_reset:
             st.write("") # alinhamento
             st.write("")
@@ -1920,22 +5179,13 @@ def main():
                 st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
         
-        # 1. Buscar dados básicos (Filtros de Situação, Ano e Busca no Banco)
-        df = listar_bolsistas(
-            situacao=situacao if situacao != "Todos" else None,
-            diretoria=None, # Filtrar diretoria depois do enriquecimento para maior precisão
-            busca=busca if busca else None,
-            ano_ref=ano_selecionado if ano_selecionado != "Todos" else None
-        )
-        
-        # 2. Enriquecer com Diretoria e Gestores do ORGANOGRAMA via Cod. Local
+        # 1. Base já enriquecida com Diretoria e Gestores do ORGANOGRAMA via Cod. Local
+        # (uma cópia por processo, compartilhada entre as sessões; só é refeita quando os dados mudam)
         # Isso garante que mesmo quem está com "N/A" no cadastro seja encontrado pela diretoria certa
-        df_org = carregar_organograma()
-        df = enriquecer_com_organograma(df, df_org)
-        
-        # 3. Aplicar filtro de diretoria agora que temos os dados reais do Organograma
-        if diretoria != "Todas":
-            df = df[df['diretoria'].astype(str).str.upper() == diretoria.upper()]
+        df = carregar_bolsistas_enriquecidos()
+
+        # 2. Filtros de Situação, Ano, Busca e Diretoria (já com os dados reais do Organograma)
+        df = filtrar_bolsistas(df, situacao, ano_selecionado, busca, diretoria)
         
         # 4. Ordenar
         if ordem == "Nome":
@@ -1954,9 +5204,9 @@ def main():
         with col1:
             st.metric("Total Encontrados", len(df))
         with col2:
-            st.metric("Soma Reembolso", f"R$ {df['valor_reembolso'].sum():,.2f}")
+            st.metric("Soma Reembolso", format_br_currency(df['valor_reembolso'].sum()))
         with col3:
-            st.metric("Média Reembolso", f"R$ {df['valor_reembolso'].mean():,.2f}" if len(df) > 0 else "R$ 0")
+            st.metric("Média Reembolso", format_br_currency(df['valor_reembolso'].mean()) if len(df) > 0 else "R$ 0")
         
         st.markdown("---")
         
@@ -1964,9 +5214,15 @@ def main():
         if len(df) > 0:
             criar_super_tabela(df, "tabela_geral")
             
-            # Botão de download Excel
-            excel_data = df_to_excel(df)
-            st.download_button("⬇️ Baixar Tabela", excel_data, "bolsistas.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            # Download gerado só no clique, lendo o banco em blocos (Excel, CSV ou Parquet)
+            botao_exportar(
+                "⬇️ Baixar Tabela",
+                lambda: {'Bolsistas': blocos_bolsistas_filtrados(situacao, ano_selecionado, busca, diretoria, ordem)},
+                "bolsistas.xlsx",
+                chave=(situacao, ano_selecionado, busca, diretoria, ordem), versao=versao_dados('bolsistas'),
+                moeda=['mensalidade', 'valor_reembolso'], percentual=['porcentagem'],
+                formatos=("Excel", "CSV (pt-BR)", "CSV (padrão)", "Parquet"), key="exp_tabela"
+            )
             
             # Seção de exclusão
             st.markdown("---")
@@ -2051,7 +5307,7 @@ def main():
         with col3:
             filtro_situacao = st.selectbox("📋 Situação", ["ATIVO", "CONCLUIDO", "INATIVO", "EM ANÁLISE", "Todos"], key=f"sit_conf_{st.session_state.filtros_version_conf}")
         with col4:
-            busca_conf = st.text_input("🔍 Buscar", placeholder="Nome ou matrícula...", key=f"bus_conf_{st.session_state.filtros_version_conf}")
+            busca_conf = st.text_input("🔍 Buscar", placeholder="Nome ou matrícula...", key=f"bus_conf_{st.session_state.filtros_version_conf}", help=AJUDA_BUSCA)
         with col_reset:
             st.write("") # alinhamento
             st.write("")
@@ -2059,47 +5315,15 @@ def main():
                 st.session_state.filtros_version_conf += 1
                 st.rerun()
         
-        # Buscar bolsistas com base no filtro de situação
-        if filtro_situacao == "Todos":
-            df_base = listar_bolsistas()
-        else:
-            df_base = listar_bolsistas(situacao=filtro_situacao)
-        
-        # Aplicar busca
-        if busca_conf:
-            df_base = df_base[
-                df_base['nome'].str.contains(busca_conf, case=False, na=False) |
-                df_base['matricula'].str.contains(busca_conf, na=False)
-            ]
+        # Bolsistas do filtro de situação já com o status de conferência do mês (LEFT JOIN com pagamentos)
+        df_base = listar_conferencia(mes_num, ano, situacao=filtro_situacao, busca=busca_conf)
         
         if len(df_base) > 0:
-            conn = get_conn()
-            pagamentos = pd.read_sql_query(
-                "SELECT bolsista_id, status, valor FROM pagamentos WHERE mes = ? AND ano = ?",
-                conn, params=(int(mes_num), int(ano))
-            )
-            conn.close()
-            
-            pagos_ids = pagamentos[pagamentos['status'] == 'PAGO']['bolsista_id'].tolist()
-            pend_ids = pagamentos[pagamentos['status'] == 'PENDENTE']['bolsista_id'].tolist()
-            
-            # Criar coluna de status para a tabela
-            # FORÇAR CAST PARA INT E SET PARA EVITAR ERROS DE TIPO
-            try:
-                pagos_ids_set = set(pagamentos[pagamentos['status'] == 'PAGO']['bolsista_id'].astype(int).tolist())
-                pend_ids_set = set(pagamentos[pagamentos['status'] == 'PENDENTE']['bolsista_id'].astype(int).tolist())
-            except:
-                pagos_ids_set = set()
-                pend_ids_set = set()
-            
-            df_base['status_conf'] = df_base['id'].apply(
-                lambda x: "✅ PAGO" if int(x) in pagos_ids_set else ("❌ PENDENTE" if int(x) in pend_ids_set else "⏳ AGUARDANDO")
-            )
-            
-            total = len(df_base)
-            pagos_count = len([x for x in df_base['id'] if int(x) in pagos_ids_set])
-            pend_count = len([x for x in df_base['id'] if int(x) in pend_ids_set])
-            aguard = total - pagos_count - pend_count
+            contagem = contar_conferencia(mes_num, ano, situacao=filtro_situacao, busca=busca_conf)
+            total = contagem['total']
+            pagos_count = contagem['pagos']
+            pend_count = contagem['pendentes']
+            aguard = contagem['aguardando']
             
             # Métricas
             col1, col2, col3, col4 = st.columns(4)
@@ -2118,11 +5342,12 @@ def main():
             
             st.markdown("---")
             
-            tab1, tab2, tab3 = st.tabs(["📝 Conferir", "✅ Pagos", "📊 Relatório DP"])
+            tab1, tab2, tab3, tab4 = st.tabs(["📝 Conferir", "✅ Pagos", "📊 Relatório DP", "🔎 Conciliação"])
             
             with tab1:
                 # Filtro por status de conferência
                 filtro_status = st.radio("Filtrar:", ["⏳ Aguardando", "Todos", "✅ Pagos", "❌ Pendentes"], horizontal=True)
+                render_fechamento_lote(mes_num, ano, filtro_situacao, busca_conf, aguard)
                 
                 df_conf = df_base.copy()
                 
@@ -2141,7 +5366,7 @@ def main():
                     
                     # Preparar tabela para edição com Status editável
                     df_edit = df_conf[['id', 'matricula', 'nome', 'mensalidade', 'porcentagem', 'valor_reembolso', 'status_conf']].copy()
-                    df_edit['porcentagem_display'] = df_edit['porcentagem'].apply(lambda x: f"{x*100:.0f}%" if pd.notna(x) else "50%")
+                    df_edit['porcentagem_display'] = formatar_percentual_br(df_edit['porcentagem'], vazio="50%")
                     # Simplificar status para dropdown
                     df_edit['status_edit'] = df_edit['status_conf'].apply(lambda x: 'PAGO' if 'PAGO' in x else ('PENDENTE' if 'PENDENTE' in x else 'AGUARDANDO'))
                     
@@ -2176,426 +5401,23 @@ def main():
                     
                     # Botão para salvar alterações da tabela
                     if st.button("💾 SALVAR ALTERAÇÕES DA TABELA", type="primary", use_container_width=True):
-                        conn = get_conn()
-                        for i, (idx, row) in enumerate(df_conf.iterrows()):
-                            valor = edited_df.iloc[i]['Valor']
-                            status = edited_df.iloc[i]['Status']
-                            if status in ['PAGO', 'PENDENTE']:
-                                conn.execute('INSERT OR REPLACE INTO pagamentos (bolsista_id, mes, ano, valor, status) VALUES (?, ?, ?, ?, ?)',
-                                            (row['id'], mes_num, ano, valor, status))
-                        conn.commit()
-                        conn.close()
+                        decisoes = [
+                            (bolsista_id, None if pd.isna(valor) else float(valor), status)
+                            for bolsista_id, valor, status in zip(df_conf['id'], edited_df['Valor'], edited_df['Status'])
+                            if status in ['PAGO', 'PENDENTE']
+                        ]
+                        salvar_tabela_conferencia(mes_num, ano, decisoes, usuario=st.session_state.get('username'))
                         st.success("✅ Alterações salvas!")
                         st.rerun()
                     
                     
-                    # ========================================
-                    # PREPARAÇÃO PARA CONFERÊNCIA INDIVIDUAL E HISTÓRICO
-                    # ========================================
-                    
-                    # Inicializar índice no session_state (agora antes do histórico para filtrar)
-                    if 'idx_colab' not in st.session_state:
-                        st.session_state.idx_colab = 0
-                    
-                    # Lista de colaboradores
-                    lista_colabs = df_conf['matricula'].astype(str).tolist()
-                    total_colabs = len(lista_colabs)
-                    
-                    # Garantir que o índice está dentro dos limites
-                    if st.session_state.idx_colab >= total_colabs:
-                        st.session_state.idx_colab = total_colabs - 1
-                    if st.session_state.idx_colab < 0:
-                        st.session_state.idx_colab = 0
-                    
-                    # Identificar Matrícula Atual para Filtro
-                    curr_mat = lista_colabs[st.session_state.idx_colab] if total_colabs > 0 else None
-                    
-                    st.markdown("---")
-                    st.markdown("---")
-                    label_hist = f"📊 Histórico de Pagamentos"
-                    if curr_mat:
-                        label_hist += f" - Matrícula: {curr_mat}"
-                    
-                    with st.expander(label_hist, expanded=True):
-                        try:
-
-                            df_pagos = get_dataset("PAGAMENTOS")
-                            if not df_pagos.empty:
-                                # Carregar sem cache para garantir que novos dados do Excel apareçam
-                                df_pagos.columns = [str(c).upper().strip() for c in df_pagos.columns]
-                                
-                                # Limpeza de Matrícula (Excel)
-                                df_pagos['MATRICULA'] = df_pagos['MATRICULA'].astype(str).str.split('.').str[0].str.strip()
-                                df_pagos['DATA'] = pd.to_datetime(df_pagos['DATA'], dayfirst=True, errors='coerce')
-                                
-                                # Filtrar Colaborador Atual
-                                if curr_mat:
-                                    m_clean = str(curr_mat).strip().split('.')[0]
-                                    df_hist = df_pagos[df_pagos['MATRICULA'] == m_clean].copy()
-                                    
-                                    if not df_hist.empty:
-                                        # Ordenar por data (mais recente primeiro)
-                                        df_hist = df_hist.sort_values('DATA', ascending=False)
-                                        
-                                        # Mostrar apenas os 5 mais recentes
-                                        df_show = df_hist.head(5).copy()
-                                        df_show['MES_ANO'] = df_show['DATA'].dt.strftime('%m/%Y')
-                                        
-                                        # Pivotar para colunas (meses)
-                                        df_pivot = df_show.pivot_table(
-                                            index=['MATRICULA', 'NOMES'],
-                                            columns='MES_ANO',
-                                            values='VALOR',
-                                            aggfunc='sum'
-                                        ).reset_index()
-                                        
-                                        df_pivot.columns.name = None
-                                        df_pivot = df_pivot.rename(columns={'MATRICULA': 'Matrícula', 'NOMES': 'Nome'})
-                                        
-                                        # Formatar Moeda
-                                        for col in df_pivot.columns:
-                                            if col not in ['Matrícula', 'Nome']:
-                                                df_pivot[col] = df_pivot[col].apply(lambda x: f"R$ {x:,.2f}" if pd.notna(x) else "-")
-                                        
-                                        st.dataframe(df_pivot, use_container_width=True, hide_index=True)
-                                        
-                                        # Totais
-                                        t_pago = df_show['VALOR'].sum()
-                                        st.markdown(f"**Total acumulado nos registros acima:** R$ {t_pago:,.2f}")
-                                    else:
-                                        st.info(f"ℹ️ Nenhuma informação de pagamento encontrada no Excel para a matrícula {m_clean}.")
-                                else:
-                                    st.info("ℹ️ Selecione um colaborador para ver o histórico.")
-                            else:
-                                st.warning("⚠️ Arquivo BASES.BOLSAS/BASE.PAGAMENTOS.xlsx não encontrado na pasta do sistema.")
-                        except Exception as e:
-                            st.error(f"Erro ao processar histórico: {e}")
-
-                    st.markdown("#### 📝 Conferência Individual")
-                    
-                    # (Lógica de índice movida para cima para suportar histórico filtrado)
-                    # Apenas renderização da navegação aqui
-                    
-                    # Navegação com botões (Usar callbacks para evitar conflito com selectbox)
-                    col1, col2, col3 = st.columns([1, 4, 1])
-                    with col1:
-                        st.write("") # Spacer
-                        st.write("") # Spacer
-                        if st.button("⬅️ Anterior", use_container_width=True, key="btn_nav_anterior"):
-                            if st.session_state.idx_colab > 0:
-                                st.session_state.idx_colab -= 1
-                            st.rerun()
-                    with col2:
-                        # Exibir apenas texto informativo para evitar conflito de estado com lista dinâmica
-                        current_matricula = lista_colabs[st.session_state.idx_colab] if st.session_state.idx_colab < len(lista_colabs) else ""
-                        html_collab = f'<div style="text-align: center; padding-top: 10px;"><strong>Colaborador {st.session_state.idx_colab + 1}</strong> de {total_colabs}<div style="font-size: 0.8rem; color: #64748b;">(Matrícula: {current_matricula})</div></div>'
-                        st.markdown(html_collab, unsafe_allow_html=True)
-
-                    with col3:
-                        st.write("") # Spacer
-                        st.write("") # Spacer
-                        if st.button("Próximo ➡️", use_container_width=True, key="btn_nav_proximo"):
-                            if st.session_state.idx_colab < total_colabs - 1:
-                                st.session_state.idx_colab += 1
-                            st.rerun()
-                    
-                    # Dados do colaborador atual
-                    if st.session_state.idx_colab < len(df_conf):
-                        row = df_conf.iloc[st.session_state.idx_colab]
-                        
-                        # Buscar últimos 3 pagamentos para contexto
-                        conn_ctx = get_conn()
-                        last_payments = pd.read_sql_query("SELECT mes, ano, valor, status FROM pagamentos WHERE bolsista_id = ? ORDER BY ano DESC, mes DESC LIMIT 3", conn_ctx, params=(row['id'],))
-                        conn_ctx.close()
-                        
-                        hist_html = ""
-                        if not last_payments.empty:
-                            hist_items = []
-                            for _, p in last_payments.iterrows():
-                                m_name = MESES[p['mes']-1][:3]
-                                hist_items.append(f"<span style='background:#e2e8f0; padding:2px 6px; border-radius:4px; font-size:0.8rem;'>{m_name}/{p['ano']}: <strong>R${p['valor']:.0f}</strong></span>")
-                            hist_html = "<div style='margin-top:10px;'>" + " ".join(hist_items) + "</div>"
-                        else:
-                            hist_html = "<div style='margin-top:10px; font-size:0.8rem; color:#94a3b8;'>Sem histórico recente</div>"
-
-
-                        # Botão de copiar matrícula
-                        c_copy, _ = st.columns([1, 5])
-                        with c_copy:
-                            st.caption("📋 Copiar Matrícula")
-                            st.code(row['matricula'], language=None)
-
-                        # Layout em Card COM histórico (já exibido acima)
-                        # Calcular valores para exibição (Fix para SyntaxError)
-                        calc_mensalidade = row['mensalidade']
-                        calc_porcentagem = row['porcentagem'] * 100
-                        calc_reembolso = float(row['valor_reembolso'])
-                        
-                        # Pre-formatar strings para evitar erro de sintaxe no bloco HTML
-                        str_mensalidade = f"{calc_mensalidade:,.2f}"
-                        str_porcentagem = f"{calc_porcentagem:.0f}%"
-                        str_reembolso = f"{calc_reembolso:,.2f}"
-
-                        # Construir HTML do card
-                        status_color = '#16a34a' if 'PAGO' in str(row['status_conf']) else ('#ca8a04' if 'AGUARDANDO' in str(row['status_conf']) else '#dc2626')
-                        diretoria_display = row['diretoria'] or 'Sem diretoria'
-                        
-                        html_card = "".join([
-                            f'<div style="background-color: #f8fafc; padding: 20px; border-radius: 12px; border: 1px solid #e2e8f0; margin-bottom: 20px; box-shadow: 0 4px 6px rgba(0,0,0,0.02);">',
-                            f'<div style="display: flex; justify-content: space-between; align-items: start;">',
-                            f'<div style="flex: 1;">',
-                            f'<h3 style="margin: 0; color: #1e293b; font-size: 1.4rem;">{row["matricula"]}</h3>',
-                            f'<p style="margin: 4px 0 0 0; color: #64748b; font-size: 0.9rem;">Nome: <strong>{row["nome"]}</strong> | {diretoria_display}</p>',
-                            f'{hist_html}',
-                            f'</div><div style="text-align: right; min-width: 120px;">',
-                            f'<span style="font-size: 0.8rem; color: #64748b; text-transform: uppercase; letter-spacing: 0.5px;">Status</span><br>',
-                            f'<span style="font-size: 1.1rem; font-weight: 700; color: {status_color};">{row["status_conf"]}</span></div></div>',
-                            f'<hr style="margin: 15px 0; border: 0; border-top: 1px solid #e2e8f0;">',
-                            f'<div style="display: flex; align-items: center; gap: 20px;"><div>',
-                            f'<p style="margin: 0; font-size: 0.85rem; color: #64748b;">Cálculo Sugerido</p>',
-                            f'<div style="font-size: 1.1rem; color: #334155; font-weight: 500;">R$ {str_mensalidade} <span style="color:#94a3b8">&times;</span> {str_porcentagem} <span style="color:#94a3b8">=</span> <strong>R$ {str_reembolso}</strong></div>',
-                            f'</div><div>',
-                            f'<p style="margin: 0; font-size: 0.85rem; color: #64748b;">Ação</p>',
-                            f'<div style="font-size: 0.9rem; color: #64748b;">Clique em PAGO para salvar e avançar.</div>',
-                            f'</div></div></div>'
-                        ])
-                        st.markdown(html_card, unsafe_allow_html=True)
-                        
-                        # --- STATUS FORA DO FORM PARA TER INTERATIVIDADE ---
-                        # Novas opções solicitadas
-                        status_opts = ["REGULAR", "IRREGULAR", "CONCLUIDO", "CANCELADO", "DESISTENCIA", "TRANCADO"]
-                        
-                        # Mapping de legado para novo sistema
-                        raw_st = row['situacao']
-                        if raw_st == "ATIVO": curr_status = "REGULAR"
-                        elif raw_st == "INATIVO": curr_status = "CANCELADO"
-                        elif raw_st == "EM ANÁLISE": curr_status = "IRREGULAR"
-                        elif raw_st in status_opts: curr_status = raw_st
-                        else: curr_status = "REGULAR"
-                        
-                        idx_status = status_opts.index(curr_status)
-                        
-                        c_stat_out, _ = st.columns([1, 2])
-                        with c_stat_out:
-                            novo_status = st.selectbox(
-                                "📌 Situação / Checagem",
-                                status_opts,
-                                index=idx_status,
-                                key=f"status_sel_{row['id']}",
-                                help="REGULAR/IRREGULAR = Ativo | CANCELADO/DESISTENCIA = Inativo"
-                            )
-
-                        # Input e Botões dentro de um FORMULÁRIO para permitir Enter = Salvar
-                        with st.form(key=f"form_pagto_{row['id']}"):
-                            c_input, c_obs = st.columns([1, 1.5])
-                            with c_input:
-                                # Lógica de Valor: Se Cancelado/Desistencia/Concluido/Trancado, sugerir 0,00
-                                if novo_status in ["CANCELADO", "DESISTENCIA", "TRANCADO", "CONCLUIDO"]:
-                                    val_float = 0.0
-                                else:
-                                    val_float = float(row['mensalidade'])
-                                    
-                                val_inicial = f"{val_float:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                                
-                                valor_pagar_str = st.text_input(
-                                    "💰 Valor Boleto (100%):",
-                                    value=val_inicial,
-                                    key=f"valor_ind_{row['id']}_{novo_status}",
-                                    help="Digite o valor CHEIO do boleto. O sistema calculará o reembolso na planilha."
-                                )
-                                
-                                # Converter input texto para float (tratamento robusto BR)
-                                try:
-                                    clean_str = valor_pagar_str.replace("R$", "").strip()
-                                    if "," in clean_str and "." in clean_str:
-                                        # Formato 1.000,00
-                                        clean_str = clean_str.replace(".", "").replace(",", ".")
-                                    elif "," in clean_str:
-                                        # Formato 1000,00
-                                        clean_str = clean_str.replace(",", ".")
-                                    valor_pagar = float(clean_str)
-                                except ValueError:
-                                    valor_pagar = 0.0
-                                
-                                # Se Status de Encerramento (Concluido, Cancelado, Desistencia), pedir Data
-                                data_comprovante = None
-                                if novo_status in ["CONCLUIDO", "CANCELADO", "DESISTENCIA", "TRANCADO"]:
-                                    lbl_map = {
-                                        "CONCLUIDO": "Data de Conclusão",
-                                        "CANCELADO": "Data de Cancelamento",
-                                        "DESISTENCIA": "Data da Desistência",
-                                        "TRANCADO": "Data do Trancamento"
-                                    }
-                                    label_data = f"📅 {lbl_map.get(novo_status, 'Data')}"
-                                    st.markdown(f"**{label_data}**")
-                                    data_comprovante = st.date_input(
-                                        "Selecione a data:",
-                                        value=datetime.today(),
-                                        format="DD/MM/YYYY",
-                                        key=f"dt_comp_{row['id']}",
-                                        label_visibility="collapsed"
-                                    )
-                            
-                            with c_obs:
-                                obs_texto = st.text_area("📝 Adicionar Obs. / Diário", height=105, key=f"obs_{row['id']}", placeholder="Digite uma observação para salvar no perfil do colaborador...")
-
-                            col_btn1, col_btn2, col_btn3 = st.columns(3)
-                            with col_btn1:
-                                # Primeiro botão é o default do Enter
-                                is_pago = st.form_submit_button("✅ PAGO", type="primary", use_container_width=True)
-                            with col_btn2:
-                                is_pendente = st.form_submit_button("❌ PENDENTE", use_container_width=True)
-                            with col_btn3:
-                                is_pular = st.form_submit_button("⏭️ PULAR", use_container_width=True)
-
-                        # Logica de Processamento UNIFICADA
-                        if is_pago or is_pendente:
-                            try:
-                                conn = get_conn()
-                                
-                                # 1. Salvar Observação se houver (com data extra se aplicável)
-                                texto_final = obs_texto
-                                
-                                if (novo_status in ["CONCLUIDO", "CANCELADO", "DESISTENCIA", "TRANCADO"]) and data_comprovante:
-                                    str_data = data_comprovante.strftime("%d/%m/%Y")
-                                    prefixo = f"[{novo_status}] Data de Referência"
-                                    obs_extra = f"{prefixo}: {str_data}"
-                                    
-                                    if texto_final:
-                                        texto_final += f" | {obs_extra}"
-                                    else:
-                                        texto_final = obs_extra
-
-                                if texto_final:
-                                    data_hoje = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                    # Verificar se tabela tem colunas corretas, senão adaptar (Baseado no código do perfil)
-                                    conn.execute("INSERT INTO observacoes (bolsista_id, data, texto) VALUES (?, ?, ?)", (int(row['id']), data_hoje, texto_final))
-                                
-                                # 2. Atualizar Status do Bolsista se Mudou
-                                if novo_status != row['situacao']:
-                                    conn.execute("UPDATE bolsistas SET situacao = ? WHERE id = ?", (novo_status, int(row['id'])))
-                                    st.toast(f"🔄 Status alterado para {novo_status}!", icon="🔄")
-
-                                # 3. Salvar Pagamento
-                                status_pgto = 'PAGO' if is_pago else 'PENDENTE'
-                                valor_pgto = float(valor_pagar) if is_pago else 0.0
-                                
-                                conn.execute('INSERT OR REPLACE INTO pagamentos (bolsista_id, mes, ano, valor, status) VALUES (?, ?, ?, ?, ?)',
-                                            (int(row['id']), int(mes_num), int(ano), valor_pgto, status_pgto))
-                                
-                                conn.commit()
-                                conn.close()
-                                
-                                
-                                # Feedback Visual
-                                if is_pago:
-                                    st.success(f"✅ Salvo: {row['nome']} - R$ {valor_pgto:,.2f} (PAGO)")
-                                else:
-                                    st.warning(f"⚠️ Salvo: {row['nome']} (PENDENTE)")
-                               
-                                
-                                if 'table_key_version' not in st.session_state: st.session_state.table_key_version = 0
-                                st.session_state.table_key_version += 1
-                                
-                                import time
-                                time.sleep(0.2)
-                                
-                                # Lógica de navegação inteligente
-                                if is_pago:
-                                    vai_sair_da_lista = (filtro_status == "⏳ Aguardando") or (filtro_status == "❌ Pendentes")
-                                else: # Pendente
-                                    vai_sair_da_lista = (filtro_status == "⏳ Aguardando") or (filtro_status == "✅ Pagos")
-                                
-                                if not vai_sair_da_lista:
-                                    if st.session_state.idx_colab < total_colabs - 1:
-                                        st.session_state.idx_colab += 1
-                                else:
-                                    if st.session_state.idx_colab >= total_colabs - 1 and total_colabs > 1:
-                                            st.session_state.idx_colab -= 1
-                                
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Erro ao salvar: {e}")
-
-                        elif is_pular:
-                            if st.session_state.idx_colab < total_colabs - 1:
-                                st.session_state.idx_colab += 1
-                            st.rerun()
-
-                        # ==========================================
-                        # PRÉVIA DO RELATÓRIO DP (Mirroring Tab 3)
-                        # ==========================================
-                        st.markdown("---")
-                        st.markdown("##### 📄 Relatório DP Parcial (Todos os Conferidos)")
-                        
-                        c_prev = get_conn()
-                        # Buscar totais
-                        res_total = c_prev.execute('SELECT SUM(valor), COUNT(*) FROM pagamentos WHERE mes=? AND ano=? AND status=?', (int(mes_num), int(ano), 'PAGO')).fetchone()
-                        total_pago_now = res_total[0] if res_total and res_total[0] else 0.0
-                        count_pago_now = res_total[1] if res_total else 0
-                        
-                        # Buscar TODOS os pagos com ID para exclusão
-                        df_prev = pd.read_sql_query('''
-                            SELECT p.id, b.nome, b.matricula, p.valor, CAST(p.bolsista_id AS INTEGER) as bolsista_id_fix
-                            FROM pagamentos p
-                            LEFT JOIN bolsistas b ON CAST(p.bolsista_id AS INTEGER) = b.id
-                            WHERE p.mes = ? AND p.ano = ? AND p.status = 'PAGO'
-                            ORDER BY p.id DESC
-                        ''', c_prev, params=(int(mes_num), int(ano)))
-                        c_prev.close()
-                        
-                        if count_pago_now > 0:
-                            st.caption(f"💰 Total Acumulado: **R$ {total_pago_now:,.2f}** ({count_pago_now} colaboradores)")
-                            
-                            # Ajustar nome 
-                            def get_nome_display(row):
-                                if row['nome'] and pd.notna(row['nome']):
-                                    return row['nome']
-                                return f"ID {row['bolsista_id_fix']}"
-                            
-                            df_prev['nome_final'] = df_prev.apply(get_nome_display, axis=1)
-                            df_prev['Excluir'] = False # Coluna de Checkbox
-                            df_prev['Competência'] = f"{mes}/{ano}" # Coluna de Competência
-                            
-                            # Formatar valor para BR string
-                            df_prev['valor_fmt'] = df_prev['valor'].apply(lambda x: f"R$ {float(x):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") if pd.notna(x) else "R$ 0,00")
-                            
-                            # Tabela Interativa
-                            edited_prev = st.data_editor(
-                                df_prev[['Excluir', 'matricula', 'nome_final', 'Competência', 'valor_fmt']],
-                                column_config={
-                                    "Excluir": st.column_config.CheckboxColumn("🗑️", width="small", help="Selecione para excluir"),
-                                    "matricula": st.column_config.TextColumn("Matrícula", width="medium", disabled=True),
-                                    "nome_final": st.column_config.TextColumn("Nome", width="large", disabled=True),
-                                    "Competência": st.column_config.TextColumn("Competência", width="medium", disabled=True),
-                                    "valor_fmt": st.column_config.TextColumn("Valor", width="medium", disabled=True)
-                                },
-                                hide_index=True,
-                                key=f"edit_prev_{st.session_state.get('table_key_version',0)}"
-                            )
-                            
-                            # Botão de Exclusão (só aparece se houver seleção)
-                            if edited_prev['Excluir'].any():
-                                if st.button("🗑️ Apagar Selecionados", type="secondary"):
-                                    # Pegar IDs reais baseados no index
-                                    ids_to_del = df_prev.loc[edited_prev[edited_prev['Excluir']].index, 'id'].tolist()
-                                    if ids_to_del:
-                                        conn = get_conn()
-                                        for pid in ids_to_del:
-                                            conn.execute("DELETE FROM pagamentos WHERE id = ?", (pid,))
-                                        conn.commit()
-                                        conn.close()
-                                        
-                                        st.toast("✅ Registros excluídos com sucesso!")
-                                        
-                                        # Forçar refresh
-                                        if 'table_key_version' not in st.session_state: st.session_state.table_key_version = 0
-                                        st.session_state.table_key_version += 1
-                                        import time; time.sleep(0.5)
-                                        st.rerun()
-
-                        else:
-                            st.info("Nenhum pagamento confirmado para este mês ainda.")
+                    # Histórico, navegação e card rodam num fragmento sobre a lista guardada na sessão:
+                    # confirmar e avançar grava uma linha e reexecuta só o fragmento, não a página inteira
+                    preparar_lista_conferencia(
+                        (mes_num, ano, filtro_situacao, busca_conf, filtro_status, versao_dados('bolsistas', 'pagamentos')),
+                        df_conf
+                    )
+                    conferencia_individual(mes, mes_num, ano, filtro_status)
             
             with tab2:
                 if pagos_count > 0:
@@ -2610,13 +5432,14 @@ def main():
                     conn.close()
                     
                     total_pago = df_pagos_db['valor_pago'].sum()
-                    st.metric("💰 Total a Reembolsar", f"R$ {total_pago:,.2f}")
+                    st.metric("💰 Total a Reembolsar", format_br_currency(total_pago))
                     
-                    st.dataframe(
-                        df_pagos_db[['matricula', 'nome', 'diretoria', 'valor_pago']].rename(columns={
-                            'matricula': 'Matrícula', 'nome': 'Nome', 'diretoria': 'Diretoria', 'valor_pago': 'Valor Pago'
-                        }),
-                        use_container_width=True, hide_index=True, height=400
+                    exibir_tabela(
+                        df_pagos_db,
+                        column_order=['matricula', 'nome', 'diretoria', 'valor_pago'],
+                        rotulos={'matricula': 'Matrícula', 'nome': 'Nome', 'diretoria': 'Diretoria', 'valor_pago': 'Valor Pago'},
+                        moeda=['valor_pago'],
+                        height=400
                     )
                 else:
                     st.info("Nenhum PAGO ainda.")
@@ -2638,18 +5461,22 @@ def main():
                     
                     total_val = df_rel['VALOR'].sum()
                     
-                    st.success(f"**{len(df_rel)} colaboradores** | **R$ {total_val:,.2f}**")
-                    
-                    # Versão de visualização com formatação
-                    df_rel_display = df_rel.copy()
-                    df_rel_display['VALOR'] = df_rel_display['VALOR'].apply(lambda x: f"R$ {float(x):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") if pd.notna(x) else "R$ 0,00")
+                    st.success(f"**{len(df_rel)} colaboradores** | **{format_br_currency(total_val)}**")
                     
-                    st.dataframe(df_rel_display, use_container_width=True, hide_index=True)
+                    exibir_tabela(df_rel, moeda=['VALOR', 'VALOR_CHEIO'], percentual=['PCT_BOLSA'])
                     
-                    excel_data = df_to_excel(df_rel)
-                    st.download_button("⬇️ BAIXAR RELATÓRIO DP", excel_data, f"BOLSAS_{mes}_{ano}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", type="primary", use_container_width=True)
+                    botao_exportar(
+                        "⬇️ BAIXAR RELATÓRIO DP", lambda: {f"{mes} {ano}": df_rel}, f"BOLSAS_{mes}_{ano}.xlsx",
+                        chave=(mes_num, ano), versao=versao_dados('pagamentos', 'bolsistas'),
+                        moeda=['VALOR', 'VALOR_CHEIO'], percentual=['PCT_BOLSA'], key="exp_relatorio_dp",
+                        type="primary", use_container_width=True
+                    )
                 else:
                     st.warning("Faça a conferência primeiro.")
+            
+            with tab4:
+                # Aprovados na Conferência x folha importada (BASE.PAGAMENTOS), por safra
+                render_conciliacao(get_safra(ano, mes_num))
     
     # =============================================
     # PERFIL DO COLABORADOR
@@ -2659,22 +5486,25 @@ def main():
         
         conn = get_conn()
         
-        # Buscar lista de colaboradores para seleção
-        df_users = pd.read_sql_query("SELECT id, matricula, nome, diretoria, curso, instituicao, valor_reembolso, situacao, observacao FROM bolsistas ORDER BY nome", conn)
+        # Busca enquanto digita: só as primeiras sugestões saem do banco, nunca a lista inteira
+        col_search, col_sel = st.columns([1, 1])
+        with col_search:
+            busca_perfil = st.text_input("🔍 Buscar Colaborador:", placeholder="Nome ou matrícula...", key="busca_perfil", help=AJUDA_BUSCA)
+        sugestoes = dict(sugestoes_bolsistas_sessao(busca_perfil))
         
-        if len(df_users) > 0:
-            # Dropdown de busca
-            col_search, _ = st.columns([1, 1])
-            with col_search:
-                # Mapa de nomes para otimizar busca (Nome + Matrícula)
-                name_map = dict(zip(df_users['id'], df_users.apply(lambda x: f"{x['nome']} ({x['matricula']})", axis=1)))
-                sel_id = st.selectbox("🔍 Buscar Colaborador:", 
-                                    options=df_users['id'].tolist(), 
-                                    format_func=lambda x: f"{name_map[x]}",
-                                    index=0)
+        if sugestoes:
+            with col_sel:
+                sel_id = st.selectbox("👤 Colaborador:", 
+                                    options=list(sugestoes), 
+                                    format_func=sugestoes.get,
+                                    index=0,
+                                    help=f"Até {LIMITE_SUGESTOES_BOLSISTAS} sugestões; digite mais do nome ou a matrícula para refinar.")
             
             if sel_id:
-                user = df_users[df_users['id'] == sel_id].iloc[0]
+                user = pd.read_sql_query(
+                    "SELECT id, matricula, nome, diretoria, curso, instituicao, valor_reembolso, situacao, observacao FROM bolsistas WHERE id = ?",
+                    conn, params=(int(sel_id),)
+                ).iloc[0]
                 
                 # Calcular cores do badge de status
                 if user['situacao'] in ['ATIVO', 'REGULAR']:
@@ -2691,7 +5521,7 @@ def main():
                     text_color = '#991b1b'
                 
                 # Formatar valor monetário
-                valor_bolsa_fmt = f"R$ {user['valor_reembolso']:,.2f}"
+                valor_bolsa_fmt = format_br_currency(user['valor_reembolso'])
                 
                 # Card Principal de Informações
                 html_perfil = "".join([
@@ -2721,52 +5551,8 @@ def main():
                 tab_hist, tab_info = st.tabs(["💰 Histórico Financeiro", "📝 Informações & Obs"])
                 
                 with tab_hist:
-                    # 1. BUSCAR DADOS DA CONFERÊNCIA ATUAL (Base de Dados)
-                    # Isso garante que o que você está conferindo agora (ex: Janeiro/2026) apareça no perfil
-                    hist_conf = pd.read_sql_query("SELECT p.mes, p.ano, (p.valor * b.porcentagem) as valor, p.status, p.observacao FROM pagamentos p JOIN bolsistas b ON p.bolsista_id = b.id WHERE p.bolsista_id = ?", conn, params=(int(sel_id),))
-                    
-                    # 2. BUSCAR DADOS DO EXCEL (Histórico Consolidado)
-                    hist_excel = pd.DataFrame()
-                    if os.path.exists("VALORES.PAGOS.xlsx"):
-                        try:
-                            df_ex = pd.read_excel("VALORES.PAGOS.xlsx")
-                            df_ex.columns = [str(c).upper().strip() for c in df_ex.columns]
-                            m_clean = str(user['matricula']).strip().split('.')[0]
-                            # Limpeza da matrícula para o match
-                            df_ex['MATRICULA'] = df_ex['MATRICULA'].astype(str).str.split('.').str[0].str.strip()
-                            df_colab = df_ex[df_ex['MATRICULA'] == m_clean].copy()
-                            
-                            if not df_colab.empty:
-                                df_colab['DATA'] = pd.to_datetime(df_colab['DATA'], dayfirst=True, errors='coerce')
-                                hist_excel = pd.DataFrame({
-                                    'mes': df_colab['DATA'].dt.month,
-                                    'ano': df_colab['DATA'].dt.year,
-                                    'valor': df_colab['VALOR'],
-                                    'status': 'PAGO',
-                                    'observacao': 'Relatório Pagos'
-                                })
-                        except:
-                            pass
-                        
-                    # 3. BUSCAR HISTÓRICO LEGADO (Backup do Sistema)
-                    try:
-                        hist_legacy = pd.read_sql_query("SELECT mes, ano, valor, 'PAGO' as status, 'Importado' as observacao FROM historico_pagamentos WHERE matricula = ?", conn, params=(str(user['matricula']),))
-                    except:
-                        hist_legacy = pd.DataFrame()
-                        
-                    # 4. UNIFICAÇÃO COM PRIORIDADE (Conferência > Excel > Legado)
-                    hist = pd.concat([hist_conf, hist_excel, hist_legacy], ignore_index=True)
-                    
-                    # Remover duplicatas de Mês/Ano, mantendo a primeira ocorrência (que é a de maior prioridade)
-                    if not hist.empty:
-                        # Criar uma chave temporária para drop_duplicates
-                        hist['temp_key'] = hist.apply(lambda x: f"{int(x['mes'])}/{int(x['ano'])}", axis=1)
-                        hist = hist.drop_duplicates(subset=['temp_key'], keep='first').drop(columns=['temp_key'])
-                        
-                        # Ordenar por Ano/Mês (mais recente primeiro)
-                        hist = hist.sort_values(by=['ano', 'mes'], ascending=False)
-                    else:
-                        hist = pd.DataFrame(columns=['mes', 'ano', 'valor', 'status', 'observacao'])
+                    # Conferência, Excel e legado já unificados por competência (view extrato_bolsistas)
+                    hist = carregar_extrato_bolsista(user['matricula'])
                     
                     # Calcular métricas
                     if len(hist) > 0:
@@ -2782,11 +5568,11 @@ def main():
                         f'<div style="display: grid; grid-template-columns: repeat(3, 1fr); gap: 15px; margin-bottom: 20px;">',
                         f'<div style="background: #eff6ff; padding: 15px; border-radius: 10px; border: 1px solid #bfdbfe; text-align: center;">',
                         f'<span style="color: #64748b; font-size: 0.9rem;">Total Pago</span><br>',
-                        f'<strong style="color: #2563eb; font-size: 1.4rem;">R$ {total_pago:,.2f}</strong>',
+                        f'<strong style="color: #2563eb; font-size: 1.4rem;">{format_br_currency(total_pago)}</strong>',
                         f'</div>',
                         f'<div style="background: #fff7ed; padding: 15px; border-radius: 10px; border: 1px solid #fed7aa; text-align: center;">',
                         f'<span style="color: #64748b; font-size: 0.9rem;">Pendente</span><br>',
-                        f'<strong style="color: #ea580c; font-size: 1.4rem;">R$ {pendente:,.2f}</strong>',
+                        f'<strong style="color: #ea580c; font-size: 1.4rem;">{format_br_currency(pendente)}</strong>',
                         f'</div>',
                         f'<div style="background: #f8fafc; padding: 15px; border-radius: 10px; border: 1px solid #e2e8f0; text-align: center;">',
                         f'<span style="color: #64748b; font-size: 0.9rem;">Último Pagamento</span><br>',
@@ -2802,9 +5588,8 @@ def main():
                             st.markdown("##### 📈 Evolução dos Pagamentos")
                             df_chart = hist[hist['status']=='PAGO'].copy()
                             # Criar data para ordenação correta no gráfico
-                            df_chart['Data'] = df_chart.apply(lambda x: pd.Timestamp(year=x['ano'], month=x['mes'], day=1), axis=1)
-                            df_chart = df_chart.sort_values('Data')
-                            df_chart['Mês/Ano'] = df_chart.apply(lambda x: f"{x['mes']:02d}/{str(x['ano'])[2:]}", axis=1)
+                            df_chart = df_chart.sort_values(['ano', 'mes'])
+                            df_chart['Mês/Ano'] = df_chart['mes'].astype(str).str.zfill(2) + "/" + df_chart['ano'].astype(str).str[2:]
                             
                             fig = px.bar(df_chart, x='Mês/Ano', y='valor', text_auto='.2s', color_discrete_sequence=['#3b82f6'])
                             fig.update_layout(
@@ -2821,13 +5606,8 @@ def main():
                         with c_table:
                             st.markdown("##### 🧾 Histórico Detalhado")
                             hist_display = hist.copy()
-                            hist_display['Competência'] = hist_display.apply(lambda x: f"{MESES[x['mes']-1]}/{x['ano']}", axis=1)
-                            # Traduzir nomes de fontes para ficar mais amigável
-                            font_map = {
-                                'Relatório Pagos': '📁 Excel',
-                                'Importado': '📦 Legado',
-                            }
-                            hist_display['Fonte'] = hist_display['observacao'].apply(lambda x: font_map.get(x, '✅ Conferência'))
+                            hist_display['Competência'] = hist_display['mes'].map(dict(enumerate(MESES, start=1))).astype(str) + "/" + hist_display['ano'].astype(str)
+                            hist_display['Fonte'] = hist_display['fonte'].map(ROTULOS_FONTE_EXTRATO)
                             
                             hist_display = hist_display[['Competência', 'valor', 'status', 'Fonte']].rename(columns={
                                 'valor': 'Valor', 'status': 'Status'
@@ -2871,14 +5651,9 @@ def main():
                     
                     # Layout: Coluna da esquerda (Histórico) e form abaixo
                     
-                    # Buscar observações registradas
-                    try:
-                        obs_hist = pd.read_sql_query("SELECT id, data, texto, nome_anexo, anexo_blob FROM observacoes WHERE bolsista_id = ? ORDER BY data DESC", conn, params=(int(sel_id),))
-                    except:
-                        try:
-                            obs_hist = pd.read_sql_query("SELECT data, texto FROM observacoes WHERE bolsista_id = ? ORDER BY data DESC", conn, params=(int(sel_id),))
-                        except:
-                            obs_hist = pd.DataFrame()
+                    # Páginas do diário (só metadados); os anexos são lidos do banco sob demanda
+                    chave_paginas = f"obs_paginas_{sel_id}"
+                    obs_hist, ha_mais = carregar_observacoes(sel_id, st.session_state.get(chave_paginas, 1))
 
                     # Migrar observação antiga se existir e não tiver no histórico novo (apenas visualização inicial)
                     if obs_hist.empty and user['observacao']:
@@ -2893,38 +5668,21 @@ def main():
                     
                     # Exibir histórico Estilo Timeline
                     if not obs_hist.empty:
+                        datas = pd.to_datetime(obs_hist['data'], errors='coerce', format='mixed')
+                        obs_hist['data_fmt'] = datas.dt.strftime("%d/%m/%Y às %H:%M").fillna(obs_hist['data'].astype(str))
                         st.markdown('<div style="max-height: 500px; overflow-y: auto; padding-right: 10px;">', unsafe_allow_html=True)
-                        for idx, row in obs_hist.iterrows():
-                            # Converter string de data
-                            try:
-                                data_obj = pd.to_datetime(row['data'])
-                                data_fmt = data_obj.strftime("%d/%m/%Y às %H:%M")
-                            except:
-                                data_fmt = str(row['data'])
-                            
+                        for row in obs_hist.to_dict('records'):
                             st.markdown("".join([
                                 f'<div style="background: #f8fafc; border-left: 4px solid #3b82f6; padding: 15px; border-radius: 4px; margin-bottom: 15px;">',
                                 f'<div style="display: flex; justify-content: space-between;">',
-                                f'<div style="font-size: 0.8rem; color: #64748b; margin-bottom: 5px;">📅 {data_fmt}</div>',
+                                f'<div style="font-size: 0.8rem; color: #64748b; margin-bottom: 5px;">📅 {row["data_fmt"]}</div>',
                                 f'</div>',
                                 f'<div style="color: #334155; white-space: pre-wrap; font-size: 0.95rem;">{row["texto"]}</div>'
                             ]), unsafe_allow_html=True)
                             
                             # Mostrar anexo se houver
-                            if 'anexo_blob' in row and row['anexo_blob']:
-                                try:
-                                    if isinstance(row['nome_anexo'], str) and row['nome_anexo'].lower().endswith(('.png', '.jpg', '.jpeg')):
-                                        with st.expander(f"🖼️ Ver Imagem: {row['nome_anexo']}", expanded=False):
-                                            st.image(row['anexo_blob'], width=400)
-                                    else:
-                                        st.download_button(
-                                            label=f"📎 Baixar Anexo ({row['nome_anexo']})",
-                                            data=row['anexo_blob'],
-                                            file_name=row['nome_anexo'] or "anexo",
-                                            key=f"dl_{row['id']}"
-                                        )
-                                except:
-                                    st.error("Erro ao exibir anexo")
+                            if row['tamanho_anexo']:
+                                render_anexo_observacao(row)
                             
                             st.markdown("</div>", unsafe_allow_html=True)
                             
@@ -2940,6 +5698,9 @@ def main():
                                     st.rerun()
                                     
                         st.markdown('</div>', unsafe_allow_html=True)
+                        if ha_mais and st.button("⬇️ Carregar mais", key=f"mais_obs_{sel_id}"):
+                            st.session_state[chave_paginas] = st.session_state.get(chave_paginas, 1) + 1
+                            st.rerun()
                     else:
                         st.info("Nenhuma anotação registrada ainda.")
                         
@@ -2961,15 +5722,18 @@ def main():
                         if submit and novo_texto:
                             blob_data = None
                             filename = None
+                            miniatura = None
                             if uploaded_file is not None:
                                 blob_data = uploaded_file.read()
                                 filename = uploaded_file.name
+                                if eh_imagem(filename):
+                                    miniatura = gerar_miniatura(blob_data)
                             
                             # Usar data selecionada + hora atual para ordenação correta
                             data_final = datetime.combine(data_registro, datetime.now().time())
                             
                             c_obs = get_conn()
-                            c_obs.execute("INSERT INTO observacoes (bolsista_id, texto, data, anexo_blob, nome_anexo) VALUES (?, ?, ?, ?, ?)", (int(sel_id), novo_texto, data_final, blob_data, filename))
+                            c_obs.execute("INSERT INTO observacoes (bolsista_id, texto, data, anexo_blob, nome_anexo, miniatura) VALUES (?, ?, ?, ?, ?, ?)", (int(sel_id), novo_texto, data_final, blob_data, filename, miniatura))
                             
                             # Atualizar 'observacao' apenas com texto para compatibilidade
                             c_obs.execute("UPDATE bolsistas SET observacao = ? WHERE id = ?", (novo_texto, int(sel_id)))
@@ -2980,6 +5744,8 @@ def main():
                             st.rerun()
 
         
+        elif busca_perfil:
+            st.warning("Nenhum colaborador encontrado para a busca.")
         else:
             st.warning("Nenhum colaborador cadastrado ainda.")
             
@@ -3045,7 +5811,7 @@ def main():
                     # Filtro por situação
                     situacao_filtro = st.selectbox("📋 Situação", ["Todas", "REGULAR", "IRREGULAR", "CONCLUIDO", "CANCELADO", "DESISTENCIA", "TRANCADO"])
                 with col4:
-                    search_term = st.text_input("🔍 Buscar", placeholder="Nome ou Matrícula...")
+                    search_term = st.text_input("🔍 Buscar", placeholder="Nome ou Matrícula...", help=AJUDA_BUSCA)
                 
                 # Preparar base de bolsistas
                 df_base = df_bolsistas.copy()
@@ -3099,12 +5865,7 @@ def main():
                 if situacao_filtro != "Todas":
                     df_base = df_base[df_base['SITUACAO'] == situacao_filtro]
                 
-                if search_term:
-                    t = search_term.lower()
-                    df_base = df_base[
-                        df_base['NOME'].astype(str).str.lower().str.contains(t, na=False) | 
-                        df_base['MATRICULA'].astype(str).str.contains(t, na=False)
-                    ]
+                df_base = filtrar_por_busca(df_base, search_term, 'MATRICULA')
                 
                 # Processar pagamentos se existirem
                 if len(df_pagos) > 0:
@@ -3171,21 +5932,16 @@ def main():
                         total = df_display[cols_meses].sum().sum()
                     else:
                         total = 0
-                    st.metric("💰 Total Pago", f"R$ {total:,.2f}")
+                    st.metric("💰 Total Pago", format_br_currency(total))
                 with col3:
                     # Média por colaborador
                     media = total / len(df_display) if len(df_display) > 0 else 0
-                    st.metric("📊 Média/Colaborador", f"R$ {media:,.2f}")
+                    st.metric("📊 Média/Colaborador", format_br_currency(media))
                 
                 st.markdown("---")
                 
                 # Exibir tabela
-                st.dataframe(
-                    df_display,
-                    use_container_width=True,
-                    height=500,
-                    hide_index=True
-                )
+                exibir_tabela(df_display, moeda=[c for c in df_display.columns if '/' in str(c)], traco=True, height=500)
                 
                 # Botões de download
                 st.markdown("### 📥 Download para Envio por E-mail")
@@ -3193,14 +5949,14 @@ def main():
                 col_btn1, col_btn2 = st.columns(2)
                 with col_btn1:
                     # Download Excel completo
-                    excel_data = df_to_excel(df_display)
-                    st.download_button(
+                    botao_exportar(
                         "📥 Baixar Relatório Completo (Excel)",
-                        excel_data,
+                        lambda: {'Histórico': df_display},
                         f"historico_pagamentos_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True,
-                        type="primary"
+                        chave=('historico_completo', periodo, diretoria_filtro, situacao_filtro, search_term),
+                        versao=lambda: _assinatura_dataframe(df_display),
+                        moeda=[c for c in df_display.columns if '/' in str(c)],
+                        key="exp_historico_completo", use_container_width=True, type="primary"
                     )
                 
                 with col_btn2:
@@ -3231,20 +5987,19 @@ def main():
                     st.markdown(f"**{len(df_gestor)} colaboradores** sob responsabilidade")
                     
                     # Mostrar tabela do gestor
-                    st.dataframe(df_gestor, use_container_width=True, height=300, hide_index=True)
+                    exibir_tabela(df_gestor, moeda=[c for c in df_gestor.columns if '/' in str(c)], traco=True, height=300)
                     
                     # Botão de download do relatório do gestor
-                    excel_gestor = df_to_excel(df_gestor)
                     nome_arquivo = f"relatorio_{gestor_selecionado.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.xlsx" if gestor_selecionado != "Todos" else f"relatorio_todos_{datetime.now().strftime('%Y%m%d')}.xlsx"
                     
-                    st.download_button(
+                    botao_exportar(
                         f"📥 Baixar Relatório para {gestor_selecionado}",
-                        excel_gestor,
+                        lambda: {'Relatório': df_gestor},
                         nome_arquivo,
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True,
-                        type="primary",
-                        key="download_gestor"
+                        chave=('gestor', gestor_selecionado, periodo, diretoria_filtro, situacao_filtro, search_term),
+                        versao=lambda: _assinatura_dataframe(df_gestor),
+                        moeda=[c for c in df_gestor.columns if '/' in str(c)],
+                        key="download_gestor", use_container_width=True, type="primary"
                     )
                 
                 # Estatísticas por Gestor
@@ -3261,14 +6016,13 @@ def main():
                         st.dataframe(resumo_gestor, use_container_width=True, hide_index=True)
                         
                         # Download do resumo
-                        excel_resumo = df_to_excel(resumo_gestor)
-                        st.download_button(
+                        botao_exportar(
                             "📥 Baixar Resumo por Gestor",
-                            excel_resumo,
+                            lambda: {'Resumo': resumo_gestor},
                             f"resumo_gestores_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            use_container_width=True,
-                            key="download_resumo_gestor"
+                            chave=('resumo_gestores', periodo, diretoria_filtro, situacao_filtro, search_term),
+                            versao=lambda: _assinatura_dataframe(resumo_gestor),
+                            key="download_resumo_gestor", use_container_width=True
                         )
             else:
                 st.warning("⚠️ Arquivo BASES.BOLSAS/BASE.PAGAMENTOS.xlsx não encontrado ou vazio.")
@@ -3285,75 +6039,18 @@ def main():
         with col_p:
             st.markdown("### 💳 Histórico de Pagamentos")
         with col_btn_p:
-            if st.button("🔄 Atualizar Pagamentos", type="primary", use_container_width=True, help="Atualiza o histórico usando o arquivo: BASES.BOLSAS/BASE.PAGAMENTOS.xlsx", key="btn_update_pag"):
-                try:
-                    import glob
-                    import shutil
-
-                    
-                    with st.spinner("Lendo arquivo de pagamentos..."):
-                        # Tenta nome específico primeiro
-                        arquivo_pag = "BASES.BOLSAS/BASE.PAGAMENTOS.xlsx"
-                        
-                        # Se não existir exato, tenta achar por padrão
-                        if not os.path.exists(arquivo_pag):
-                            procura = glob.glob("BASES.BOLSAS/BASE.PAGAMENTOS*.xlsx")
-                            if procura:
-                                arquivo_pag = procura[0]
-                            else:
-                                arquivo_pag = None
-                        
-                        if arquivo_pag and os.path.exists(arquivo_pag):
-                            # Mostrar timestamp do arquivo
-                            mod_time = os.path.getmtime(arquivo_pag)
-                            dt_mod = datetime.fromtimestamp(mod_time).strftime('%d/%m/%Y %H:%M:%S')
-                            st.info(f"📁 Processando: `{arquivo_pag}`\n\n🕒 Última modificação do arquivo: **{dt_mod}**")
-                            
-                            # Limpar cache do Streamlit para garantir
-                            st.cache_data.clear()
-                            
-                            # Copiar para temp para evitar erro de arquivo aberto
-                            temp_pag = "temp_pagamentos_sync.xlsx"
-                            try:
-                                shutil.copy2(arquivo_pag, temp_pag)
-                                
-                                # Leitura inteligente de Abas (PAGAMENTOS > Sheet1)
-                                xl_file = pd.ExcelFile(temp_pag)
-                                sheet_name = 0
-                                if 'PAGAMENTOS' in [s.upper() for s in xl_file.sheet_names]:
-                                    for s in xl_file.sheet_names:
-                                        if s.upper() == 'PAGAMENTOS':
-                                            sheet_name = s
-                                            break
-                                            
-                                st.info(f"📄 Lendo aba: `{sheet_name}`")
-                                df_hist = pd.read_excel(temp_pag, sheet_name=sheet_name)
-                                
-                                processar_importacao_historico(df_hist, datetime.now().year)
-                            except PermissionError:
-                                st.error(f"⚠️ O arquivo `{arquivo_pag}` parece estar aberto. Feche-o e tente novamente.")
-                            except Exception as e:
-                                st.error(f"Erro ao ler arquivo: {e}")
-                            finally:
-                                # Sempre remover arquivo temporário
-                                if os.path.exists(temp_pag):
-                                    try:
-                                        os.remove(temp_pag)
-                                    except:
-                                        pass
-                        else:
-                            st.warning("⚠️ Arquivo 'BASE.PAGAMENTOS.xlsx' não encontrado na pasta BASES.BOLSAS.")
-                            
-                        # Atualiza também a base cadastral para garantir integridade (mas sem estardalhaço)
-                        if os.path.exists("BASES.BOLSAS/BASE.BOLSAS.2025.xlsx"):
-                            df_base = pd.read_excel("BASES.BOLSAS/BASE.BOLSAS.2025.xlsx")
-                            # processar_importacao_df -> comentado para não poluir, ou chamamos silenciosamente?
-                            # Melhor focar no que o usuário pediu: Pagamentos.
-                            
-                    st.balloons()
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Erro ao sincronizar: {e}")
+            todos_arquivos = st.checkbox(
+                "Todas as planilhas e abas", value=True, key="pag_todos_arquivos",
+                help="Lê em paralelo todas as BASE.PAGAMENTOS*.xlsx e VALORES.PAGOS*.xlsx, ignorando linhas repetidas entre arquivos. "
+                     "Desmarcado: só a BASE.PAGAMENTOS, em blocos (para planilhas muito grandes); "
+                     "substitui só os meses que ela cobre, e as linhas da VALORES.PAGOS são mantidas."
+            )
+            if st.button("🔄 Atualizar Pagamentos", type="primary", use_container_width=True, help="Atualiza o histórico a partir das planilhas de pagamentos em BASES.BOLSAS", key="btn_update_pag"):
+                iniciar_job("Atualização dos pagamentos", 'historico_pagamentos',
+                            sincronizar_historico_todos if todos_arquivos else sincronizar_historico_arquivo)
+        
+        # Andamento/resultado da atualização em segundo plano
+        render_status_job('historico_pagamentos')
         
         # ABAS PRINCIPAIS PARA ORGANIZAÇÃO
         tab_consulta, tab_dashboard, tab_ranking = st.tabs([
@@ -3390,7 +6087,7 @@ def main():
             with col2:
                 mes_filter = st.selectbox("Mês:", ["Todos"] + MESES, key="mes_consulta")
             with col3:
-                busca_pag = st.text_input("🔍 Buscar:", placeholder="Matrícula ou nome...", key="busca_consulta")
+                busca_pag = st.text_input("🔍 Buscar:", placeholder="Matrícula ou nome...", key="busca_consulta", help=AJUDA_BUSCA)
             
             # Buscar histórico
             conn = get_conn()
@@ -3405,12 +6102,13 @@ def main():
                 query += " AND mes = ?"
                 params.append(mes_num)
             if busca_pag:
-                query += " AND (matricula LIKE ? OR nome LIKE ?)"
-                params.extend([f'%{busca_pag}%', f'%{busca_pag}%'])
+                filtro, params_busca = filtro_busca_sql(busca_pag, 'historico_pagamentos')
+                query += f" AND {filtro}"
+                params.extend(params_busca)
             
             query += " ORDER BY ano DESC, mes DESC, nome"
             
-            df_hist = pd.read_sql_query(query, conn, params=params)
+            df_hist = ler_sql_tipado(query, conn, SCHEMA_HISTORICO_PAGAMENTOS, params=params)
             conn.close()
             
             if len(df_hist) > 0:
@@ -3421,20 +6119,29 @@ def main():
                 with col2:
                     st.metric("Colaboradores", df_hist['matricula'].nunique())
                 with col3:
-                    st.metric("Total Pago", f"R$ {df_hist['valor'].sum():,.2f}")
+                    st.metric("Total Pago", format_br_currency(df_hist['valor'].sum()))
                 
                 st.markdown("---")
                 
                 # Tabela
-                df_show = df_hist[['matricula', 'nome', 'mes_referencia', 'data_pagamento', 'valor']].copy()
-                df_show.columns = ['Matrícula', 'Nome', 'Mês Ref.', 'Data Pagto', 'Valor']
-                df_show['Valor'] = df_show['Valor'].apply(lambda x: f"R$ {x:,.2f}")
-                
-                st.dataframe(df_show, use_container_width=True, hide_index=True, height=500)
+                exibir_tabela(
+                    df_hist,
+                    column_order=['matricula', 'nome', 'mes_referencia', 'data_pagamento', 'valor'],
+                    rotulos={'matricula': 'Matrícula', 'nome': 'Nome', 'mes_referencia': 'Mês Ref.',
+                             'data_pagamento': 'Data Pagto', 'valor': 'Valor'},
+                    moeda=['valor'],
+                    height=500
+                )
                 
-                # Download Excel
-                excel_data = df_to_excel(df_hist)
-                st.download_button("⬇️ Baixar Histórico", excel_data, "historico_pagamentos.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="download_consulta")
+                # Download gerado só no clique, direto do cursor em blocos (Excel, CSV ou Parquet)
+                botao_exportar(
+                    "⬇️ Baixar Histórico",
+                    lambda: {'Histórico': ler_sql_em_blocos(query, params, SCHEMA_HISTORICO_PAGAMENTOS)},
+                    "historico_pagamentos.xlsx",
+                    chave=(query, tuple(params)), versao=versao_dados('historico_pagamentos'),
+                    moeda=['valor'], formatos=("Excel", "CSV (pt-BR)", "CSV (padrão)", "Parquet"),
+                    key="download_consulta"
+                )
             else:
                 st.info("Nenhum pagamento encontrado com os filtros selecionados.")
         
@@ -3447,15 +6154,11 @@ def main():
             # =============================================
             st.markdown("#### Evolução dos Pagamentos")
         
-            # Buscar TODOS os pagamentos para a linha do tempo (incluindo cod_local e diretoria do histórico)
-            conn = get_conn()
-            df_timeline = pd.read_sql_query("SELECT mes, ano, mes_referencia, matricula, nome, valor, data_pagamento, cod_local, diretoria FROM historico_pagamentos ORDER BY ano, mes", conn)
-            conn.close()
+            # Buscar TODOS os pagamentos para a linha do tempo (incluindo cod_local, diretoria e safra)
+            # A linha do tempo é compartilhada entre as sessões: dez usuários no fechamento = uma cópia
+            df_timeline = carregar_timeline_pagamentos()
             
             if len(df_timeline) > 0:
-                # Adicionar coluna de safra
-                df_timeline['safra'] = df_timeline.apply(lambda row: get_safra(row['ano'], row['mes']), axis=1)
-                
                 # FILTROS DINÂMICOS
                 anos_disponiveis = sorted(df_timeline['ano'].unique().tolist(), reverse=True)
                 safras_disponiveis = get_safras_disponiveis(df_timeline)
@@ -3490,8 +6193,8 @@ def main():
                     else:
                         filtro_mes = "Todos"
             
-                # Aplicar filtro
-                df_filtered = df_timeline.copy()
+                # Aplicar filtro (a visão do cache é somente leitura; filtros geram novos frames)
+                df_filtered = df_timeline
             
                 if tipo_filtro == "📅 Ano":
                     if filtro_periodo != "Todos":
@@ -3514,7 +6217,7 @@ def main():
                     return f"{ano_safra}-{mes_ordem:02d}"
             
                 df_filtered['periodo'] = df_filtered.apply(get_periodo_safra, axis=1)
-                df_filtered['periodo_label'] = df_filtered['mes_referencia'] + '/' + df_filtered['ano'].astype(str)
+                df_filtered['periodo_label'] = df_filtered['mes_referencia'].astype(str) + '/' + df_filtered['ano'].astype(str)
             
                 # Agregação por período
                 df_agg = df_filtered.groupby(['ano', 'mes', 'periodo', 'periodo_label']).agg({
@@ -3580,10 +6283,10 @@ def main():
                             df_merged_dir[col] = df_merged_dir[col].astype(str).replace(['N/A', 'NAN', 'NONE', 'nan', ''], None)
                     
                     # 2. Conectar com Organograma para preencher Diretorias via Cod. Local
-                    df_org_dash = carregar_organograma()
+                    df_org_dash, versao_org_dash = carregar_organograma_versionado()
                     if not df_org_dash.empty:
                         # O enriquecer já prioriza o organograma sobre o N/A
-                        df_merged_dir = enriquecer_com_organograma(df_merged_dir, df_org_dash)
+                        df_merged_dir = enriquecer_com_organograma(df_merged_dir, df_org_dash, versao_org_dash)
                     
                     # Garantir que a diretoria seja normalizada antes do agrupamento
                     df_merged_dir['diretoria'] = df_merged_dir['diretoria'].fillna('N/A').astype(str).str.upper().str.strip()
@@ -3614,10 +6317,11 @@ def main():
                     with col_d2:
                         # Gráfico de Pizza ou Tabela? Vamos de Tabela para detalhes
                         st.markdown("##### Detalhes do Período")
-                        df_total_dir_show = df_total_dir.sort_values('valor', ascending=False).copy()
-                        df_total_dir_show.columns = ['Diretoria', 'Valor Total']
-                        df_total_dir_show['Valor Total'] = df_total_dir_show['Valor Total'].apply(lambda x: format_br_currency(x))
-                        st.dataframe(df_total_dir_show, use_container_width=True, hide_index=True)
+                        exibir_tabela(
+                            df_total_dir.sort_values('valor', ascending=False),
+                            rotulos={'diretoria': 'Diretoria', 'valor': 'Valor Total'},
+                            moeda=['valor']
+                        )
 
                     # --- NOVO: Detalhamento de N/A para auxílio ao usuário ---
                     if 'N/A' in df_merged_dir['diretoria'].unique():
@@ -3632,11 +6336,7 @@ def main():
                             df_na_grouped.columns = ['Matrícula', 'Nome', 'Valor Total no Período', 'Código Local']
                             
                             st.write("Estes colaboradores estão sem diretoria mapeada. Verifique se a matrícula existe no cadastro ou se o Código Local está correto no Organograma.")
-                            st.dataframe(
-                                df_na_grouped.style.format({'Valor Total no Período': 'R$ {:,.2f}'}),
-                                use_container_width=True,
-                                hide_index=True
-                            )
+                            exibir_tabela(df_na_grouped, moeda=['Valor Total no Período'])
 
                     st.markdown("---")
                     st.markdown("##### 📊 Orçamento vs Realizado (Acompanhamento)")
@@ -3702,7 +6402,7 @@ def main():
                         
                         df_budget['Diferença'] = df_budget['Limite Orçamentário'] - df_budget['Gasto Atual']
                         df_budget['Status'] = df_budget['Diferença'].apply(lambda x: "✅ No Limite" if x >= 0 else "🚨 Acima do Limite")
-                        df_budget['% do Budget'] = (df_budget['Gasto Atual'] / df_budget['Limite Orçamentário']) * 100
+                        df_budget['% do Budget'] = df_budget['Gasto Atual'] / df_budget['Limite Orçamentário']
                         
                         df_budget_plot = df_budget[df_budget['Meta %'] > 0].copy()
                         
@@ -3715,7 +6415,7 @@ def main():
                                 y=df_budget_plot['Gasto Atual'],
                                 name="Gasto Atual",
                                 marker_color=df_budget_plot['Diferença'].apply(lambda x: '#22c55e' if x >= 0 else '#ef4444'),
-                                text=df_budget_plot['Gasto Atual'].apply(lambda x: format_br_currency(x)),
+                                text=formatar_moeda_br(df_budget_plot['Gasto Atual']),
                                 textposition='auto',
                             ))
                             
@@ -3740,19 +6440,13 @@ def main():
                             st.plotly_chart(fig_budget, use_container_width=True)
                             
                             st.markdown("###### Detalhamento da Meta vs Realizado")
-                            df_tbl_budget = df_budget_plot.copy()
-                            df_tbl_budget['Meta % Tabela'] = df_tbl_budget['Meta %'].apply(lambda x: f"{x*100:.1f}%")
-                            df_tbl_budget['Utilização %'] = df_tbl_budget['% do Budget'].apply(lambda x: f"{x:.1f}%")
-                            
-                            for col in ['Gasto Atual', 'Limite Orçamentário', 'Diferença']:
-                                df_tbl_budget[col] = df_tbl_budget[col].apply(lambda x: format_br_currency(x))
-                            
                             # Reordenar colunas para incluir a Meta da Diretoria
-                            st.dataframe(
-                                df_tbl_budget[['Diretoria', 'Meta % Tabela', 'Gasto Atual', 'Limite Orçamentário', 'Utilização %', 'Status']] \
-                                .rename(columns={'Meta % Tabela': 'Sua Fatia do Budget (%)'}), 
-                                use_container_width=True, 
-                                hide_index=True
+                            exibir_tabela(
+                                df_budget_plot,
+                                column_order=['Diretoria', 'Meta %', 'Gasto Atual', 'Limite Orçamentário', '% do Budget', 'Status'],
+                                rotulos={'Meta %': 'Sua Fatia do Budget (%)', '% do Budget': 'Utilização %'},
+                                moeda=['Gasto Atual', 'Limite Orçamentário'],
+                                percentual=['Meta %', '% do Budget']
                             )
                         else:
                             st.warning("Nenhuma diretoria com meta definida foi encontrada nos dados atuais.")
@@ -3903,7 +6597,8 @@ def main():
                         index='safra',
                         columns='mes',
                         aggfunc=agg_func,
-                        fill_value=0
+                        fill_value=0,
+                        observed=True
                     )
                 
                     # Ordenar colunas conforme ordem da safra (Abr a Mar)
@@ -3918,31 +6613,23 @@ def main():
                     df_pivot.columns = [MESES[m-1][:3] for m in df_pivot.columns]
                     df_pivot['TOTAL'] = df_pivot.sum(axis=1)
                 
-                    # Formatar valores para exibição - FORMATO BRASILEIRO
-                    df_pivot_fmt = df_pivot.copy()
-                    for col in df_pivot_fmt.columns:
-                        if "Valor" in tipo_visao:
-                            df_pivot_fmt[col] = df_pivot_fmt[col].apply(lambda x: format_br_currency(x) if x > 0 else "-")
-                        else:
-                            df_pivot_fmt[col] = df_pivot_fmt[col].apply(lambda x: format_br_number(x) if x > 0 else "-")
-                    
                     # Renomear index para mostrar "Safra"
-                    df_pivot_fmt.index.name = 'Safra'
+                    df_pivot.index.name = 'Safra'
                 
                     # Botão de Download Excel
-                    import io
-                    buffer = io.BytesIO()
-                    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                        df_pivot.to_excel(writer, sheet_name='Resumo')
-                        
-                    st.download_button(
-                        label="📥 Baixar em Excel",
-                        data=buffer,
-                        file_name="resumo_pagamentos_safra.xlsx",
-                        mime="application/vnd.ms-excel"
+                    df_pivot_export = df_pivot.reset_index()
+                    botao_exportar(
+                        "📥 Baixar em Excel", lambda: {'Resumo': df_pivot_export}, "resumo_pagamentos_safra.xlsx",
+                        chave=('resumo_safra', tipo_visao, tipo_filtro, filtro_periodo, filtro_mes),
+                        versao=versao_dados('historico_pagamentos'),
+                        moeda=[c for c in df_pivot.columns] if "Valor" in tipo_visao else (), key="exp_resumo_safra"
                     )
 
-                    st.dataframe(df_pivot_fmt, use_container_width=True)
+                    # Formatação pt-BR aplicada na exibição, mantendo os valores numéricos
+                    if "Valor" in tipo_visao:
+                        exibir_tabela(df_pivot, moeda=list(df_pivot.columns), traco=True, hide_index=False)
+                    else:
+                        exibir_tabela(df_pivot, inteiro=list(df_pivot.columns), traco=True, hide_index=False)
                 
                     # Gráfico Dual Axis (Valor + Quantidade)
                     import plotly.graph_objects as go
@@ -4091,7 +6778,8 @@ def main():
                         index='safra',
                         columns='mes',
                         aggfunc='sum',
-                        fill_value=0
+                        fill_value=0,
+                        observed=True
                     )
                     
                     # Renomear colunas para ordenar corretamente na sequência da safra (Abr a Mar)
@@ -4111,24 +6799,10 @@ def main():
                     df_pivot_safra['Total'] = df_pivot_safra.sum(axis=1)
                     
                     # Adicionar linha de Quantidade de bolsistas por total da safra
-                    df_qtd_safra = df_safra_detalhada.groupby('safra').size()
+                    df_qtd_safra = df_safra_detalhada.groupby('safra', observed=True).size()
                     df_pivot_safra['Quantidade'] = df_qtd_safra
                     
-                    # Formatar valores para exibição - FORMATO BRASILEIRO
-                    df_safra_show = df_pivot_safra.copy()
-                    
-                    for col in df_safra_show.columns:
-                        if col == 'Quantidade':
-                            df_safra_show[col] = df_safra_show[col].apply(lambda x: format_br_number(x) if x > 0 else "-")
-                        else:
-                            df_safra_show[col] = df_safra_show[col].apply(lambda x: format_br_currency(x) if x > 0 else "-")
-
-                    
-                    # Resetar index para mostrar Safra como coluna
-                    df_safra_show = df_safra_show.reset_index()
-                    df_safra_show = df_safra_show.rename(columns={'safra': 'Safra'})
-                    
-                    # Preparar dados numéricos para o gráfico (antes da formatação)
+                    # Dados numéricos para a tabela resumo e o gráfico
                     df_safra_grafico = df_pivot_safra.copy()
                     df_safra_grafico = df_safra_grafico.reset_index()
                     df_safra_grafico['Valor Total'] = df_safra_grafico['Total']
@@ -4140,9 +6814,13 @@ def main():
                     with c_safra_tab:
                          st.markdown("##### Tabela Resumo")
                          # Mostrar apenas Safra, Total e Quantidade
-                         df_resumo_compacto = df_safra_show[['Safra', 'Total', 'Quantidade']].copy()
-                         df_resumo_compacto.columns = ['Safra', 'Valor Total', 'Quantidade']
-                         st.dataframe(df_resumo_compacto, use_container_width=True, hide_index=True)
+                         exibir_tabela(
+                             df_safra_grafico,
+                             column_order=['Safra', 'Total', 'Quantidade'],
+                             rotulos={'Total': 'Valor Total'},
+                             moeda=['Total'],
+                             inteiro=['Quantidade']
+                         )
                          
                     with c_safra_chart:
                         # Gráfico Safra (Dual Axis)
@@ -4204,7 +6882,7 @@ def main():
                     st.markdown("#### Todos os Colaboradores - Ranking por Valor Recebido")
                 
                     # Busca
-                    busca_colab = st.text_input("🔍 Buscar colaborador:", placeholder="Nome ou matrícula...", key="busca_colab_top")
+                    busca_colab = st.text_input("🔍 Buscar colaborador:", placeholder="Nome ou matrícula...", key="busca_colab_top", help=AJUDA_BUSCA)
                 
                     # Todos colaboradores por valor total (usando dados filtrados)
                     df_top = df_filtered.groupby(['matricula', 'nome']).agg({
@@ -4215,20 +6893,16 @@ def main():
                     df_top = df_top.sort_values('Valor Total', ascending=False)
                 
                     # Aplicar busca
-                    if busca_colab:
-                        df_top = df_top[
-                            df_top['Nome'].str.contains(busca_colab, case=False, na=False) |
-                            df_top['Matrícula'].astype(str).str.contains(busca_colab, case=False, na=False)
-                        ]
+                    df_top = filtrar_por_busca(df_top, busca_colab, 'Matrícula', 'historico_pagamentos')
                 
                     # Métricas
                     col1, col2, col3 = st.columns(3)
                     with col1:
                         st.metric("👥 Total Colaboradores", len(df_top))
                     with col2:
-                        st.metric("💰 Valor Total", f"R$ {df_top['Valor Total'].sum():,.2f}")
+                        st.metric("💰 Valor Total", format_br_currency(df_top['Valor Total'].sum()))
                     with col3:
-                        st.metric("📊 Média/Colaborador", f"R$ {df_top['Valor Total'].mean():,.2f}" if len(df_top) > 0 else "R$ 0")
+                        st.metric("📊 Média/Colaborador", format_br_currency(df_top['Valor Total'].mean()) if len(df_top) > 0 else "R$ 0")
                 
                     # Gráfico dos Top 20 (se não houver busca) ou todos da busca
                     df_chart = df_top.head(20) if not busca_colab else df_top
@@ -4262,23 +6936,26 @@ def main():
                 
                     # Tabela completa com todos
                     st.markdown("##### 📋 Lista Completa")
-                    df_top_show = df_top.copy()
-                    df_top_show['Valor Total Fmt'] = df_top_show['Valor Total'].apply(lambda x: f"R$ {x:,.2f}")
-                    df_top_show['Período'] = df_top_show['Primeiro Ano'].astype(str) + ' - ' + df_top_show['Último Ano'].astype(str)
-                    df_top_show['Ranking'] = range(1, len(df_top_show) + 1)
+                    df_top_show = df_top.assign(
+                        **{'Período': df_top['Primeiro Ano'].astype(str) + ' - ' + df_top['Último Ano'].astype(str),
+                           'Ranking': np.arange(1, len(df_top) + 1)}
+                    )
                 
-                    st.dataframe(
-                        df_top_show[['Ranking', 'Matrícula', 'Nome', 'Valor Total Fmt', 'Qtd Pagamentos', 'Período']].rename(
-                            columns={'Valor Total Fmt': 'Valor Total'}
-                        ),
-                        use_container_width=True,
-                        hide_index=True,
+                    exibir_tabela(
+                        df_top_show,
+                        column_order=['Ranking', 'Matrícula', 'Nome', 'Valor Total', 'Qtd Pagamentos', 'Período'],
+                        moeda=['Valor Total'],
+                        inteiro=['Qtd Pagamentos'],
                         height=600
                     )
                 
                     # Download Excel
-                    excel_top = df_to_excel(df_top)
-                    st.download_button("⬇️ Baixar Lista Completa", excel_top, "ranking_colaboradores.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="download_ranking")
+                    botao_exportar(
+                        "⬇️ Baixar Lista Completa", lambda: {'Ranking': df_top}, "ranking_colaboradores.xlsx",
+                        chave=('ranking', tipo_filtro, filtro_periodo, filtro_mes, busca_colab),
+                        versao=versao_dados('historico_pagamentos'),
+                        moeda=['Valor Total'], key="download_ranking"
+                    )
             else:
                 st.info("Nenhum dado de pagamento disponível para gerar a linha do tempo.")
 
@@ -4291,43 +6968,19 @@ def main():
         tab1, tab2 = st.tabs(["📝 Cadastro Manual", "📂 Importar Excel"])
         
         with tab1:
-            # Função para buscar colaborador na base de gestores
-            @st.cache_data(ttl=300)
-            def carregar_base_gestores():
-                """Carrega a base de gestores do Excel"""
+            diretorio = obter_diretorio_colaboradores()
+
+            def usar_colaborador(registro):
+                """Preenche o cadastro com o colaborador escolhido na lista de nomes."""
+                st.session_state.matricula_cadastro = registro['matricula']
+                st.session_state.dados_gestor = registro
+                st.session_state.candidatos_cadastro = []
 
-                # Carregar Gestores do Organograma (Substitui o antigo gestores.xlsx)
-                try:
-                    df_gestores_file = get_dataset("ORGANOGRAMA")
-                    if not df_gestores_file.empty:
-                        df_gestores_file.columns = [str(c).upper().strip() for c in df_gestores_file.columns]
-                        return df_gestores_file
-                except Exception as e:
-                    logger.error(f"Erro ao carregar ORGANOGRAMA para gestores: {e}")
-                return pd.DataFrame()
-            
-            def buscar_colaborador(matricula_busca):
-                """Busca um colaborador na base de gestores pela matricula"""
-                df_gestores = carregar_base_gestores()
-                if df_gestores.empty:
-                    return None
-                
-                # Normalizar matrícula para busca
-                matricula_busca = str(matricula_busca).strip()
-                
-                # Buscar na coluna MATRICULA
-                if 'MATRICULA' in df_gestores.columns:
-                    df_gestores['MATRICULA'] = df_gestores['MATRICULA'].astype(str).str.strip()
-                    resultado = df_gestores[df_gestores['MATRICULA'] == matricula_busca]
-                    if not resultado.empty:
-                        return resultado.iloc[0].to_dict()
-                return None
-            
             # Campo de matrícula FORA do form para permitir busca dinâmica
             st.markdown("#### 🔍 Buscar Colaborador")
             col_mat, col_btn = st.columns([3, 1])
             with col_mat:
-                matricula = st.text_input("Matrícula *", key="matricula_cadastro", placeholder="Digite a matrícula e clique em Buscar")
+                matricula = st.text_input("Matrícula *", key="matricula_cadastro", placeholder="Digite a matrícula (ou o início do nome) e clique em Buscar")
             with col_btn:
                 st.write("")  # Spacer
                 buscar = st.button("🔍 Buscar", type="primary", use_container_width=True)
@@ -4336,15 +6989,26 @@ def main():
             if 'dados_gestor' not in st.session_state:
                 st.session_state.dados_gestor = {}
             
-            # Buscar dados quando clicar no botão
+            # Buscar dados quando clicar no botão (matrícula exata; senão, prefixo do nome)
             if buscar and matricula:
-                colab = buscar_colaborador(matricula)
+                colab = diretorio.buscar(matricula)
+                st.session_state.candidatos_cadastro = [] if colab else diretorio.por_prefixo(matricula)
                 if colab:
                     st.session_state.dados_gestor = colab
-                    st.success(f"✅ Colaborador encontrado: **{colab.get('COLABORADOR', 'N/A')}**")
-                else:
+                    st.success(f"✅ Colaborador encontrado: **{colab.get('nome') or 'N/A'}**")
+                elif not st.session_state.candidatos_cadastro:
                     st.session_state.dados_gestor = {}
                     st.warning("⚠️ Matrícula não encontrada na base de gestores. Preencha manualmente.")
+
+            candidatos = st.session_state.get('candidatos_cadastro', [])
+            if candidatos:
+                st.caption(f"{len(candidatos)} colaborador(es) com nome começando por \"{matricula}\":")
+                for registro in candidatos:
+                    st.button(
+                        f"{registro.get('nome')} · {registro['matricula']}",
+                        key=f"usar_colab_{registro['matricula']}",
+                        on_click=usar_colaborador, args=(registro,)
+                    )
             
             # Pegar dados do session_state
             dados_g = st.session_state.get('dados_gestor', {})
@@ -4357,11 +7021,11 @@ def main():
                 with col1:
                     # Matrícula já preenchida
                     st.text_input("Matrícula", value=matricula, disabled=True, key="mat_display")
-                    nome = st.text_input("Nome *", value=dados_g.get('COLABORADOR', ''))
-                    cpf = st.text_input("CPF", value=dados_g.get('CPF FORMATADO', dados_g.get('CPF', '')))
+                    nome = st.text_input("Nome *", value=dados_g.get('nome') or '')
+                    cpf = st.text_input("CPF", value=dados_g.get('cpf') or '')
                     
                     # Diretoria - tentar pegar do gestor
-                    diretoria_gestor = dados_g.get('DIRETORIA', '')
+                    diretoria_gestor = dados_g.get('diretoria') or ''
                     if diretoria_gestor and diretoria_gestor in DIRETORIAS:
                         idx_dir = DIRETORIAS.index(diretoria_gestor) + 1
                     else:
@@ -4372,7 +7036,7 @@ def main():
                 
                 with col2:
                     # Tentar pegar curso da base gestores se existir
-                    curso_gestor = dados_g.get('BASE BOLSAS.CURSO', '')
+                    curso_gestor = dados_g.get('curso') or ''
                     curso = st.text_input("Curso", value=curso_gestor if curso_gestor else '')
                     instituicao = st.text_input("Instituição")
                     
@@ -4395,7 +7059,7 @@ def main():
                     pct = st.slider("% Bolsa", 0, 100, 50) / 100
                 with c3:
                     valor = mensalidade * pct
-                    st.metric("Reembolso", f"R$ {valor:,.2f}")
+                    st.metric("Reembolso", format_br_currency(valor))
                 
                 obs = st.text_area("Observações")
                 
@@ -4448,13 +7112,14 @@ def main():
                 st.caption(f"Fonte: Google Sheets (Se conectado) ou `BASES.BOLSAS/BASE.BOLSAS.2025.xlsx`")
                 
                 sobrescrever_imp = st.checkbox("Sobrescrever Status/Obs?", value=False, key="check_sobrescrever_imp")
+                previa_imp = st.checkbox("🔍 Prévia antes de gravar", value=True, key="previa_cadastro")
                 
                 if st.button(f"🔄 Sincronizar Agora", type="primary", use_container_width=True):
                     try:
                         df_local = get_dataset("BOLSAS")
                         if not df_local.empty:
                             st.info(f"Dados carregados! {len(df_local)} registros.")
-                            processar_importacao_df(df_local, preserve_status=not sobrescrever_imp)
+                            importar_bolsistas_ui(df_local, "Sincronização da base", preserve_status=not sobrescrever_imp, previa=previa_imp)
                         else:
                             st.error(f"Não foi possível carregar dados da fonte (Sheets ou Local).")
                     except Exception as e:
@@ -4468,10 +7133,14 @@ def main():
                          try:
                              df_up = pd.read_excel(uploaded_file)
                              if df_up is not None:
-                                 processar_importacao_df(df_up, preserve_status=not sobrescrever_imp)
+                                 importar_bolsistas_ui(df_up, "Importação do upload", preserve_status=not sobrescrever_imp, previa=previa_imp)
                          except Exception as e:
                              st.error(f"Erro ao ler upload: {e}")
 
+            # Andamento/resultado das importações em segundo plano
+            render_status_job('bolsistas')
+            render_previa_bolsistas("previa_cadastro")
+
     # =============================================
     # RODAPÉ DISCRETO COM AÇÕES DO SISTEMA
     # =============================================
@@ -4481,12 +7150,23 @@ def main():
         with col_sys1:
             if st.button("🗑️ Limpar Cache", help="Força o sistema a recarregar todos os dados", use_container_width=True, key="btn_limpar_cache_footer"):
                 st.cache_data.clear()
+                obter_cache_compartilhado().invalidar()
+                obter_carregador_fontes().expirar()
                 st.success("Cache limpo com sucesso!")
                 st.rerun()
         with col_sys2:
             if st.button("🔄 Atualizar Dados", help="Reprocessa o cruzamento com o Organograma", use_container_width=True, key="btn_atualizar_footer"):
                 st.cache_data.clear()
+                obter_cache_compartilhado().invalidar()
+                obter_carregador_fontes().expirar()
                 st.rerun()
+        with col_sys_spacer:
+            cache_stats = obter_cache_compartilhado().estatisticas()
+            st.caption(
+                f"🧠 Cache compartilhado: {cache_stats['itens']} itens | "
+                f"{cache_stats['mb_usados']:.1f} de {cache_stats['mb_orcamento']:.0f} MB | "
+                f"acertos {cache_stats['acertos']} / faltas {cache_stats['faltas']}"
+            )
 
 if __name__ == "__main__":
     main()
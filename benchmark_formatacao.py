@@ -0,0 +1,77 @@
+import time
+import numpy as np
+import pandas as pd
+
+from app import formatar_moeda_br, formatar_numero_br, parse_moeda_br
+
+# Compara a formatação/leitura vetorizada com as versões antigas elemento a elemento (.apply)
+N_LINHAS = 500_000
+
+
+def format_br_currency_antigo(val):
+    if pd.isna(val) or val == "": return "R$ 0,00"
+    try:
+        val = float(val)
+    except:
+        return "R$ 0,00"
+    return f"R$ {val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def format_br_number_antigo(val):
+    if pd.isna(val) or val == "": return "0"
+    try:
+        val = float(val)
+    except:
+        return str(val)
+    if val == int(val):
+        return f"{int(val):,}".replace(",", ".")
+    return f"{val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def parse_antigo(v):
+    try:
+        return float(str(v).replace('R$', '').replace('.', '').replace(',', '.').strip())
+    except:
+        return np.nan
+
+
+def cronometrar(rotulo, func, repeticoes=3):
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = func()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    print(f"  {rotulo:<28}{melhor:>8.3f}s")
+    return resultado, melhor
+
+
+def comparar(titulo, serie, antigo, novo):
+    print(f"\n{titulo}")
+    r_antigo, t_antigo = cronometrar("antigo (.apply)", lambda: serie.apply(antigo))
+    r_novo, t_novo = cronometrar("vetorizado", lambda: novo(serie))
+    iguais = (r_antigo.astype(str).to_numpy() == r_novo.astype(str).to_numpy()).all()
+    print(f"  ganho: {t_antigo / t_novo:.1f}x | resultados idênticos: {'SIM' if iguais else 'NÃO'}")
+
+
+def main():
+    rng = np.random.default_rng(7)
+    # Mensalidades reais se repetem muito; o caso aleatório é o pior cenário para o vetorizado
+    mensalidades = pd.Series(rng.choice(np.arange(300, 4000, 12.5), N_LINHAS))
+    aleatorios = pd.Series(rng.uniform(0, 1_000_000, N_LINHAS).round(2))
+    contagens = pd.Series(rng.integers(0, 50_000, N_LINHAS)).astype('float64')
+
+    print(f"Benchmark com {N_LINHAS:,} linhas")
+    comparar("Moeda - mensalidades (valores repetidos)", mensalidades, format_br_currency_antigo, formatar_moeda_br)
+    comparar("Moeda - valores aleatórios", aleatorios, format_br_currency_antigo, formatar_moeda_br)
+    comparar("Número - contagens inteiras", contagens, format_br_number_antigo, formatar_numero_br)
+
+    textos = formatar_moeda_br(mensalidades)
+    print("\nLeitura - textos 'R$ 1.234,56'")
+    r_antigo, t_antigo = cronometrar("antigo (.apply)", lambda: textos.apply(parse_antigo))
+    r_novo, t_novo = cronometrar("vetorizado", lambda: parse_moeda_br(textos))
+    iguais = np.allclose(r_antigo.to_numpy(), r_novo.to_numpy())
+    print(f"  ganho: {t_antigo / t_novo:.1f}x | resultados idênticos: {'SIM' if iguais else 'NÃO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+# Servidor local que imita o endpoint /spreadsheets/d/<id>/export?format=csv do Google Sheets.
+# Cada planilha tem um atraso configurável para simular rede lenta/fora do ar.
+ATRASOS = {"ORGANOGRAMA": 0.2, "PAGAMENTOS": 0.5, "BOLSAS": 10.0}
+PRAZO = 2.0
+
+CSV_FALSO = {
+    "ORGANOGRAMA": pd.DataFrame({"Cod. Local": ["1001", "1002"], "Local": ["A", "B"], "Diretoria": ["AGRICOLA", "INDUSTRIAL"]}),
+    "PAGAMENTOS": pd.DataFrame({"MATRICULA": ["1", "2"], "NOMES": ["FULANO", "CICRANO"], "DATA": ["10/01/2025", "10/02/2025"], "VALOR": [500.0, 750.0]}),
+    "BOLSAS": pd.DataFrame({"MATRICULA": ["1"], "NOME": ["FULANO"], "SITUACAO": ["ATIVO"]}),
+}
+
+os.environ["BOLSAS_PRAZO_FONTE"] = str(PRAZO)
+
+import app  # noqa: E402  (lê as variáveis de ambiente na importação)
+
+ID_PARA_FONTE = {re.search(r"/spreadsheets/d/([^/]+)", url).group(1): chave for chave, url in app.GSHEETS_URLS.items()}
+
+
+class PlanilhaFalsa(BaseHTTPRequestHandler):
+    def do_GET(self):
+        m = re.search(r"/spreadsheets/d/([^/]+)/export", self.path)
+        fonte = ID_PARA_FONTE.get(m.group(1)) if m else None
+        if not fonte:
+            self.send_error(404)
+            return
+        time.sleep(ATRASOS[fonte])
+        corpo = CSV_FALSO[fonte].to_csv(index=False).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), PlanilhaFalsa)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    app.GSHEETS_EXPORT_BASE = f"http://127.0.0.1:{servidor.server_port}"
+    print(f"Servidor local em {app.GSHEETS_EXPORT_BASE} | atrasos: {ATRASOS} | prazo por fonte: {PRAZO}s")
+
+    import tempfile
+    carregador = app.CarregadorFontes(pasta_snapshots=tempfile.mkdtemp(prefix="snapshots_"))
+
+    print("\n1) Primeira carga, sem snapshot (BOLSAS estoura o prazo e cai no Excel local):")
+    inicio = time.perf_counter()
+    dados = carregador.carregar(list(app.GSHEETS_URLS), prazo=PRAZO)
+    print(f"   tempo total: {time.perf_counter() - inicio:.2f}s (sequencial seria {sum(min(a, PRAZO) for a in ATRASOS.values()):.2f}s+)")
+    for chave, df in dados.items():
+        print(f"   {chave:<12} {df.shape}")
+
+    print("\n2) Aguardando a busca de BOLSAS terminar em segundo plano...")
+    time.sleep(ATRASOS["BOLSAS"] - PRAZO + 1)
+    inicio = time.perf_counter()
+    dados = carregador.carregar(["BOLSAS"], prazo=PRAZO)
+    print(f"   BOLSAS agora vem da cópia remota: {dados['BOLSAS'].shape} em {time.perf_counter() - inicio:.3f}s")
+
+    print("\n3) Snapshot vencido + 20 leituras concorrentes (deve haver uma única busca em segundo plano):")
+    carregador.expirar()
+    ATRASOS["PAGAMENTOS"] = 3.0
+    resultados = []
+
+    def ler():
+        t0 = time.perf_counter()
+        carregador.carregar(["PAGAMENTOS"], prazo=PRAZO)
+        resultados.append(time.perf_counter() - t0)
+
+    leitores = [threading.Thread(target=ler) for _ in range(20)]
+    for t in leitores:
+        t.start()
+    for t in leitores:
+        t.join()
+    print(f"   leitura mais lenta: {max(resultados):.3f}s | buscas em curso: {sum(1 for i in carregador.estado().values() if i['atualizando'])}")
+    for chave, info in carregador.estado().items():
+        print(f"   {chave:<12} {info['origem']:<14} {app.descrever_idade(info['atualizado_em'])}{' (atualizando)' if info['atualizando'] else ''}")
+
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Planilha BASE.PAGAMENTOS sintética com 1 milhão de linhas, importada em blocos com uma
+# falha simulada no meio e retomada a partir do checkpoint. Roda numa pasta temporária
+# para não tocar no bolsas.db de verdade.
+N_LINHAS = 1_000_000
+FALHAR_NO_BLOCO = 20
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+if len(sys.argv) > 2 and sys.argv[1] == "--gerar":
+    PASTA = os.path.dirname(sys.argv[2])
+else:
+    PASTA = tempfile.mkdtemp(prefix="importacao_")
+    for nome in ("BASES.BOLSAS", "static"):
+        os.symlink(os.path.join(RAIZ, nome), os.path.join(PASTA, nome))
+os.chdir(PASTA)
+sys.path.insert(0, RAIZ)
+
+import app  # noqa: E402  (cria o bolsas.db na pasta temporária)
+
+
+def gerar_planilha(caminho, n):
+    """Escreve a planilha em memória constante (xlsxwriter), no mesmo layout da BASE.PAGAMENTOS."""
+    import xlsxwriter
+
+    rng = np.random.default_rng(35)
+    codigos = app.carregar_organograma().iloc[:, 0].dropna().astype(str).unique()
+    wb = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+    ws = wb.add_worksheet("PAGAMENTOS")
+    fmt_data = wb.add_format({'num_format': 'dd/mm/yyyy'})
+    ws.write_row(0, 0, ["MATRICULA", "NOMES", "DATA", "VALOR", "CODIGO LOCAL"])
+    base = datetime(2019, 1, 1)
+    matriculas = rng.integers(1_000_000, 1_010_000, n)
+    meses = rng.integers(0, 84, n)
+    valores = rng.uniform(200, 3000, n).round(2)
+    locais = rng.integers(0, len(codigos), n)
+    for i in range(n):
+        ws.write_number(i + 1, 0, int(matriculas[i]))
+        ws.write_string(i + 1, 1, f"COLABORADOR {matriculas[i] - 1_000_000:05d}")
+        ws.write_datetime(i + 1, 2, base + timedelta(days=int(meses[i]) * 30), fmt_data)
+        ws.write_number(i + 1, 3, float(valores[i]))
+        ws.write_string(i + 1, 4, codigos[locais[i]])
+    wb.close()
+
+
+def pico_memoria_mb():
+    """Pico de memória residente do processo (Linux/macOS); None onde não há o módulo resource."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 ** 2 if sys.platform == "darwin" else pico / 1024
+
+
+def contar(tabela):
+    conn = sqlite3.connect(app.DB_PATH)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    caminho = os.path.join(PASTA, "BASE.PAGAMENTOS.grande.xlsx")
+    base = pico_memoria_mb()
+    print(f"Gerando planilha com {N_LINHAS:,} linhas em {PASTA} ...")
+    inicio = time.perf_counter()
+    # Em outro processo, para a geração não contar no pico de memória da importação
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--gerar", caminho], check=True)
+    print(f"  {os.path.getsize(caminho) / 1024 ** 2:.1f} MB em {time.perf_counter() - inicio:.1f}s")
+
+    print(f"\n1) Importação com falha simulada no bloco {FALHAR_NO_BLOCO + 1}:")
+
+    def progresso_com_falha(fracao, mensagem):
+        if mensagem.startswith(f"Bloco {FALHAR_NO_BLOCO}:"):
+            raise RuntimeError("falha simulada (queda de energia, arquivo travado...)")
+
+    try:
+        app.importar_historico_arquivo(caminho, "PAGAMENTOS", progresso=progresso_com_falha)
+    except RuntimeError as e:
+        print(f"  interrompida: {e}")
+    conn = sqlite3.connect(app.DB_PATH)
+    checkpoint = conn.execute("SELECT blocos_gravados, linhas_gravadas FROM importacoes_checkpoint").fetchone()
+    conn.close()
+    print(f"  checkpoint: {checkpoint[0]} blocos / {checkpoint[1]:,} linhas na área de preparação")
+    print(f"  historico_pagamentos intocado: {contar('historico_pagamentos'):,} linhas")
+
+    print("\n2) Retomando:")
+    inicio = time.perf_counter()
+    resultado = app.importar_historico_arquivo(caminho, "PAGAMENTOS")
+    tempo = time.perf_counter() - inicio
+    print(f"  retomado do bloco {resultado['retomado_do_bloco']} | {resultado['registros']:,} registros em {tempo:.1f}s")
+    pico = pico_memoria_mb()
+    if pico is not None:
+        print(f"  pico de memória do processo: {pico:.0f} MB para uma planilha de "
+              f"{os.path.getsize(caminho) / 1024 ** 2:.0f} MB (bloco de {app.LINHAS_POR_BLOCO_IMPORTACAO:,} linhas; "
+              f"{base:.0f} MB já ocupados só com pandas/streamlit carregados)")
+    total = contar('historico_pagamentos')
+    print(f"  historico_pagamentos: {total:,} linhas | área de preparação: {contar('historico_pagamentos_carga')} | "
+          f"{'OK' if total == N_LINHAS else 'DIVERGENTE'}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--gerar":
+        gerar_planilha(sys.argv[2], N_LINHAS)
+    else:
+        main()
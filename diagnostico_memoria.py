@@ -0,0 +1,63 @@
+import time
+import numpy as np
+import pandas as pd
+
+from app import SCHEMA_HISTORICO_PAGAMENTOS, aplicar_schema
+
+# Histórico sintético com a mesma forma que o read_sql devolve (tudo object/int64/float64)
+N_LINHAS = 500_000
+MESES = ['JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
+         'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO']
+DIRETORIAS = ['AGRICOLA', 'INDUSTRIAL', 'ADMINISTRATIVA', 'COMERCIAL', 'FINANCEIRA', 'RH', 'TI', 'N/A']
+
+
+def gerar_historico(n):
+    rng = np.random.default_rng(42)
+    n_colab = 3000
+    matriculas = np.array([str(100000 + i) for i in range(n_colab)], dtype=object)
+    nomes = np.array([f"COLABORADOR {i:04d}" for i in range(n_colab)], dtype=object)
+    locais = np.array([str(1000 + i) for i in range(400)], dtype=object)
+    idx = rng.integers(0, n_colab, n)
+    mes = rng.integers(1, 13, n)
+    ano = rng.integers(2020, 2027, n)
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1, dtype='int64'),
+        'matricula': matriculas[idx],
+        'nome': nomes[idx],
+        'mes': mes.astype('int64'),
+        'ano': ano.astype('int64'),
+        'mes_referencia': np.array(MESES, dtype=object)[mes - 1],
+        'valor': rng.uniform(200, 3000, n).round(2),
+        'data_pagamento': [f"{a}-{m:02d}-10" for a, m in zip(ano, mes)],
+        'cod_local': locais[idx % len(locais)],
+        'diretoria': np.array(DIRETORIAS, dtype=object)[idx % len(DIRETORIAS)],
+    }).astype({c: object for c in ['matricula', 'nome', 'mes_referencia', 'data_pagamento', 'cod_local', 'diretoria']})
+
+
+def mb(serie):
+    return serie.memory_usage(index=False, deep=True) / 1024 ** 2
+
+
+def main():
+    print(f"Gerando histórico sintético com {N_LINHAS:,} linhas...")
+    df_bruto = gerar_historico(N_LINHAS)
+
+    inicio = time.perf_counter()
+    df_tipado = aplicar_schema(df_bruto.copy(), SCHEMA_HISTORICO_PAGAMENTOS)
+    tempo = time.perf_counter() - inicio
+
+    print(f"\n{'COLUNA':<16}{'DTYPE ANTES':<14}{'MB ANTES':>10}   {'DTYPE DEPOIS':<16}{'MB DEPOIS':>10}")
+    print("-" * 70)
+    for col in df_bruto.columns:
+        print(f"{col:<16}{str(df_bruto[col].dtype):<14}{mb(df_bruto[col]):>10.2f}   "
+              f"{str(df_tipado[col].dtype):<16}{mb(df_tipado[col]):>10.2f}")
+
+    total_antes = df_bruto.memory_usage(index=True, deep=True).sum() / 1024 ** 2
+    total_depois = df_tipado.memory_usage(index=True, deep=True).sum() / 1024 ** 2
+    print("-" * 70)
+    print(f"TOTAL: {total_antes:.2f} MB -> {total_depois:.2f} MB "
+          f"({100 * (1 - total_depois / total_antes):.1f}% menor) | conversão em {tempo:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
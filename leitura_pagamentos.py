@@ -0,0 +1,78 @@
+"""
+Leitura das planilhas de pagamentos (openpyxl read_only).
+
+Fica fora do app.py porque roda também nos processos do pool de importação:
+não pode importar o Streamlit nem ter efeitos colaterais na importação.
+"""
+import time
+from itertools import islice
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from mapeamento_colunas import MAPEADOR_PAGAMENTOS
+
+LINHAS_POR_BLOCO_IMPORTACAO = 20000
+
+
+def _aba(wb, aba):
+    return wb[aba] if isinstance(aba, str) else wb.worksheets[aba]
+
+
+def ler_excel_em_blocos(caminho, aba=0, tamanho=LINHAS_POR_BLOCO_IMPORTACAO, pular_blocos=0):
+    """
+    Lê uma aba do Excel em blocos de até `tamanho` linhas: gera (índice, DataFrame).
+    Só o bloco atual fica em memória; os `pular_blocos` iniciais são percorridos sem virar DataFrame.
+    """
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = _aba(wb, aba).iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = [str(c).strip() if c is not None else f"COLUNA_{i + 1}" for i, c in enumerate(cabecalho)]
+        indice = 0
+        while True:
+            lote = list(islice(linhas, tamanho))
+            if not lote:
+                break
+            if indice >= pular_blocos:
+                bloco = pd.DataFrame.from_records(lote, columns=colunas, nrows=len(lote))
+                bloco.index = pd.RangeIndex(2 + indice * tamanho, 2 + indice * tamanho + len(lote))  # linha no Excel
+                yield indice, bloco.dropna(how='all')
+            indice += 1
+    finally:
+        wb.close()
+
+
+def contar_linhas_excel(caminho, aba=0):
+    """Total de linhas de dados pela dimensão gravada na aba (None se o arquivo não informar)."""
+    wb = load_workbook(caminho, read_only=True)
+    try:
+        max_row = _aba(wb, aba).max_row
+        return max_row - 1 if max_row else None
+    finally:
+        wb.close()
+
+
+def abas_de_pagamento(caminho):
+    """Abas cuja primeira linha traz colunas de matrícula e de data (ignora tabelas dinâmicas e rascunhos)."""
+    wb = load_workbook(caminho, read_only=True)
+    try:
+        abas = []
+        for ws in wb.worksheets:
+            cabecalho = next(ws.iter_rows(max_row=1, values_only=True), ())
+            ausentes = MAPEADOR_PAGAMENTOS.resolver(c for c in cabecalho if c is not None)['ausentes']
+            if 'data' not in ausentes and 'matricula' not in ausentes:
+                abas.append(ws.title)
+        return abas
+    finally:
+        wb.close()
+
+
+def ler_aba(caminho, aba):
+    """Aba inteira num DataFrame indexado pela linha no Excel, com o tempo gasto na leitura: (DataFrame, segundos)."""
+    inicio = time.perf_counter()
+    blocos = [bloco for _, bloco in ler_excel_em_blocos(caminho, aba)]
+    df = pd.concat(blocos) if blocos else pd.DataFrame()
+    return df, time.perf_counter() - inicio
@@ -0,0 +1,124 @@
+"""
+Cabeçalhos das planilhas -> colunas do banco, para todos os importadores.
+
+Os apelidos de cada esquema são normalizados uma única vez (sem acento, maiúsculo,
+pontuação e espaços uniformes); cada planilha é resolvida com uma consulta por cabeçalho.
+Sem Streamlit: também é usado pelos processos do pool de leitura.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+# Apelidos por coluna do banco, em ordem de prioridade: quando a planilha traz mais de um
+# cabeçalho para a mesma coluna, vale o primeiro da lista e os demais saem como ambíguos.
+ALIASES_BOLSISTAS = {
+    'matricula': ['MATRÍCULA', 'MATRICULA', 'MATR', 'REGISTRO', 'RE', 'ID'],
+    'nome': ['NOME', 'NOMES', 'COLABORADOR', 'FUNCIONARIO', 'BOLSISTA'],
+    'cpf': ['CPF'],
+    'diretoria': ['DIRETORIA', 'AREA', 'DEPARTAMENTO', 'DEPTO'],
+    'cod_local': ['COD. LOCAL', 'CÓDIGO LOCAL', 'CODIGO LOCAL', 'COD_LOCAL', 'CENTRO DE CUSTO', 'CC', 'CR'],
+    'curso': ['CURSO'],
+    'instituicao': ['INSTITUIÇÃO', 'INSTITUIO', 'FACULDADE', 'UNIVERSIDADE'],
+    'tipo': ['TIPO', 'NIVEL'],
+    'modalidade': ['MODALIDADE'],
+    'inicio_curso': ['INÍCIO CURSO', 'INÍCIO DO CURSO', 'DATA INÍCIO', 'INÍCIO'],
+    'fim_curso': ['FIM CURSO', 'FIM DO CURSO', 'TÉRMINO DO CURSO', 'DATA FIM', 'DATA TÉRMINO', 'FIM'],
+    'ano_referencia': ['ANO REFERÊNCIA', 'ANO PROGRAMA', 'SAFRA', 'ANO'],
+    'mensalidade': ['MENSALIDADE', 'VALOR MENSALIDADE', 'MENSALIDADE PREV CONTRATO'],
+    'porcentagem': ['% BOLSA', 'PORCENTAGEM', '%'],
+    'valor_reembolso': ['VALOR REEMBOLSO', 'REEMBOLSO', 'VALOR'],
+    'situacao': ['SITUAÇÃO', 'STATUS'],
+    'checagem': ['CHECAGEM', 'CHECAGEM SITUAÇÃO'],
+}
+
+ALIASES_PAGAMENTOS = {
+    'data': ['DATA', 'PGTO', 'PAGTO', 'MÊS'],
+    'matricula': ['MATRÍCULA', 'ID'],
+    'nome': ['NOMES', 'NOME', 'COLABORADOR'],
+    'valor': ['VALOR', 'VALOR LÍQUIDO', 'LÍQUIDO', 'VLR. LÍQUIDO', 'TOTAL'],
+    'cod_local': ['CÓDIGO LOCAL', 'COD. LOCAL'],
+}
+
+# Colaboradores no organograma (diretório do Cadastrar e preenchimento dos importadores)
+ALIASES_COLABORADORES = {
+    'matricula': ['MATRÍCULA', 'MATRICULA'],
+    'nome': ['COLABORADOR', 'NOME', 'NOMES'],
+    'cpf': ['CPF FORMATADO', 'CPF'],
+    'diretoria': ['DIRETORIA'],
+    'cod_local': ['COD. LOCAL', 'CÓDIGO LOCAL', 'CODIGO LOCAL'],
+    'curso': ['BASE BOLSAS.CURSO', 'CURSO'],
+}
+
+
+def normalizar_cabecalho(nome):
+    """'Cód. Local ' -> 'COD LOCAL'; '%Bolsa' -> '% BOLSA'. None/vazio -> ''."""
+    if nome is None:
+        return ""
+    texto = unicodedata.normalize("NFKD", str(nome))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).upper()
+    texto = texto.replace("%", " % ")
+    texto = re.sub(r"[^\w%]+|_", " ", texto)
+    return " ".join(texto.split())
+
+
+class MapeadorColunas:
+    """Resolve os cabeçalhos de uma planilha para as colunas canônicas de um esquema."""
+
+    def __init__(self, aliases):
+        self.colunas = list(aliases)
+        self._indice = {}  # apelido normalizado -> (coluna canônica, prioridade)
+        for canonica, apelidos in aliases.items():
+            for prioridade, apelido in enumerate(apelidos):
+                chave = normalizar_cabecalho(apelido)
+                anterior = self._indice.get(chave)
+                if anterior and anterior[0] != canonica:
+                    raise ValueError(f"Apelido '{apelido}' aparece em '{anterior[0]}' e em '{canonica}'")
+                self._indice.setdefault(chave, (canonica, prioridade))
+        self._resolver_cache = lru_cache(maxsize=64)(self._resolver)
+
+    def resolver(self, cabecalhos):
+        """
+        {'renomear': {cabeçalho: coluna}, 'nao_mapeadas': [...], 'ambiguas': {coluna: [descartados]},
+        'ausentes': [colunas do esquema sem cabeçalho]}. Planilhas com o mesmo cabeçalho reaproveitam o resultado.
+        """
+        return self._resolver_cache(tuple(cabecalhos))
+
+    def _resolver(self, cabecalhos):
+        candidatos, nao_mapeadas = {}, []
+        for posicao, cabecalho in enumerate(cabecalhos):
+            achado = self._indice.get(normalizar_cabecalho(cabecalho))
+            if achado is None:
+                nao_mapeadas.append(cabecalho)
+            else:
+                candidatos.setdefault(achado[0], []).append((achado[1], posicao, cabecalho))
+        renomear, ambiguas = {}, {}
+        for canonica, opcoes in candidatos.items():
+            opcoes.sort()
+            renomear[opcoes[0][2]] = canonica
+            if len(opcoes) > 1:
+                ambiguas[canonica] = [cabecalho for _, _, cabecalho in opcoes[1:]]
+        return {
+            'renomear': renomear,
+            'nao_mapeadas': nao_mapeadas,
+            'ambiguas': ambiguas,
+            'ausentes': [c for c in self.colunas if c not in candidatos],
+        }
+
+    def aplicar(self, df):
+        """Renomeia o DataFrame de uma vez e mantém só as colunas mapeadas: (DataFrame, relatório)."""
+        relatorio = self.resolver(df.columns)
+        return df[list(relatorio['renomear'])].rename(columns=relatorio['renomear']), relatorio
+
+    def descrever(self, relatorio, contexto=""):
+        """Avisos legíveis sobre cabeçalhos ambíguos (os não mapeados são só ignorados)."""
+        prefixo = f"{contexto}: " if contexto else ""
+        return [
+            f"⚠️ {prefixo}mais de um cabeçalho para '{canonica}'; usado "
+            f"'{next(c for c, k in relatorio['renomear'].items() if k == canonica)}', ignorado(s) {', '.join(map(str, descartados))}."
+            for canonica, descartados in relatorio['ambiguas'].items()
+        ]
+
+
+MAPEADOR_BOLSISTAS = MapeadorColunas(ALIASES_BOLSISTAS)
+MAPEADOR_PAGAMENTOS = MapeadorColunas(ALIASES_PAGAMENTOS)
+MAPEADOR_COLABORADORES = MapeadorColunas(ALIASES_COLABORADORES)